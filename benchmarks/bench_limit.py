@@ -0,0 +1,78 @@
+'''
+Compare the LIMIT rewriter (limit.set_limit) with the former implementation that
+parsed the whole statement with sqlparse, on small and very large statements.
+
+    python -m benchmarks.bench_limit [columns]
+'''
+import sys
+import time
+import sqlparse
+
+from jupyterlab_sql_explorer import limit
+
+
+def sqlparse_set_limit(sql, def_lim=200, max_lim=10000):
+    parsed = sqlparse.parse(sql)
+    if len(parsed) != 1:
+        return False, 'can only process one statement'
+    stmt = parsed[0]
+    if not isinstance(stmt, sqlparse.sql.Statement) or stmt.get_type() != "SELECT":
+        return True, sql
+    out = ''
+    has_limit = False
+    after_limit = False
+    for token in stmt:
+        if has_limit is False:
+            if token.ttype == sqlparse.tokens.Keyword and token.value.upper() == "LIMIT":
+                has_limit = True
+            else:
+                out += str(token)
+        elif after_limit:
+            out += str(token)
+        else:
+            if token.ttype == sqlparse.tokens.Literal.Number.Integer:
+                limit_value = int(token.value)
+                after_limit = True
+    use_lim = def_lim
+    if has_limit:
+        use_lim = limit_value if limit_value <= max_lim else max_lim
+    out += f' LIMIT {use_lim}'
+    return True, out
+
+
+def bench(name, func, sql, repeat=5, number=1):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        try:
+            for _ in range(number):
+                out = func(sql)
+        except Exception as err:
+            print(f'{name:32s} failed: {err}')
+            return None
+        cost = (time.perf_counter() - begin) / number
+        best = cost if best is None else min(best, cost)
+    print(f'{name:32s} {best * 1000:9.3f} ms')
+    return out
+
+
+def main():
+    ncol = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    small = 'select a, b, c from t where a > 1 order by b limit 20'
+    print(f'small statement, {len(small)} bytes')
+    bench('sqlparse', sqlparse_set_limit, small, number=100)
+    bench('limit.set_limit', limit.set_limit.__wrapped__, small, number=100)
+    bench('limit.set_limit (cached)', limit.set_limit, small, number=100)
+
+    # sqlparse refuses statements of more than 10000 tokens
+    for n in (300, ncol):
+        large = 'select ' + ',\n'.join(f"coalesce(c{i}, 'n/a') as c{i}" for i in range(n)) + \
+            '\nfrom t1 join t2 on t1.id = t2.id where t1.x in (select x from t3) limit 50000'
+        print(f'large statement, {n} columns, {len(large) / 1024:.0f} KB')
+        bench('sqlparse', sqlparse_set_limit, large, repeat=1)
+        bench('limit.set_limit', limit.set_limit.__wrapped__, large)
+        bench('limit.set_limit (cached)', limit.set_limit, large)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Compare per-value serialization (make_row_serializable) with the column plan
+(serialize_rows) on result sets with datetime/Decimal/UUID columns.
+
+    python -m benchmarks.bench_serializer [rows]
+'''
+import sys
+import json
+import time
+import uuid
+import decimal
+import datetime
+
+from jupyterlab_sql_explorer.serializer import make_row_serializable, serialize_rows
+
+
+def make_rows(n):
+    t0 = datetime.datetime(2024, 1, 1)
+    return [
+        (i, f'name {i}', i * 0.5, t0 + datetime.timedelta(seconds=i), decimal.Decimal(i) / 100,
+         uuid.UUID(int=i), None if i % 10 else 'x')
+        for i in range(n)
+    ]
+
+
+def bench(name, func, rows, repeat=5):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        out = func(rows)
+        cost = time.perf_counter() - begin
+        best = cost if best is None else min(best, cost)
+    print(f'{name:32s} {best * 1000:9.1f} ms')
+    return out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(n)
+    print(f'{n} rows x {len(rows[0])} columns')
+    old = bench('make_row_serializable', lambda rows: [make_row_serializable(r) for r in rows], rows)
+    new = bench('serialize_rows', serialize_rows, rows)
+    assert json.dumps(old) == json.dumps(new)
+
+    plain = [(i, f'name {i}', i * 0.5) for i in range(n)]
+    print(f'{n} rows x 3 columns, nothing to convert')
+    bench('make_row_serializable', lambda rows: [make_row_serializable(r) for r in rows], plain)
+    bench('serialize_rows', serialize_rows, plain)
+
+
+if __name__ == '__main__':
+    main()
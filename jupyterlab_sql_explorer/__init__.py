@@ -1,4 +1,4 @@
-from traitlets import Unicode, default
+from traitlets import Unicode, Integer, Float, Bool, List, default
 from traitlets.config import Configurable
 import os
 
@@ -6,6 +6,11 @@ from ._version import __version__
 from .handlers import setup_handlers
 from . import db
 from . import comments
+from . import engine
+from . import task
+from . import resultset
+from . import crawler
+from . import kerberos
 from .const import DB_ROOT
 
 class JupyterLabSqlExplorer(Configurable):
@@ -24,6 +29,180 @@ class JupyterLabSqlExplorer(Configurable):
         os.makedirs(dir_name, exist_ok=True)
         return "database::sqlite:///" + p
 
+    comments_reload_interval = Float(
+        60,
+        help="seconds between checks for comments written by others (shared comments store), 0 to disable",
+        config=True
+    )
+
+    engine_idle_timeout = Float(
+        600,
+        help="seconds an unused database engine (and its connection pool) is kept alive",
+        config=True
+    )
+
+    engine_max_count = Integer(
+        32,
+        help="max number of live database engines, least recently used is disposed first",
+        config=True
+    )
+
+    pool_warmup = Integer(
+        0,
+        help="connections opened at start for each fixed connection (set by DB_* environment variables), 0 to disable. They are closed after engine_idle_timeout without use",
+        config=True
+    )
+
+    pool_pre_ping = Bool(
+        False,
+        help="test a pooled connection before it is used, so stale connections (e.g. closed by a firewall) are replaced. It costs a round trip per checkout. Not on Hive",
+        config=True
+    )
+
+    pool_recycle = Float(
+        0,
+        help="seconds after which a pooled connection is replaced, 0 to disable",
+        config=True
+    )
+
+    meta_cache_ttl = Float(
+        300,
+        help="seconds schema/table/column listings are cached, 0 to disable",
+        config=True
+    )
+
+    meta_cache_size = Integer(
+        1000,
+        help="max number of cached schema/table/column listings",
+        config=True
+    )
+
+    catalog_snapshot = Bool(
+        True,
+        help="save schema/table/column listings under ~/work/.database/catalog, shown (as stale) after a restart until fetched again",
+        config=True
+    )
+
+    crawler_interval = Float(
+        0,
+        help="seconds between background crawls of the schemas/tables/columns of each connection, 0 to disable",
+        config=True
+    )
+
+    crawler_connections = List(
+        Unicode(),
+        help="connections (dbid) crawled in background, all connections with a known password if empty",
+        config=True
+    )
+
+    crawler_workers = Integer(
+        2,
+        help="number of schemas crawled at the same time",
+        config=True
+    )
+
+    meta_workers = Integer(
+        8,
+        help="number of threads for metadata and connection requests",
+        config=True
+    )
+
+    meta_timeout = Float(
+        60,
+        help="seconds to wait for a metadata or connection request",
+        config=True
+    )
+
+    query_max_running = Integer(
+        8,
+        help="max number of queries running at the same time, others wait in queue",
+        config=True
+    )
+
+    query_max_per_conn = Integer(
+        4,
+        help="max number of queries running at the same time on one connection",
+        config=True
+    )
+
+    task_ttl = Float(
+        3600,
+        help="seconds the result of a finished query is kept for the client",
+        config=True
+    )
+
+    task_max_bytes = Integer(
+        512 * 1024 * 1024,
+        help="max bytes of retained query results, least recently used results are dropped first",
+        config=True
+    )
+
+    cursor_idle_timeout = Float(
+        300,
+        help="seconds the cursor of a paged query result is kept open without page requests",
+        config=True
+    )
+
+    page_timeout = Float(
+        300,
+        help="seconds to wait for a page of a paged query result",
+        config=True
+    )
+
+    result_max_rows = Integer(
+        1000000,
+        help="max rows of a paged query result",
+        config=True
+    )
+
+    result_spool_bytes = Integer(
+        16 * 1024 * 1024,
+        help="bytes of a paged query result kept in memory, more rows are moved to a file under ~/work/.database/spool, 0 to disable",
+        config=True
+    )
+
+    result_cache_ttl = Float(
+        0,
+        help="seconds results of SELECT statements are cached, 0 to disable (can be set per connection with cache_ttl)",
+        config=True
+    )
+
+    result_cache_bytes = Integer(
+        64 * 1024 * 1024,
+        help="max bytes of cached query results, least recently used results are dropped first",
+        config=True
+    )
+
+    kerberos_keytab = Unicode(
+        '/opt/conda/etc/keytab_{dbid}',
+        help="keytab of a Hive (kerberos) connection, {dbid} is replaced by the connection id",
+        config=True
+    )
+
+    kerberos_krb5_conf = Unicode(
+        '/opt/conda/etc/krb5.conf',
+        help="krb5.conf where the realms of the Hive (kerberos) connections are added, other content is kept",
+        config=True
+    )
+
+    kerberos_ticket_lifetime = Float(
+        10 * 3600,
+        help="seconds a kerberos ticket is valid if klist can't tell (ticket_lifetime of the realm), it is renewed before",
+        config=True
+    )
+
+    kerberos_renew_interval = Float(
+        300,
+        help="seconds between checks for kerberos tickets to renew, 0 to disable",
+        config=True
+    )
+
+    task_sweep_interval = Float(
+        60,
+        help="seconds between checks for expired query results",
+        config=True
+    )
+
 def _jupyter_labextension_paths():
     return [{
         "src": "labextension",
@@ -46,6 +225,23 @@ def _load_jupyter_server_extension(server_app):
     cfg = JupyterLabSqlExplorer(config=server_app.config)
     server_app.log.info("use comment store: " + cfg.comments_store)
     comments.init(cfg.comments_store)
+    comments.start_reloader(cfg.comments_reload_interval)
+    engine.set_engine_limits(cfg.engine_idle_timeout, cfg.engine_max_count)
+    engine.set_pool_options(cfg.pool_pre_ping, cfg.pool_recycle)
+    kerberos.configure(cfg.kerberos_keytab, cfg.kerberos_krb5_conf, cfg.kerberos_ticket_lifetime)
+    kerberos.start_renewer(cfg.kerberos_renew_interval)
+    db.set_meta_cache(cfg.meta_cache_ttl, cfg.meta_cache_size)
+    db.set_catalog_snapshot(cfg.catalog_snapshot)
+    task.set_meta_executor(cfg.meta_workers, cfg.meta_timeout)
+    task.set_query_limits(cfg.query_max_running, cfg.query_max_per_conn)
+    task.set_task_limits(cfg.task_ttl, cfg.task_max_bytes, cfg.cursor_idle_timeout)
+    task.set_page_timeout(cfg.page_timeout)
+    db.set_result_limits(cfg.result_max_rows)
+    resultset.set_spool(cfg.result_spool_bytes)
+    db.set_result_cache(cfg.result_cache_ttl, cfg.result_cache_bytes)
+    task.start_sweeper(cfg.task_sweep_interval)
+    engine.start_warmup(cfg.pool_warmup, server_app.log)
+    crawler.start_crawler(cfg.crawler_interval, cfg.crawler_workers, cfg.crawler_connections)
 
     setup_handlers(server_app.web_app)
     name = "jupyterlab_sql_explorer"
@@ -0,0 +1,191 @@
+import time
+import threading
+import contextlib
+from sqlalchemy import event
+
+class QueryCancelled(Exception):
+    pass
+
+# interval to check the state of an async hive query
+HIVE_POLL_INTERVAL = 0.5
+
+_local = threading.local()
+_running = {}       # taskid -> RunningQuery
+_lock = threading.Lock()
+
+class RunningQuery:
+    '''
+    handle to the database connection a task is running on
+    '''
+    def __init__(self, taskid):
+        self.taskid = taskid
+        self.cancelled = False
+        self.lock = threading.RLock()
+        self.engine = None
+        self.dialect = None
+        self.dbapi_conn = None
+        self.cursor = None
+        self.backend_id = None
+
+    def clear(self):
+        '''
+        the connection is not used by the task any more (returned to the pool), it must
+        not be cancelled: it may run the statement of another request next
+        '''
+        with self.lock:
+            self.dbapi_conn = None
+            self.cursor = None
+            self.backend_id = None
+
+@contextlib.contextmanager
+def running(taskid):
+    '''
+    mark the current thread is running task taskid, so that the connection it uses
+    can be cancelled
+    '''
+    q = RunningQuery(taskid)
+    with _lock:
+        _running[taskid] = q
+    _local.query = q
+    try:
+        yield q
+    finally:
+        _local.query = None
+        with _lock:
+            _running.pop(taskid, None)
+        q.clear()
+
+def _current() -> 'RunningQuery | None':
+    return getattr(_local, 'query', None)
+
+def cancelled() -> bool:
+    '''
+    is the task running in the current thread cancelled
+    '''
+    q = _current()
+    return q is not None and q.cancelled
+
+def _dbapi_connection(conn):
+    fairy = conn.connection
+    # sqlalchemy 2.0 / 1.4
+    return getattr(fairy, 'dbapi_connection', None) or fairy.connection
+
+def _backend_id(dialect: str, dbapi_conn):
+    try:
+        if dialect == 'postgresql':
+            if hasattr(dbapi_conn, 'get_backend_pid'):
+                return dbapi_conn.get_backend_pid()
+            return dbapi_conn.info.backend_pid
+        elif dialect == 'mysql':
+            return dbapi_conn.thread_id()
+    except Exception:
+        pass
+    return None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    q = _current()
+    if q is None:
+        return
+    if q.cancelled:
+        raise QueryCancelled('query cancelled')
+    with q.lock:
+        q.engine = conn.engine
+        q.dialect = conn.dialect.name
+        q.dbapi_conn = _dbapi_connection(conn)
+        q.cursor = cursor
+        q.backend_id = _backend_id(q.dialect, q.dbapi_conn)
+
+def _checkin(dbapi_conn, record):
+    with _lock:
+        queries = list(_running.values())
+    for q in queries:
+        if q.dbapi_conn is dbapi_conn:
+            q.clear()
+
+def _hive_execute(cursor, statement, parameters):
+    '''
+    run hive statement asynchronously and poll it, so it can be cancelled on the server
+    '''
+    from TCLIService.ttypes import TOperationState
+    pending = (TOperationState.INITIALIZED_STATE, TOperationState.PENDING_STATE, TOperationState.RUNNING_STATE)
+
+    q = _current()
+    cursor.execute(statement, parameters, async_=True)
+    while cursor.poll().operationState in pending:
+        if q.cancelled:
+            cursor.cancel()
+            raise QueryCancelled('query cancelled')
+        time.sleep(HIVE_POLL_INTERVAL)
+
+def _hive_do_execute(cursor, statement, parameters, context):
+    if _current() is None:
+        return None
+    _hive_execute(cursor, statement, parameters)
+    return True
+
+def _hive_do_execute_no_params(cursor, statement, context):
+    if _current() is None:
+        return None
+    _hive_execute(cursor, statement, None)
+    return True
+
+def attach(engine):
+    '''
+    install the listeners to record connections of running tasks on engine
+    '''
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'checkin', _checkin)
+    if engine.dialect.name == 'hive':
+        event.listen(engine, 'do_execute', _hive_do_execute)
+        event.listen(engine, 'do_execute_no_params', _hive_do_execute_no_params)
+    return engine
+
+def _kill(q: RunningQuery, dbapi_conn, sql: str):
+    '''
+    run sql on another connection. It is opened without the lock of q (it may wait for the
+    pool or the network), the statement is run only if q still runs on dbapi_conn
+    '''
+    with q.engine.connect() as conn:
+        with q.lock:
+            if q.dbapi_conn is not dbapi_conn:
+                # finished meanwhile, the backend may run the statement of another request
+                return
+            conn.exec_driver_sql(sql)
+
+def cancel(taskid) -> bool:
+    '''
+    cancel the running statement of task on the database server. It blocks (some
+    databases need another connection to kill the query), don't call it in event loop.
+    '''
+    with _lock:
+        q = _running.get(taskid)
+    if q is None:
+        return False
+    q.cancelled = True
+    # the lock keeps the connection from being returned to the pool (and used by another
+    # request) while it is cancelled
+    with q.lock:
+        if q.dbapi_conn is None:
+            # not started yet (it will stop at before_cursor_execute), or finished
+            return True
+
+        dbapi_conn = q.dbapi_conn
+        sql = None
+        if q.dialect == 'sqlite':
+            dbapi_conn.interrupt()
+        elif q.dialect == 'postgresql':
+            if q.backend_id is not None:
+                sql = f'SELECT pg_cancel_backend({int(q.backend_id)})'
+            else:
+                dbapi_conn.cancel()
+        elif q.dialect == 'mysql':
+            if q.backend_id is not None:
+                sql = f'KILL QUERY {int(q.backend_id)}'
+        elif q.dialect == 'oracle':
+            dbapi_conn.cancel()
+        elif q.dialect == 'hive':
+            # the polling thread cancels the operation
+            pass
+    if sql is not None:
+        _kill(q, dbapi_conn, sql)
+    return True
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from .const import DB_ROOT
+
+#
+# Snapshot of the catalog listings (schemas, tables, columns) of each connection, in a
+# sqlite file per connection, so a restarted server can show them before the database
+# answers. Keys are the metadata cache keys: (dbid, 'tables', schema), (dbid, 'columns', db, table)
+#
+enabled = True
+catalog_dir = DB_ROOT + 'catalog/'
+
+_conns = {}         # file -> sqlite3 connection
+_lock = threading.Lock()
+
+# listings fetched before are of a previous session
+started = time.time()
+# keys served from the snapshot and not fetched again yet
+_stale = set()
+# keys being fetched again, one at a time in background
+_pending = set()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sql-explorer-catalog')
+
+def set_catalog(on: bool, dirname: str = None):
+    global enabled, catalog_dir
+    enabled = on
+    if dirname:
+        catalog_dir = dirname
+
+def _file(dbid: str) -> str:
+    return os.path.join(os.path.expanduser(catalog_dir), quote(dbid, safe='') + '.db')
+
+def _conn(dbid: str) -> sqlite3.Connection:
+    '''
+    connection to the snapshot of dbid, must hold the lock
+    '''
+    path = _file(dbid)
+    conn = _conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute('CREATE TABLE IF NOT EXISTS listing (key TEXT PRIMARY KEY, items TEXT NOT NULL, fetched REAL NOT NULL)')
+        _conns[path] = conn
+    return conn
+
+def _row_key(key: tuple) -> str:
+    return json.dumps(key[1:])
+
+def get_fetched(key: tuple) -> ('list | None', float):
+    '''
+    the listing of key in the snapshot and the time it was fetched, (None, 0) if not saved
+    (or the snapshot can't be read)
+    '''
+    if not enabled:
+        return None, 0
+    try:
+        with _lock:
+            row = _conn(key[0]).execute('SELECT items, fetched FROM listing WHERE key = ?', (_row_key(key),)).fetchone()
+    except (sqlite3.Error, OSError) as err:
+        print(f'read catalog snapshot of {key[0]}: {err}')
+        return None, 0
+    return (None, 0) if row is None else (json.loads(row[0]), row[1])
+
+def get(key: tuple) -> 'list | None':
+    '''
+    the listing of key in the snapshot, None if not saved (or the snapshot can't be read)
+    '''
+    return get_fetched(key)[0]
+
+def put_many(dbid: str, listings: list):
+    '''
+    save fetched listings [(key, items)] of dbid, they are not stale any more
+    '''
+    with _lock:
+        for key, _ in listings:
+            _stale.discard(key)
+    if not enabled or not listings:
+        return
+    now = time.time()
+    try:
+        with _lock:
+            conn = _conn(dbid)
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO listing (key, items, fetched) VALUES (?, ?, ?)',
+                                 [(_row_key(key), json.dumps(items), now) for key, items in listings])
+    except (sqlite3.Error, OSError) as err:
+        print(f'save catalog snapshot of {dbid}: {err}')
+
+def put(key: tuple, items: list):
+    put_many(key[0], [(key, items)])
+
+def clear(dbid: str):
+    '''
+    drop the snapshot of dbid, e.g. its objects were changed
+    '''
+    with _lock:
+        for key in [key for key in _stale if key[0] == dbid]:
+            _stale.discard(key)
+    if not enabled:
+        return
+    try:
+        with _lock:
+            if _file(dbid) not in _conns and not os.path.exists(_file(dbid)):
+                return
+            conn = _conn(dbid)
+            with conn:
+                conn.execute('DELETE FROM listing')
+    except (sqlite3.Error, OSError) as err:
+        print(f'clear catalog snapshot of {dbid}: {err}')
+
+def drop(dbid: str):
+    '''
+    close and remove the snapshot of dbid, e.g. the connection is deleted
+    '''
+    path = _file(dbid)
+    with _lock:
+        for key in [key for key in _stale if key[0] == dbid]:
+            _stale.discard(key)
+        conn = _conns.pop(path, None)
+        if conn is not None:
+            conn.close()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            print(f'remove catalog snapshot of {dbid}: {err}')
+
+def is_stale(key: tuple) -> bool:
+    return key in _stale
+
+def revalidate(key: tuple, load):
+    '''
+    key was served from the snapshot: mark it stale, call load() in background to fetch it
+    again (which saves it with put)
+    '''
+    with _lock:
+        _stale.add(key)
+        if key in _pending:
+            return
+        _pending.add(key)
+
+    def run():
+        try:
+            load()
+        except Exception as err:
+            print(f'revalidate {key}: {err}')
+        finally:
+            with _lock:
+                _pending.discard(key)
+
+    _executor.submit(run)
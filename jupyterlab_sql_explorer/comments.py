@@ -1,4 +1,9 @@
 import os
+import io
+import csv
+import json
+import asyncio
+import threading
 from . import comments_db
 from .const import DB_ROOT
 
@@ -7,30 +12,165 @@ from .const import DB_ROOT
 #
 comments_store = None
 
+# comments of the objects looked up so far: (type, dbid, schema, table) of the parent -> {name: comment}
+_index = {}
+_index_lock = threading.Lock()
+# newest comment applied, comments written by others after it are loaded by reload()
+_last_id = 0
+# reload() reads again the comments of the last RELOAD_WINDOW ids, a writer may commit an
+# id after a larger one was read. ids of the window applied so far
+RELOAD_WINDOW = 100
+_recent = set()
+
 def init(store_str):
-    global comments_store
+    global comments_store, _last_id, _recent
     print(store_str)
     arr=store_str.split("::")
+    with _index_lock:
+        _index.clear()
     if arr[0]=='database':
         comments_db.init(arr[1])
         comments_store=arr[0]
+        try:
+            _last_id = comments_db.last_id()
+            _recent = {r[0] for r in comments_db.get_comments_since(_last_id - RELOAD_WINDOW)}
+        except Exception:
+            _last_id = 0
+            _recent = set()
     else:
         comments_store=None
 
+def _index_key(type, dbid, schema=None, table=None, column=None) -> (tuple, str):
+    '''
+    key of the parent and name of an object. A missing schema or table is '', as in the store
+    '''
+    type = int(type)
+    schema, table = schema or '', table or ''
+    if type == comments_db.C_CONN:
+        return (type,), dbid
+    elif type == comments_db.C_SCHEMA:
+        return (type, dbid), schema
+    elif type == comments_db.C_TABLE:
+        return (type, dbid, schema), table
+    return (type, dbid, schema, table), column
+
+def _lookup(key: tuple, load) -> dict:
+    '''
+    comments of the children of key, load() them from the store if not looked up yet
+    '''
+    clist = _index.get(key)
+    if clist is None:
+        clist = load()
+        if clist is None:
+            # store not readable, try again next time
+            return {}
+        with _index_lock:
+            clist = _index.setdefault(key, clist)
+    return clist
+
+def _apply(type, dbid, schema, table, column, memo):
+    key, name = _index_key(type, dbid, schema, table, column)
+    with _index_lock:
+        clist = _index.get(key)
+        if clist is not None:
+            clist[name] = memo
+
 def add(data):
     if comments_store is None:
         return "can't set comment, please set comment store first!"
     elif comments_store == 'database':
         comments_db.set_comments(**data)
+        _apply(data['type'], data['dbid'], data.get('schema'), data.get('table'), data.get('column'), data['comment'])
     elif comments_store == 'server':
         pass
     return "set comment ok"
 
+def add_bulk(items: list) -> (int, 'Exception | None'):
+    '''
+    set many comments, return the count committed (the first items) and the error that
+    stopped the import if any
+    '''
+    if comments_store != 'database':
+        raise Exception("can't set comment, please set comment store first!")
+    n, err = comments_db.set_comments_bulk(items)
+    for data in items[:n]:
+        _apply(data['type'], data['dbid'], data.get('schema'), data.get('table'), data.get('column'), data['comment'])
+    return n, err
+
+# fields of a comment in bulk import/export
+COMMENT_FIELDS = ('type', 'dbid', 'schema', 'table', 'column', 'comment')
+
+def parse_comments(body: bytes, fmt: str) -> list:
+    '''
+    comments of a bulk import: json (a list), jsonl (an object per line) or csv (with a
+    header line of COMMENT_FIELDS)
+    '''
+    if fmt == 'csv':
+        items = list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'))))
+    elif fmt == 'jsonl':
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    elif fmt == 'json':
+        items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError('a list of comments is expected')
+    else:
+        raise ValueError(f'unknown format {fmt}')
+    return items
+
+def export_comments(dbid: 'str | None', after: int = 0) -> (list, int):
+    '''
+    a page of the current comments of dbid (all if None), values in the order of
+    COMMENT_FIELDS, and the position to get the next page from. An empty page is the end.
+    '''
+    if comments_store != 'database':
+        return [], after
+    rows = comments_db.get_current_comments(dbid, after)
+    return [r[1:] for r in rows], rows[-1][0] if rows else after
+
+def reload() -> int:
+    '''
+    apply comments written by others (shared store) since last reload, return the count
+    '''
+    global _last_id, _recent
+    if comments_store != 'database':
+        return 0
+    rows = comments_db.get_comments_since(max(_last_id - RELOAD_WINDOW, 0))
+    n = sum(1 for r in rows if r[0] > _last_id or r[0] not in _recent)
+    if n == 0:
+        return 0
+    # all rows of the window in id order, so a late comment doesn't hide a newer one
+    for id, type, dbid, schema, table, column, memo in rows:
+        _apply(type, dbid, schema, table, column, memo)
+    _last_id = max(_last_id, rows[-1][0])
+    _recent = {r[0] for r in rows if r[0] > _last_id - RELOAD_WINDOW}
+    return n
+
+_reloader = None
+
+def start_reloader(interval: float = 60):
+    global _reloader
+    from tornado.ioloop import PeriodicCallback
+    from . import task
+
+    async def _reload():
+        try:
+            await task.run_blocking(reload)
+        except Exception as err:
+            print(f'reload comments: {err}')
+
+    if _reloader is not None:
+        _reloader.stop()
+        _reloader = None
+    if interval > 0:
+        _reloader = PeriodicCallback(lambda: asyncio.ensure_future(_reload()), interval * 1000)
+        _reloader.start()
+
 def match_column(dbid: str, schema: str, table: str, columns: list)->list:
     if comments_store is None:
         return columns
     elif comments_store == 'database':
-        clist = comments_db.get_column_comments(dbid, schema, table)
+        clist = _lookup((comments_db.C_COLUMN, dbid, schema or '', table or ''),
+                        lambda: comments_db.get_column_comments(dbid, schema, table))
     elif comments_store == 'server':
         pass
 
@@ -44,7 +184,8 @@ def match_table(dbid: str, schema: str, tables: list)->list:
     if comments_store is None:
         return tables
     elif comments_store == 'database':
-        clist = comments_db.get_table_comments(dbid, schema)
+        clist = _lookup((comments_db.C_TABLE, dbid, schema or ''),
+                        lambda: comments_db.get_table_comments(dbid, schema))
     elif comments_store == 'server':
         pass
 
@@ -58,7 +199,7 @@ def match_schema(dbid: str, schemas: list)->list:
     if comments_store is None:
         return schemas
     elif comments_store == 'database':
-        clist = comments_db.get_schema_comments(dbid)
+        clist = _lookup((comments_db.C_SCHEMA, dbid), lambda: comments_db.get_schema_comments(dbid))
     elif comments_store == 'server':
         pass
 
@@ -72,7 +213,7 @@ def match_conn(conns: list)->list:
     if comments_store is None:
         return conns
     elif comments_store == 'database':
-        clist = comments_db.get_conn_comments()
+        clist = _lookup((comments_db.C_CONN,), comments_db.get_conn_comments)
     elif comments_store == 'server':
         pass
 
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Index, text, Sequence
+from sqlalchemy import create_engine, Column, Integer, String, Index, Sequence, update, insert, select, func, exc
 from sqlalchemy.orm import sessionmaker, declarative_base
 #from sqlalchemy.ext.declarative import declarative_base
 
@@ -8,6 +8,8 @@ C_TABLE = 3
 C_COLUMN = 4
 
 _conn_str=None
+_engine=None
+_Session=None
 
 Base = declarative_base()
 
@@ -26,83 +28,100 @@ class Comments(Base):
 
     index_name = Index('idx', type, dbid, schema, tabname, colname)
 
+class CurrentComments(Base):
+    '''
+    the current comment of each object, comments keeps the history.
+    Missing schema/table/column are '', the primary key serves lookups of the children
+    of an object (by prefix)
+    '''
+    __tablename__ = 'comments_current'
+
+    type = Column(Integer, primary_key=True)
+    dbid = Column(String(20), primary_key=True)
+    schema = Column(String(100), primary_key=True)
+    tabname = Column(String(100), primary_key=True)
+    colname = Column(String(100), primary_key=True)
+    memo = Column(String(500))
+    id = Column(Integer)
+
+    index_id = Index('idx_current_id', id)
+
+def _migrate(engine):
+    '''
+    fill comments_current from the history of stores created by older versions
+    '''
+    key = [Comments.type, Comments.dbid, func.coalesce(Comments.schema, ''),
+           func.coalesce(Comments.tabname, ''), func.coalesce(Comments.colname, '')]
+    latest = select(func.max(Comments.id)).group_by(*key)
+    stmt = insert(CurrentComments).from_select(
+        ['type', 'dbid', 'schema', 'tabname', 'colname', 'memo', 'id'],
+        select(*key, Comments.memo, Comments.id).where(Comments.id.in_(latest)))
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(CurrentComments)).scalar():
+            return
+        conn.execute(stmt)
+
 def init(conn_str: str):
-    global _conn_str
+    global _conn_str, _engine, _Session
+    if _engine is not None:
+        _engine.dispose()
     _conn_str= conn_str
-    engine = create_engine(conn_str)
-    Base.metadata.create_all(engine)
-
-def get_conn_comments():
+    # one engine (and connection pool) for the life of the server
+    _engine = create_engine(conn_str, pool_pre_ping=True)
+    _Session = sessionmaker(bind=_engine)
+    Base.metadata.create_all(_engine)
+    _migrate(_engine)
+
+def _fetch_dict(stmt) -> 'dict | None':
+    '''
+    {name: memo} of the query, None if the store can not be read
+    '''
     try:
-        engine = create_engine(_conn_str)
-        with engine.connect() as conn:
-            result = conn.execute(text('''
-            SELECT dbid, memo FROM comments 
-            WHERE id in ( SELECT max(id) as id FROM comments
-                    WHERE type = :type
-                    GROUP BY dbid )
-            '''), {"type":str(C_CONN)})
+        with _engine.connect() as conn:
+            result = conn.execute(stmt)
             data={}
             for r in result.fetchall():
                 data[r[0]]=r[1]
             return data
     except Exception:
-        return {}
+        return None
+
+# schema is a reserved word in some databases (e.g. MySQL), statements are built with
+# SQLAlchemy so that the column names are quoted where needed
+def get_conn_comments():
+    return _fetch_dict(select(CurrentComments.dbid, CurrentComments.memo)
+                       .where(CurrentComments.type == C_CONN))
 
 def get_schema_comments(dbid: str):
-    try:
-        engine = create_engine(_conn_str)
-        with engine.connect() as conn:
-            result = conn.execute(text('''
-            SELECT schema, memo FROM comments
-            WHERE id in ( SELECT max(id) as id FROM comments
-                        WHERE type = :type and dbid = :dbid
-                        GROUP BY schema )
-            '''), {'type':str(C_SCHEMA), 'dbid':dbid})
-            data={}
-            for r in result.fetchall():
-                data[r[0]]=r[1]
-            return data
-    except Exception:
-        return {}
+    return _fetch_dict(select(CurrentComments.schema, CurrentComments.memo)
+                       .filter_by(type=C_SCHEMA, dbid=dbid))
 
 def get_table_comments(dbid: str, schema: str):
-    try:
-        engine = create_engine(_conn_str)       
-        data={}
-        with engine.connect() as conn:
-            result = conn.execute(text('''
-            SELECT tabname, memo FROM comments
-            WHERE id in ( SELECT max(id) as id FROM comments
-                        WHERE type = :type and dbid = :dbid and schema = :schema
-                        GROUP BY tabname )
-            '''), {'type':str(C_TABLE), 'dbid':dbid, 'schema':schema})
-            
-            for r in result.fetchall():
-                data[r[0]]=r[1]
-        return data
-    except Exception:
-        return {}
+    return _fetch_dict(select(CurrentComments.tabname, CurrentComments.memo)
+                       .filter_by(type=C_TABLE, dbid=dbid, schema=schema or ''))
 
 def get_column_comments(dbid: str, schema: str, table: str):
-    try:
-        engine = create_engine(_conn_str)
-        with engine.connect() as conn:
-            result = conn.execute(text('''
-            SELECT colname, memo FROM comments
-            WHERE id in ( SELECT max(id) as id FROM comments
-                        WHERE type = :type and dbid = :dbid and schema = :schema and tabname = :table
-                        GROUP BY colname )
-            '''), {'type':str(C_COLUMN), 'dbid':dbid, 'schema':schema, 'table':table})
-            data={}
-            for r in result.fetchall():
-                data[r[0]]=r[1]
-            return data
-    except Exception:
-        return {}
-
-def set_comments(**args):
-
+    return _fetch_dict(select(CurrentComments.colname, CurrentComments.memo)
+                       .filter_by(type=C_COLUMN, dbid=dbid, schema=schema or '', tabname=table or ''))
+
+def last_id() -> int:
+    '''
+    id of the newest comment, 0 if none
+    '''
+    with _engine.connect() as conn:
+        return conn.execute(select(func.max(Comments.id))).scalar() or 0
+
+def get_comments_since(id: int) -> list:
+    '''
+    comments (id, type, dbid, schema, tabname, colname, memo) written after comment id, oldest first
+    '''
+    stmt = select(Comments.id, Comments.type, Comments.dbid, Comments.schema,
+                  Comments.tabname, Comments.colname, Comments.memo) \
+        .where(Comments.id > id).order_by(Comments.id)
+    with _engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(stmt).fetchall()]
+
+def _comment_param(args: dict) -> (int, dict):
     param={
         'type': args['type'],
         'memo': args['comment'],
@@ -121,10 +140,73 @@ def set_comments(**args):
         param.update({'schema': args['schema'], 'tabname': args['table'], 'colname': args['column']})
     else:
         raise Exception('arg error')
+    return type, param
+
+def _write(batch: list):
+    '''
+    add comments [(type, param)] to the history and set them current, in one transaction.
+    It is run again if another writer inserted the current comment of an object first
+    '''
+    for attempt in (1, 2):
+        with _Session() as session:
+            rows = [Comments(**param) for _, param in batch]
+            session.add_all(rows)
+            session.flush()
+            try:
+                for (type, param), c in zip(batch, rows):
+                    _set_current(session, type, param, c.id)
+            except exc.IntegrityError:
+                session.rollback()
+                if attempt == 2:
+                    raise
+                continue
+            session.commit()
+            return
 
-    engine = create_engine(_conn_str)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    c = Comments(**param)
-    session.add(c)
-    session.commit()
\ No newline at end of file
+def set_comments(**args):
+    _write([_comment_param(args)])
+
+def _set_current(session, type: int, param: dict, id: int):
+    '''
+    update the current comment of the object, insert it if there is none
+    '''
+    key = {
+        'type': type,
+        'dbid': param['dbid'],
+        'schema': param.get('schema') or '',
+        'tabname': param.get('tabname') or '',
+        'colname': param.get('colname') or '',
+    }
+    stmt = update(CurrentComments).filter_by(**key).values(memo=param['memo'], id=id)
+    if session.execute(stmt).rowcount == 0:
+        session.execute(insert(CurrentComments).values(memo=param['memo'], id=id, **key))
+
+# comments written in one transaction by set_comments_bulk
+BULK_BATCH = 1000
+
+def set_comments_bulk(items: list) -> (int, 'Exception | None'):
+    '''
+    set many comments (dicts of the arguments of set_comments), BULK_BATCH in each
+    transaction. Nothing is written if an item is malformed. Return the count committed,
+    the first items, and the error that stopped the writes if any
+    '''
+    params = [_comment_param(args) for args in items]
+    for i in range(0, len(params), BULK_BATCH):
+        try:
+            _write(params[i:i + BULK_BATCH])
+        except Exception as err:
+            return i, err
+    return len(params), None
+
+def get_current_comments(dbid: 'str | None', after: int = 0, limit: int = BULK_BATCH) -> list:
+    '''
+    current comments (id, type, dbid, schema, tabname, colname, memo) of dbid (all if None)
+    with id > after, ordered by id. Page through all with after = id of the last one.
+    '''
+    stmt = select(CurrentComments.id, CurrentComments.type, CurrentComments.dbid, CurrentComments.schema,
+                  CurrentComments.tabname, CurrentComments.colname, CurrentComments.memo) \
+        .where(CurrentComments.id > after).order_by(CurrentComments.id).limit(limit)
+    if dbid is not None:
+        stmt = stmt.where(CurrentComments.dbid == dbid)
+    with _engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(stmt).fetchall()]
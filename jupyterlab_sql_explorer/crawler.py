@@ -0,0 +1,193 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import engine, db, task
+
+#
+# Background crawler: lists the schemas, tables and columns of connections, so the
+# catalog snapshot and the search index are filled before a user browses them. Columns are
+# not added to the metadata cache (entries cached already are updated), a crawl doesn't
+# evict the listings users work with. After the first crawl only tables whose change
+# indicator (see db.table_signatures) changed have their columns fetched again. Catalog
+# queries run in the metadata executor with its timeout.
+#
+
+# seconds between crawls of a connection, 0 to disable
+crawl_interval = 0
+# connections to crawl, all connections (with a known password) if empty
+crawl_connections = []
+# seconds to wait before each schema, and while queries of the connection are running
+CRAWL_PAUSE = 0.1
+CRAWL_YIELD_MAX = 60
+
+# schemas crawled at the same time (all connections)
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sql-explorer-crawler')
+
+class Crawler:
+    '''
+    crawl state of a connection
+    '''
+    def __init__(self, dbid):
+        self.dbid = dbid
+        self.running = False
+        self.signatures = {}    # schema -> {table: signature}, signature None if unknown
+        self._lock = threading.Lock()
+        self.progress = {'state': 'idle', 'runs': 0, 'schemas': 0, 'done': 0, 'tables': 0, 'changed': 0, 'errors': 0}
+
+    def reset(self):
+        '''
+        forget the signatures, all tables are crawled again (their cached metadata was dropped)
+        '''
+        self.signatures = {}
+
+    def _yield(self):
+        # low priority: give way to the queries of users
+        time.sleep(CRAWL_PAUSE)
+        waited = 0
+        while task.running_queries(self.dbid) > 0 and waited < CRAWL_YIELD_MAX:
+            time.sleep(1)
+            waited += 1
+
+    def _crawl_schema(self, schema):
+        self._yield()
+        sigs = task.call_blocking(db.table_signatures, self.dbid, schema)
+        old = self.signatures.get(schema)
+        if sigs is not None and sigs == old:
+            changed = []
+        else:
+            if sigs is None:
+                # no change indicators: tables are listed, only new tables are crawled
+                items = task.call_blocking(db.get_schema_or_table, self.dbid, schema, refresh=True)
+                sigs = {r['name']: None for r in items}
+            elif schema is not None:
+                task.call_blocking(db.get_schema_or_table, self.dbid, schema, refresh=True)
+            if old is None:
+                changed = list(sigs)
+                task.call_blocking(db.get_schema_columns, self.dbid, schema, refresh=True, cache=False)
+            else:
+                changed = [t for t, sig in sigs.items() if t not in old or old[t] != sig]
+                if changed:
+                    task.call_blocking(db.get_schema_columns, self.dbid, schema, changed, refresh=True, cache=False)
+            self.signatures[schema] = sigs
+        with self._lock:
+            self.progress['done'] += 1
+            self.progress['tables'] += len(sigs)
+            self.progress['changed'] += len(changed)
+
+    async def crawl(self):
+        '''
+        crawl the connection once, schemas are crawled in the crawler executor
+        '''
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+        p = self.progress
+        p.update(state='running', started=time.time(), schemas=0, done=0, tables=0, changed=0, errors=0)
+        p.pop('error', None)
+        try:
+            items = await task.run_blocking(db.get_schema_or_table, self.dbid, None, refresh=True)
+            if items is None:
+                raise Exception(f'connection {self.dbid} not found')
+            schemas = [r['name'] for r in items if r['type'] == 'db']
+            if not schemas:
+                # no schema layer, tables are listed
+                schemas = [None]
+            p['schemas'] = len(schemas)
+            loop = asyncio.get_event_loop()
+            futures = [(schema, loop.run_in_executor(_executor, self._crawl_schema, schema)) for schema in schemas]
+            for schema, f in futures:
+                try:
+                    await f
+                except Exception as err:
+                    # e.g. no privilege on the schema
+                    p['errors'] += 1
+                    p['error'] = f'{schema}: {err}'
+            # dropped schemas
+            for schema in set(self.signatures) - set(schemas):
+                del self.signatures[schema]
+        except Exception as err:
+            p['errors'] += 1
+            p['error'] = str(err)
+        finally:
+            p.update(state='idle', finished=time.time(), runs=p['runs'] + 1)
+            self.running = False
+
+_crawlers = {}      # dbid -> Crawler
+_lock = threading.Lock()
+
+def get_crawler(dbid) -> Crawler:
+    with _lock:
+        c = _crawlers.get(dbid)
+        if c is None:
+            c = _crawlers[dbid] = Crawler(dbid)
+        return c
+
+def drop(dbid):
+    with _lock:
+        _crawlers.pop(dbid, None)
+
+def reset(dbid=None):
+    '''
+    called when the metadata of dbid (all if None) is invalidated
+    '''
+    with _lock:
+        crawlers = [c for c in _crawlers.values() if dbid is None or c.dbid == dbid]
+    for c in crawlers:
+        c.reset()
+
+def status(dbid=None) -> dict:
+    '''
+    progress of the crawls, {dbid: progress}
+    '''
+    with _lock:
+        crawlers = [c for c in _crawlers.values() if dbid is None or c.dbid == dbid]
+    return {c.dbid: dict(c.progress) for c in crawlers}
+
+async def start_crawl(dbid) -> bool:
+    '''
+    start crawling dbid in background, False if it is being crawled
+    '''
+    c = get_crawler(dbid)
+    if c.running:
+        return False
+    # errors are kept in the progress
+    asyncio.ensure_future(c.crawl())
+    return True
+
+def _connections() -> list:
+    if crawl_connections:
+        return list(crawl_connections)
+    return list(engine._getDBlist()) + list(engine._getCfgEntryList())
+
+async def _crawl_all():
+    for dbid in _connections():
+        try:
+            st, _ = await task.run_blocking(engine.check_pass, dbid)
+        except Exception as err:
+            print(f'crawl {dbid}: {err}')
+            continue
+        # connections whose password is not given yet are skipped
+        if st:
+            await start_crawl(dbid)
+
+_timer = None
+
+def start_crawler(interval: float = 0, workers: int = 2, connections: list = None):
+    global _timer, _executor, crawl_interval, crawl_connections
+    from tornado.ioloop import IOLoop, PeriodicCallback
+
+    crawl_interval = interval
+    crawl_connections = list(connections or [])
+    old = _executor
+    _executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='sql-explorer-crawler')
+    old.shutdown(wait=False)
+
+    if _timer is not None:
+        _timer.stop()
+        _timer = None
+    if interval > 0:
+        _timer = PeriodicCallback(lambda: asyncio.ensure_future(_crawl_all()), interval * 1000)
+        _timer.start()
+        IOLoop.current().add_callback(_crawl_all)
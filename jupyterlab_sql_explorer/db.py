@@ -1,7 +1,32 @@
+import os
+import time
+import tempfile
+import functools
 import sqlparse
 from . import engine
 from . import comments
-from .serializer import make_row_serializable
+from . import cancel
+from . import limit
+from . import search
+from . import catalog
+from .serializer import serialize_rows, column_types, to_csv, to_jsonl, estimate_size
+from .metacache import MetaCache
+from .resultcache import ResultCache
+from .resultset import ResultHandle
+
+# statement types which do not change metadata
+_NON_DDL = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'MERGE', 'UPSERT'}
+
+_meta_cache = MetaCache()
+
+# results of SELECT statements, disabled (ttl 0) unless configured or set on the connection (cache_ttl)
+_result_cache = ResultCache()
+
+# max rows of a paged result
+_paged_max_rows = 1000000
+
+# rows fetched and written at once when exporting
+EXPORT_BATCH_ROWS = 1000
 
 log=None
 def set_log(_log):
@@ -17,86 +42,340 @@ def query(dbid, sql, **kwargs) ->list:
         usedb=kwargs['db']
     eng = engine.getEngine(dbid, usedb)
     if eng:
-        conn = eng.connect()
-        result = conn.exec_driver_sql(sql)
-        data = result.fetchall()
-        conn.close()
-        return data
+        with eng.connect() as conn:
+            result = conn.exec_driver_sql(sql)
+            return result.fetchall()
 
     return []
 
-def set_limit(sql: str, def_lim: int = 200, max_lim: int = 10000) -> (bool, str):
+def set_limit(sql: str, def_lim: int = 200, max_lim: int = 10000, dialect: str = None) -> (bool, str):
     '''
     Append LIMIT to a select sql statment.
     If the LIMIT is not set, set the LIMIT to def_lim. If the LIMIT is set and LIMIT < max_limit, keep it unchanged. 
-    Otherwise, modify the LIMIT to max_limit.
+    Otherwise, modify the LIMIT to max_limit. dialect (db_type of the connection) decides the form of the limit clause.
+    '''
+    return limit.set_limit(sql, def_lim, max_lim, dialect)
+
+def _is_ddl(sql: str)->bool:
+    '''
+    may the statement change metadata
+    '''
+    return any(limit.statement_verb(stmt) not in _NON_DDL for stmt in limit.split_statements(sql))
+
+def set_result_limits(max_rows: int)->None:
+    global _paged_max_rows
+    _paged_max_rows = max_rows
+
+def set_result_cache(ttl: float, max_bytes: int)->None:
+    _result_cache.ttl = ttl
+    _result_cache.max_bytes = max_bytes
+    _result_cache.invalidate()
+
+def invalidate_results(dbid: 'str | None' = None)->None:
+    '''
+    drop cached query results of dbid (all if None)
     '''
+    _result_cache.invalidate(dbid)
+
+def result_cache_stats()->dict:
+    return _result_cache.stats()
+
+def _cache_ttl(info: dict)->float:
+    ttl = info.get('cache_ttl')
+    return _result_cache.ttl if ttl is None else float(ttl)
+
+def _cache_key(dbid, usedb, sql) -> 'tuple | None':
+    '''
+    key of the result of a single SELECT statement: keywords in upper case, comments removed,
+    whitespaces collapsed. None if the statement is not cacheable, long statements are not
+    '''
+    if len(sql) > limit.CACHE_MAX_SQL:
+        return None
+    stmts = limit.split_statements(sql)
+    if len(stmts) != 1 or limit.statement_verb(stmts[0]) != 'SELECT':
+        return None
     parsed = sqlparse.parse(sql)
-    if len(parsed)!=1:
-        return False, 'can only process one statement'
-
-    stmt = parsed[0]
-    if not isinstance(stmt, sqlparse.sql.Statement) or stmt.get_type() != "SELECT":
-        return True, sql
-
-    out=''
-    has_limit=False
-    after_limit=False
-    for token in stmt:
-        if has_limit is False:
-            if token.ttype == sqlparse.tokens.Keyword and token.value.upper() == "LIMIT":
-                has_limit = True  # limit found
-            else:
-                out += str(token)
-        elif after_limit:
-            out += str(token)
-        else:
-            if token.ttype == sqlparse.tokens.Literal.Number.Integer:
-                limit_value = int(token.value)
-                after_limit = True
-            elif token.ttype != sqlparse.tokens.Whitespace:
-                raise Exception("Sql Error")
-
-    use_lim = def_lim
-    if has_limit:
-        if limit_value<=max_lim:
-            use_lim = limit_value
+    if len(parsed) != 1:
+        return None
+    out = []
+    for tok in parsed[0].flatten():
+        if tok.is_whitespace or tok.ttype in sqlparse.tokens.Comment:
+            if out and out[-1] != ' ':
+                out.append(' ')
         else:
-            use_lim = max_lim
-    out += f' LIMIT {use_lim}'
-    return True, out
+            out.append(tok.value.upper() if tok.is_keyword else tok.value)
+    return (dbid, usedb, ''.join(out).strip().rstrip(';').rstrip())
 
-def query_exec(dbid, sql, **kwargs) ->dict:
+def _cache_result(key, ttl, h: ResultHandle):
+    _result_cache.put(key, {'columns': h.columns, 'types': h.types, 'data': h.rows}, h.size, ttl)
+
+def _query_paged(eng, dbid, sql, page_size, on_complete=None) -> 'ResultHandle | dict':
     '''
-    make a query, return with header
+    run query with a server side cursor, return a handle to fetch pages of the result
     '''
-    rc, sql = set_limit(sql, 10000)
+    conn = eng.connect()
+    try:
+        conn = conn.execution_options(stream_results=True)
+        transaction=conn.begin()
+        result = conn.exec_driver_sql(sql)
+        if not result.returns_rows:
+            transaction.commit()
+            conn.close()
+            if _is_ddl(sql):
+                invalidate_meta(dbid)
+            return {}
+        handle = ResultHandle(conn, transaction, result, _paged_max_rows, page_size)
+        handle.on_complete = on_complete
+    except BaseException:
+        conn.close()
+        raise
+    handle.page(0, page_size)
+    return handle
+
+def export_query(dbid, sql, fmt, write, progress: dict, **kwargs) -> dict:
+    '''
+    run query without limit and pass the whole result to write(bytes) as csv or json lines,
+    batch by batch from a server side cursor. progress['rows'] and progress['bytes'] are
+    updated after each batch.
+    '''
+    usedb=None
+    if 'db' in kwargs:
+        usedb=kwargs['db']
+    eng = engine.getEngine(dbid, usedb)
+    if eng is None:
+        raise Exception(f'connection {dbid} not found')
+
+    with eng.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        with conn.begin():
+            result = conn.exec_driver_sql(sql)
+            if not result.returns_rows:
+                raise Exception('statement returns no rows')
+            columns = list(result.keys())
+            if fmt == 'csv':
+                data = to_csv([columns])
+                write(data)
+                progress['bytes'] += len(data)
+            while True:
+                if cancel.cancelled():
+                    raise cancel.QueryCancelled('query cancelled')
+                rows = result.fetchmany(EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                rows = serialize_rows(rows)
+                data = to_csv(rows) if fmt == 'csv' else to_jsonl(columns, rows)
+                write(data)
+                progress['rows'] += len(rows)
+                progress['bytes'] += len(data)
+    return progress
+
+def export_file(dbid, sql, fmt, path, progress: dict, **kwargs) -> dict:
+    '''
+    export the result of query to file path. It is written to a temporary file in the
+    same directory first, path is replaced when the export completes
+    '''
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            export_query(dbid, sql, fmt, f.write, progress, **kwargs)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return progress
+
+def query_exec(dbid, sql, **kwargs) ->'dict | ResultHandle':
+    '''
+    make a query, return with header.
+    If page_size is set, return a ResultHandle of the open result, rows are fetched by pages.
+    Results of SELECT are cached if enabled, unless no_cache is set; a result from the
+    cache has 'cached' (its age in seconds).
+    '''
+    info = engine.getDbInfo(dbid) or {}
+    dialect = info.get('db_type')
+    page_size = kwargs.get('page_size')
+    if page_size:
+        rc, sql = set_limit(sql, _paged_max_rows, _paged_max_rows, dialect)
+    else:
+        rc, sql = set_limit(sql, 10000, dialect=dialect)
     if not rc:
         raise Exception(sql)
 
     usedb=None
     if 'db' in kwargs:
         usedb=kwargs['db']
+
+    key = None
+    ttl = _cache_ttl(info)
+    if ttl > 0 or len(_result_cache) > 0:
+        key = _cache_key(dbid, usedb, sql)
+        if key is None:
+            # the statement may change data
+            _result_cache.invalidate(dbid)
+        elif not kwargs.get('no_cache'):
+            hit = _result_cache.get(key)
+            if hit is not None:
+                value, age = hit
+                if page_size:
+                    h = ResultHandle.from_rows(value['columns'], value['types'], value['data'], page_size)
+                    h.cached = round(age, 1)
+                    return h
+                return dict(value, cached=round(age, 1))
+        if ttl <= 0:
+            key = None
+
     eng = engine.getEngine(dbid, usedb)
+    if eng and page_size:
+        on_complete = functools.partial(_cache_result, key, ttl) if key else None
+        return _query_paged(eng, dbid, sql, page_size, on_complete)
     if eng:
-        conn = eng.connect()
-        transaction=conn.begin()
-        result = conn.exec_driver_sql(sql)
-        transaction.commit()
-        conn.close()
-        if result.returns_rows:
-            data = [make_row_serializable(row) for row in result]
-            columns = list(result.keys())
-            return {'columns': columns, 'data': data}
+        with eng.connect() as conn:
+            transaction=conn.begin()
+            result = conn.exec_driver_sql(sql)
+            transaction.commit()
+            if not result.returns_rows and _is_ddl(sql):
+                invalidate_meta(dbid)
+            if result.returns_rows:
+                rows = result.fetchall()
+                types = column_types(rows)
+                data = serialize_rows(rows)
+                columns = list(result.keys())
+                out = {'columns': columns, 'types': types, 'data': data}
+                if key:
+                    _result_cache.put(key, out, estimate_size(data) + estimate_size(columns), ttl)
+                return out
     return {}
 
-def get_column_info(dbid, db, tbl):
+# max rows of a statement result in a script
+SCRIPT_MAX_ROWS = 10000
+
+def script_exec(dbid, script, progress: dict, **kwargs) -> dict:
     '''
+    run the statements of script one by one on one connection, in one transaction if
+    transaction is set (rolled back if a statement fails), otherwise each statement is
+    committed. It stops at the first error.
+    Result (rowcount or rows, time) of each statement is appended to progress['results']
+    when it completes.
     '''
-    dbinfo = engine._getDbInfo(dbid)
-    if dbinfo is None:
-        return
+    statements = limit.split_statements(script)
+    info = engine.getDbInfo(dbid) or {}
+    dialect = info.get('db_type')
+    results = progress.setdefault('results', [])
+    progress['total'] = len(statements)
+    progress['done'] = 0
+
+    usedb=None
+    if 'db' in kwargs:
+        usedb=kwargs['db']
+    eng = engine.getEngine(dbid, usedb)
+    if eng is None:
+        raise Exception(f'connection {dbid} not found')
 
+    in_transaction = bool(kwargs.get('transaction'))
+    changed = ddl = failed = False
+    with eng.connect() as conn:
+        transaction = conn.begin() if in_transaction else None
+        for stmt in statements:
+            item = {'sql': stmt}
+            begin = time.monotonic()
+            try:
+                rc, sql = set_limit(stmt, SCRIPT_MAX_ROWS, SCRIPT_MAX_ROWS, dialect)
+                if not rc:
+                    raise Exception(sql)
+                if not in_transaction:
+                    transaction = conn.begin()
+                result = conn.exec_driver_sql(sql)
+                if result.returns_rows:
+                    rows = result.fetchall()
+                    item['columns'] = list(result.keys())
+                    item['types'] = column_types(rows)
+                    item['data'] = serialize_rows(rows)
+                else:
+                    item['rowcount'] = result.rowcount
+                    changed = True
+                    ddl = ddl or _is_ddl(stmt)
+                if not in_transaction:
+                    transaction.commit()
+            except Exception as err:
+                if transaction is not None and transaction.is_active:
+                    transaction.rollback()
+                item['error'] = str(err)
+                failed = True
+            item['time'] = round(time.monotonic() - begin, 3)
+            results.append(item)
+            progress['done'] += 1
+            if failed:
+                break
+        if in_transaction and not failed:
+            transaction.commit()
+
+    if changed:
+        _result_cache.invalidate(dbid)
+    if ddl:
+        invalidate_meta(dbid)
+    out = {'results': results, 'total': len(statements)}
+    if failed and in_transaction:
+        out['rolled_back'] = True
+    return out
+
+def set_meta_cache(ttl: float, max_size: int)->None:
+    _meta_cache.ttl = ttl
+    _meta_cache.max_size = max_size
+    _meta_cache.invalidate()
+
+def invalidate_meta(dbid: 'str | None' = None)->None:
+    '''
+    drop cached metadata of dbid (all if None), and the catalog snapshot of dbid. The
+    crawler fetches all tables again
+    '''
+    from . import crawler
+    _meta_cache.invalidate(dbid)
+    if dbid is not None:
+        catalog.clear(dbid)
+    crawler.reset(dbid)
+
+def set_catalog_snapshot(enabled: bool)->None:
+    catalog.set_catalog(enabled)
+
+def is_stale(dbid, *key)->bool:
+    '''
+    is the listing (e.g. 'tables', schema) served from the snapshot of a previous session,
+    it is being fetched again
+    '''
+    return catalog.is_stale((dbid,) + key)
+
+def _listing(key: tuple, fetch, refresh=False)->(list, bool):
+    '''
+    a catalog listing from the metadata cache, else from the snapshot (stale and fetched
+    again in background if of a previous session or older than the cache ttl), else
+    fetch() it. Fetched listings are saved in the snapshot. Return (items, stale)
+    '''
+    def load():
+        items = fetch()
+        catalog.put(key, items)
+        return items
+
+    if not refresh and _meta_cache.ttl > 0:
+        items = _meta_cache.peek(key)
+        if items is not None:
+            return items, catalog.is_stale(key)
+        items, fetched = catalog.get_fetched(key)
+        if items is not None:
+            _meta_cache.put(key, items)
+            if fetched >= catalog.started and time.time() - fetched < _meta_cache.ttl:
+                # fetched in this session, e.g. by the crawler
+                return items, False
+            catalog.revalidate(key, lambda: _meta_cache.put(key, load()))
+            return items, True
+    return _meta_cache.get(key, load, refresh), False
+
+def _copy_items(items: list)->list:
+    # comments are matched on copies, the cached items are kept unchanged
+    return [dict(r) for r in items]
+
+def _get_column_info(dbid, dbinfo, db, tbl)->list:
     columns=[]
     eng=engine.getEngine(dbid, db)
     if eng:
@@ -136,18 +415,128 @@ def get_column_info(dbid, db, tbl):
                 else:
                     cols[r['col_name']]={'name': r['col_name'], 'desc': r['comment'], 'type': 'col', 'stype': 'parkey'}
             columns=list(cols.values())
-    columns = comments.match_column(dbid, db, tbl, columns)
     return columns
 
-def get_schema_or_table(dbid, schema):
+def get_column_info(dbid, db, tbl, refresh=False, with_stale=False):
     '''
-    Obtain the schema or table (if there is no scheam layer) of a specified database
-    connection
+    Obtain the columns of a table, set refresh to bypass the metadata cache.
+    With with_stale, return (columns, stale): stale if served from the snapshot
+    '''
+    dbinfo = engine._getDbInfo(dbid)
+    if dbinfo is None:
+        return (None, False) if with_stale else None
+
+    columns, stale = _listing((dbid, 'columns', db, tbl), lambda: _get_column_info(dbid, dbinfo, db, tbl), refresh)
+    columns = comments.match_column(dbid, db, tbl, _copy_items(columns))
+    search.update(dbid, columns, db, tbl)
+    return (columns, stale) if with_stale else columns
+
+def _sql_str(value: str, db_type: str = None)->str:
+    '''
+    string literal of value, MySQL also takes backslash as escape character
+    '''
+    if db_type == engine.DB_MYSQL:
+        value = value.replace('\\', '\\\\')
+    return "'" + value.replace("'", "''") + "'"
+
+def _sql_list(names: list, db_type: str = None)->str:
+    return ', '.join(_sql_str(n, db_type) for n in names)
+
+def _get_schema_columns(dbid, dbinfo, db, tables=None)->dict:
+    '''
+    columns of all tables of schema db (or the tables given) with one catalog query,
+    {table: columns}. Hive has no such catalog, each table is described.
+    '''
+    out={}
+    db_type=dbinfo['db_type']
+    if db_type ==engine.DB_SQLITE:
+        where = f" AND m.name IN ({_sql_list(tables, db_type)})" if tables else ''
+        for r in query(dbid, f'''
+            SELECT m.name, p.name, p.type FROM sqlite_master m JOIN pragma_table_info(m.name) p
+            WHERE m.type IN ('table', 'view'){where}
+            ORDER BY m.name, p.cid
+        '''):
+            out.setdefault(r[0], []).append({'name': r[1], 'desc': r[2], 'type': 'col'})
+    elif db_type ==engine.DB_MYSQL:
+        where = f" AND table_name IN ({_sql_list(tables, db_type)})" if tables else ''
+        for r in query(dbid, f'''
+            SELECT table_name, column_name, column_comment FROM information_schema.columns
+            WHERE table_schema = {_sql_str(db, db_type)}{where}
+            ORDER BY table_name, ordinal_position
+        '''):
+            out.setdefault(r[0], []).append({'name': r[1], 'desc': r[2], 'type': 'col'})
+    elif db_type ==engine.DB_PGSQL:
+        where = f" AND c.table_name IN ({_sql_list(tables, db_type)})" if tables else ''
+        for r in query(dbid, f'''
+            SELECT c.table_name, c.column_name, d.description
+            FROM information_schema.columns c
+            LEFT JOIN pg_catalog.pg_namespace n ON n.nspname = c.table_schema
+            LEFT JOIN pg_catalog.pg_class t ON t.relname = c.table_name AND t.relnamespace = n.oid
+            LEFT JOIN pg_catalog.pg_description d ON d.objoid = t.oid AND d.objsubid = c.ordinal_position
+            WHERE c.table_schema = {_sql_str(db)}{where}
+            ORDER BY c.table_name, c.ordinal_position
+        '''):
+            out.setdefault(r[0], []).append({'name': r[1], 'desc': r[2], 'type': 'col'})
+    elif db_type ==engine.DB_ORACLE:
+        where = f" AND table_name IN ({_sql_list(tables, db_type)})" if tables else ''
+        for r in query(dbid, f'''
+            SELECT table_name, column_name FROM all_tab_columns
+            WHERE owner = {_sql_str(db)}{where}
+            ORDER BY table_name, column_id
+        '''):
+            out.setdefault(r[0], []).append({'name': r[1], 'desc': '', 'type': 'col'})
+    else:
+        if tables is None:
+            tables = [t['name'] for t in _get_schema_or_table(dbid, dbinfo, db)]
+        for tbl in tables:
+            out[tbl] = _get_column_info(dbid, dbinfo, db, tbl)
+    return out
+
+def get_schema_columns(dbid, db, tables: list = None, refresh=False, cache=True)->'dict | None':
+    '''
+    Obtain the columns of all tables of a schema (or the tables given) in one round trip,
+    {table: columns}. The columns of each table are put in the metadata cache, so the
+    tables are not queried again by get_column_info. With cache False (the crawler) they
+    only go to the snapshot, entries already cached are updated.
     '''
     dbinfo = engine._getDbInfo(dbid)
     if dbinfo is None:
         return None
 
+    store = _meta_cache.put if cache else _meta_cache.replace
+    if tables is None:
+        def load():
+            out = _get_schema_columns(dbid, dbinfo, db)
+            listings = [((dbid, 'columns', db, tbl), columns) for tbl, columns in out.items()]
+            for key, columns in listings:
+                store(key, columns)
+            catalog.put_many(dbid, listings)
+            return out
+        result = _meta_cache.get((dbid, 'schema_columns', db), load, refresh) if cache else load()
+    else:
+        result = {}
+        missing = []
+        for tbl in tables:
+            columns = None if refresh else _meta_cache.peek((dbid, 'columns', db, tbl))
+            if columns is None:
+                missing.append(tbl)
+            else:
+                result[tbl] = columns
+        if missing:
+            listings = [((dbid, 'columns', db, tbl), columns)
+                        for tbl, columns in _get_schema_columns(dbid, dbinfo, db, missing).items()]
+            for key, columns in listings:
+                store(key, columns)
+                result[key[-1]] = columns
+            catalog.put_many(dbid, listings)
+
+    out = {}
+    for tbl, columns in result.items():
+        out[tbl] = comments.match_column(dbid, db, tbl, _copy_items(columns))
+        search.update(dbid, out[tbl], db, tbl)
+    return out
+
+def _get_schema_or_table(dbid, dbinfo, schema)->list:
     if dbinfo['db_type'] ==engine.DB_SQLITE:
         tables=[]
         for r in query(dbid, '''
@@ -160,14 +549,12 @@ def get_schema_or_table(dbid, schema):
             FROM sqlite_master where type='table' or type='view'
         '''):
             tables.append({'name': r[0], 'desc': '', 'type': 'table', 'subtype': r[1]})
-        tables = comments.match_table(dbid, '', tables)
         return tables
     elif dbinfo['db_type'] ==engine.DB_PGSQL:
         if schema is None:
             schemas=[]
             for r in query(dbid, "select schema_name from information_schema.schemata where schema_name='public' or schema_owner!='gpadmin'"):
                 schemas.append({'name': r[0], 'desc': '', 'type': 'db'})
-            schemas = comments.match_schema(dbid, schemas)
             return schemas
         else:
             tables=[]
@@ -183,7 +570,6 @@ def get_schema_or_table(dbid, schema):
             WHERE t.table_schema='%s'
             ''' % schema):
                 tables.append({'name': r[0], 'desc': r[2], 'type': 'table', 'subtype': r[1]})
-            tables = comments.match_table(dbid, schema, tables)
             return tables
 
     elif dbinfo['db_type'] ==engine.DB_MYSQL:
@@ -191,7 +577,6 @@ def get_schema_or_table(dbid, schema):
             schemas=[]
             for r in query(dbid, "show databases"):
                 schemas.append({'name': r[0], 'desc': '', 'type': 'db'})
-            schemas = comments.match_schema(dbid, schemas)
             return schemas
         else:
             tables=[]
@@ -207,7 +592,6 @@ def get_schema_or_table(dbid, schema):
                 WHERE table_schema = '%s'
             ''' % schema):
                 tables.append({'name': r[0], 'desc': r[1], 'type': 'table', 'subtype': r[2]})
-            tables = comments.match_table(dbid, schema, tables)
             return tables
 
     else:
@@ -215,12 +599,90 @@ def get_schema_or_table(dbid, schema):
             schemas=[]
             for r in query(dbid, "show databases"):
                 schemas.append({'name': r[0], 'desc': '', 'type': 'db'})
-            schemas = comments.match_schema(dbid, schemas)
             return schemas
         else:
             tables=[]
             for r in query(dbid, "show tables", db=schema):
                 tables.append({'name': r[0], 'desc': '', 'type': 'table'})
-            tables = comments.match_schema(dbid, schema, tables)
             return tables
 
+def get_schema_or_table(dbid, schema, refresh=False, with_stale=False):
+    '''
+    Obtain the schema or table (if there is no scheam layer) of a specified database
+    connection, set refresh to bypass the metadata cache.
+    With with_stale, return (items, stale): stale if served from the snapshot
+    '''
+    dbinfo = engine._getDbInfo(dbid)
+    if dbinfo is None:
+        return (None, False) if with_stale else None
+
+    items, stale = _listing((dbid, 'tables', schema), lambda: _get_schema_or_table(dbid, dbinfo, schema), refresh)
+    items = _copy_items(items)
+    if dbinfo['db_type'] ==engine.DB_SQLITE:
+        items = comments.match_table(dbid, '', items)
+    elif schema is None:
+        items = comments.match_schema(dbid, items)
+    else:
+        items = comments.match_table(dbid, schema, items)
+    search.update(dbid, items, schema)
+    return (items, stale) if with_stale else items
+
+def _table_signatures(dbid, dbinfo, schema)->'dict | None':
+    db_type=dbinfo['db_type']
+    if db_type ==engine.DB_SQLITE:
+        rows = query(dbid, "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'view')")
+    elif db_type ==engine.DB_MYSQL:
+        # create_time changes with ALTER TABLE (the table is rebuilt)
+        rows = query(dbid, f'''
+            SELECT table_name, CONCAT(IFNULL(create_time, ''), '|', IFNULL(update_time, ''))
+            FROM information_schema.tables WHERE table_schema = {_sql_str(schema, db_type)}
+        ''')
+    elif db_type ==engine.DB_PGSQL:
+        # the pg_class row is rewritten (new xmin) by ALTER/COMMENT/ANALYZE of the table
+        rows = query(dbid, f'''
+            SELECT c.relname, c.xmin::text || '|' || c.relnatts
+            FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = {_sql_str(schema)} AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+        ''')
+    else:
+        return None
+    return {r[0]: r[1] for r in rows}
+
+def table_signatures(dbid, schema)->'dict | None':
+    '''
+    change indicator of each table of a schema with one catalog query, {table: signature},
+    None if the database has none. The signature changes when the table is altered.
+    '''
+    dbinfo = engine._getDbInfo(dbid)
+    if dbinfo is None:
+        return None
+    return _table_signatures(dbid, dbinfo, schema)
+
+def build_search_index(dbid):
+    '''
+    list all schemas, tables and columns of a connection to fill its search index, the
+    listings are cached as usual. Progress is in the stats of the index.
+    '''
+    idx = search.get_index(dbid)
+    idx.building = True
+    try:
+        items = get_schema_or_table(dbid, None)
+        if items is None:
+            raise Exception(f'connection {dbid} not found')
+        schemas = [r['name'] for r in items if r['type'] == 'db']
+        if not schemas:
+            # no schema layer, tables are listed
+            schemas = [None]
+        idx.progress = {'schemas': len(schemas), 'done': 0, 'errors': 0}
+        for schema in schemas:
+            try:
+                if schema is not None:
+                    get_schema_or_table(dbid, schema)
+                get_schema_columns(dbid, schema)
+            except Exception as err:
+                # e.g. no privilege on the schema, go on with the others
+                idx.progress['errors'] += 1
+                idx.progress['error'] = f'{schema}: {err}'
+            idx.progress['done'] += 1
+    finally:
+        idx.building = False
@@ -0,0 +1,115 @@
+import os
+import json
+import base64
+import tempfile
+import threading
+
+class ConfigStore:
+    '''
+    Cached view of connection configs: fixed ones from DB_* environment variables and
+    user defined ones from the json config file.
+
+    The file is parsed again only when its mtime/size changed, an env var is decoded
+    again only when its value changed. Callers get copies, so they can modify them freely.
+    '''
+    def __init__(self, passfile: str):
+        self.passfile = passfile
+        self._lock = threading.Lock()
+        self._file_key = None
+        self._file_entries = {}
+        self._env_entries = {}   # var name -> (raw value, decoded info)
+
+    def _path(self) -> str:
+        return os.path.expanduser(self.passfile)
+
+    @staticmethod
+    def _stat_key(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (path, None)
+        return (path, st.st_mtime_ns, st.st_size)
+
+    def _load_file(self) -> dict:
+        '''
+        must hold the lock
+        '''
+        path = self._path()
+        key = self._stat_key(path)
+        if key != self._file_key:
+            dblst = {}
+            if key[1] is not None:
+                with open(path, mode='rt') as f:
+                    try:
+                        dblst = json.load(f)
+                    except Exception:
+                        dblst = {}
+            self._file_entries = dblst
+            self._file_key = key
+        return self._file_entries
+
+    def entries(self) -> dict:
+        '''
+        all entries of config file
+        '''
+        with self._lock:
+            return {k: dict(v) for k, v in self._load_file().items()}
+
+    def get(self, name: str) -> 'dict | None':
+        with self._lock:
+            e = self._load_file().get(name)
+        return None if e is None else dict(e)
+
+    def env_ids(self) -> list:
+        '''
+        dbid of connections set by environment variables
+        '''
+        return [e[3:] for e in os.environ if e[0:3]=='DB_']
+
+    def env_get(self, name: str) -> 'dict | None':
+        var_name = 'DB_' + name
+        db_str = os.getenv(var_name)
+        if db_str is None:
+            return None
+        with self._lock:
+            cached = self._env_entries.get(var_name)
+            if cached is None or cached[0] != db_str:
+                cached = (db_str, json.loads(base64.b64decode(db_str.encode())))
+                self._env_entries[var_name] = cached
+        return dict(cached[1])
+
+    def _write(self, dblst: dict):
+        '''
+        write config file atomically, must hold the lock
+        '''
+        path = self._path()
+        dir_name = os.path.dirname(path)
+        os.makedirs(dir_name, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dir_name, prefix='.db_conf.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wt') as f:
+                f.write(json.dumps(dblst, indent=4))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._file_entries = dblst
+        self._file_key = self._stat_key(path)
+
+    def add(self, dbid: str, dbinfo: dict):
+        with self._lock:
+            dblst = dict(self._load_file())
+            dblst[dbid] = dict(dbinfo)
+            self._write(dblst)
+
+    def delete(self, dbid: str) -> bool:
+        with self._lock:
+            dblst = dict(self._load_file())
+            if dbid not in dblst:
+                return False
+            del dblst[dbid]
+            self._write(dblst)
+            return True
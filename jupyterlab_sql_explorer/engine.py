@@ -1,7 +1,5 @@
 import os
 import re
-import json
-import base64
 import sqlalchemy
 import gettext
 from urllib.parse import quote_plus
@@ -9,6 +7,10 @@ _ = gettext.gettext
 
 from .const import DB_ROOT
 from . import comments
+from . import cancel
+from . import kerberos
+from .registry import EngineRegistry
+from .dbconf import ConfigStore
 
 DB_CFG=DB_ROOT+'db_conf.json'
 
@@ -21,18 +23,17 @@ DB_SQLITE = '6'
 
 _temp_pass_store = dict()
 
-def open_dbfile(dbfile):
-    expanded_file_path = os.path.expanduser(dbfile)
-    dir_name = os.path.dirname(expanded_file_path)
-    os.makedirs(dir_name, exist_ok=True)
-    return open(expanded_file_path, 'wt')
+_engines = EngineRegistry()
+
+_cfg_stores = dict()
+
+def _getCfgStore(passfile=DB_CFG)->ConfigStore:
+    if passfile not in _cfg_stores:
+        _cfg_stores[passfile] = ConfigStore(passfile)
+    return _cfg_stores[passfile]
 
 def _getDBlist()->list:
-    dbs=[]
-    for e in os.environ:
-        if e[0:3]=='DB_':
-            dbs.append(e[3:])
-    return dbs
+    return _getCfgStore().env_ids()
 
 def getDBlist()->list:
     dbs = _getDBlist()
@@ -48,30 +49,16 @@ def getDBlist()->list:
 
     return comments.match_conn(lst)
 
-def _getCfgEntryList(passfile=DB_CFG)->list:
-    passfile= os.path.expanduser(passfile)
-    if os.path.exists(passfile):
-        with open(passfile, mode='rt') as f:
-            try:
-                dblst = json.load(f)
-            except:
-                dblist={}
-    else:
-        dblst={}
-    return dblst
+def _getCfgEntryList(passfile=DB_CFG)->dict:
+    return _getCfgStore(passfile).entries()
 
 def _getCfgEntry(name, passfile=DB_CFG):
-    dblst = _getCfgEntryList(passfile)
-    if name in dblst:
-        return dblst[name]
-    return None
+    return _getCfgStore(passfile).get(name)
 
 def _getDbInfo(name: str)-> 'dict | None':
-    var_name='DB_' + name
-    db_str=os.getenv(var_name)
-
-    if db_str is not None:
-        return json.loads(base64.b64decode(db_str.encode()))
+    info = _getCfgStore().env_get(name)
+    if info is not None:
+        return info
 
     return _getCfgEntry(name)
 
@@ -88,18 +75,23 @@ def _getSQL_engine(dbid, db, usedb=None):
     db_host = db['db_host'] if 'db_host' in db else ''
     db_name = db['db_name'] if 'db_name' in db else ''
 
-    if usedb is not None and db['db_type'] in [DB_MYSQL, DB_HIVE_LDAP, DB_HIVE_KERBEROS]:
-        # 对于 myql, hive database / schema 等价
-        db_name=usedb
+    if db['db_type'] in [DB_MYSQL, DB_HIVE_LDAP, DB_HIVE_KERBEROS]:
+        if usedb is not None:
+            # 对于 myql, hive database / schema 等价
+            db_name=usedb
+    else:
+        # the url does not depend on usedb, one engine for all schemas
+        usedb=None
 
     if db['db_type'] == DB_HIVE_KERBEROS:  # Hive-kerberos
         db_port = db['db_port'] if 'db_port' in db else 10000
         principal = db['principal']
-        os.system(f"kinit -kt /opt/conda/etc/keytab_{dbid} {principal}")
+        ccache = kerberos.ensure_ticket(dbid, principal)
         # from pyhive import hive
         # return hive.connect(host=db_host, port=int(db_port), auth='KERBEROS', kerberos_service_name='hive')
         sqlstr = f"hive://{db_host}:{db_port}/{db_name}"
-        return sqlalchemy.create_engine(sqlstr, connect_args={'auth': 'KERBEROS', 'kerberos_service_name': 'hive'})
+        return _registered_engine(dbid, usedb, sqlstr, ccache=ccache,
+                                  connect_args={'auth': 'KERBEROS', 'kerberos_service_name': 'hive'})
 
     #
     # set user/pass for db exclude DB_SQLITE
@@ -134,37 +126,118 @@ def _getSQL_engine(dbid, db, usedb=None):
         db_port = db['db_port'] if 'db_port' in db else 10000
         # return hive.connect(db_host, port=int(db_port), auth='LDAP', username=db_user, password=db_pass)
         sqlstr = f"hive://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-        return sqlalchemy.create_engine(sqlstr, connect_args={'auth': 'LDAP'})
+        return _registered_engine(dbid, usedb, sqlstr, connect_args={'auth': 'LDAP'})
     elif db['db_type'] == DB_SQLITE:  # SQLITE
         if db_name[0]!='/' and db_name!=':memory:':
             db_name=os.path.expanduser(DB_ROOT+db_name)
 
         # make sure parent dir exists
         dir_name = os.path.dirname(db_name)
-        if not os.path.isdir(dir_name):
+        if dir_name and not os.path.isdir(dir_name):
             os.makedirs(dir_name, exist_ok=True)
 
         sqlstr = f"sqlite+pysqlite:///{db_name}"
-        return sqlalchemy.create_engine(sqlstr)
+        return _registered_engine(dbid, usedb, sqlstr)
     else:
         raise ValueError(("unsupport database type"))
 
-    return sqlalchemy.create_engine(sqlstr, pool_size=20, max_overflow=20, pool_timeout=30000, echo=False)
+    return _registered_engine(dbid, usedb, sqlstr, pool_size=20, max_overflow=20, pool_timeout=30000, echo=False)
+
+def _registered_engine(dbid, usedb, sqlstr, ccache=None, **kwargs):
+    '''
+    get engine from registry, the url (with user/pass) and options are part of the key,
+    so that changed credential will get a new engine. Connections of an engine with a
+    kerberos credential cache ccache are opened with it
+    '''
+    if not sqlstr.startswith('sqlite'):
+        kwargs = dict(_pool_options, **kwargs)
+        if sqlstr.startswith('hive'):
+            # the ping of Hive is a SELECT 1 run as a job
+            kwargs['pool_pre_ping'] = False
+    key = (dbid, usedb, EngineRegistry.fingerprint(sqlstr, sorted(kwargs.items()), ccache))
+
+    def create():
+        eng = cancel.attach(sqlalchemy.create_engine(sqlstr, **kwargs))
+        return kerberos.attach(eng, ccache) if ccache else eng
+    return _engines.get(key, create)
+
+# pool options of database servers: test a pooled connection before it is used, and
+# replace connections older than pool_recycle seconds (-1: never)
+_pool_options = {'pool_pre_ping': False, 'pool_recycle': -1}
+
+def set_pool_options(pre_ping: bool, recycle: float)->None:
+    _pool_options['pool_pre_ping'] = pre_ping
+    _pool_options['pool_recycle'] = int(recycle) if recycle > 0 else -1
+
+def warm_up(dbid: str, count: int)->int:
+    '''
+    open count connections of dbid (at most its pool size) and return them to the pool,
+    so that first requests don't wait for the connection setup. Return the number opened.
+    '''
+    eng = getEngine(dbid)
+    if not eng:
+        return 0
+    if isinstance(eng.pool, sqlalchemy.pool.QueuePool):
+        count = min(count, eng.pool.size())
+    else:
+        count = min(count, 1)
+    conns = []
+    try:
+        for _ in range(count):
+            conns.append(eng.connect())
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns)
+
+def _warm(dbid: str, count: int)->int:
+    st, _ = check_pass(dbid)
+    return warm_up(dbid, count) if st else 0
 
-def __gen_krb5_conf(db):
+def start_warmup(count: int, log)->None:
+    '''
+    warm up the pools of the fixed connections (set by environment variables) in background,
+    in the metadata executor
+    '''
+    if count <= 0:
+        return
+    from tornado.ioloop import IOLoop
+    from . import task
+
+    async def run():
+        for dbid in _getDBlist():
+            try:
+                n = await task.run_blocking(_warm, dbid, count)
+                if n:
+                    log.info(f'warm up {dbid}: {n} connections')
+            except Exception as err:
+                log.warning(f'warm up {dbid}: {err}')
+
+    IOLoop.current().spawn_callback(run)
+
+def set_engine_limits(idle_timeout: float, max_count: int)->None:
+    _engines.idle_timeout = idle_timeout
+    _engines.max_count = max_count
+
+def list_engines()->list:
+    '''
+    list live engines
+    '''
+    _engines.sweep()
+    return _engines.list()
+
+def dispose_engines(dbid: 'str | None' = None)->int:
+    '''
+    dispose engines of dbid, all if dbid is None
+    '''
+    return _engines.dispose(dbid)
+
+def __gen_krb5_conf(dbid, db):
 
     if db['db_type'] != DB_HIVE_KERBEROS:
         return
 
-    default_realm = db['def_realm']
-    with open('/opt/conda/etc/krb5.conf', 'a') as f:
-        f.write(f"[libdefaults]\ndefault_realm = {default_realm}\ndns_lookup_realm = false\ndns_lookup_kdc = false\n\n[realms]\n")
-        for realm, cfg in db['krb5conf'].items():
-            f.write("  %s = {\n" % realm)
-            for k, v in cfg.items():
-                f.write(f"    {k} = {v}\n")
-            f.write("  }\n")
-    # os.system('cat /opt/conda/etc/krb5.conf')
+    kerberos.write_krb5_conf(dbid, db)
 
 def getEngine(dbid, usedb=None):
 
@@ -176,10 +249,10 @@ def getEngine(dbid, usedb=None):
             return False
         newinfo = addEntry(name=dbid)
         return
-        __gen_krb5_conf(newinfo)
+        __gen_krb5_conf(dbid, newinfo)
         return _getSQL_engine(dbid, newinfo, usedb)
     else:
-        __gen_krb5_conf(dbinfo)
+        __gen_krb5_conf(dbid, dbinfo)
         return _getSQL_engine(dbid, dbinfo, usedb)
 
 def addEntry(dbinfo, dbfile=DB_CFG):
@@ -206,8 +279,7 @@ def addEntry(dbinfo, dbfile=DB_CFG):
             err='db name can only contain letters, numbers, and underscores.'
 
     fix_dbs =_getDBlist()
-    dbcfg=_getCfgEntryList(dbfile)
-    if dbid in fix_dbs or dbid in dbcfg:
+    if dbid in fix_dbs or _getCfgEntry(dbid, dbfile) is not None:
         err=f'db_id {dbid} already exists.'
 
     if 'name' not in dbinfo:
@@ -216,19 +288,12 @@ def addEntry(dbinfo, dbfile=DB_CFG):
     if err!='':
         raise Exception(err)
 
-    dbcfg[dbid]=dbinfo
-    cfg=json.dumps(dbcfg, indent=4)
-    with open_dbfile(dbfile) as f:
-        f.write(cfg)
+    _getCfgStore(dbfile).add(dbid, dbinfo)
     return dbinfo
 
 def delEntry(dbid, dbfile=DB_CFG):
-    dbcfg=_getCfgEntryList(dbfile)
-    if dbid in dbcfg:
-        del dbcfg[dbid]
-        cfg=json.dumps(dbcfg, indent=4)
-        with open_dbfile(dbfile) as f:
-            f.write(cfg)
+    _getCfgStore(dbfile).delete(dbid)
+    dispose_engines(dbid)
 
 def check_pass(dbid: str)->(bool, str):
     '''
@@ -261,6 +326,7 @@ def set_pass(dbid: str, user: str, pwd: str)->(bool, str):
             return True, None
         except:
             del _temp_pass_store[dbid]
+            dispose_engines(dbid)
             return False, "user or passwd error"
     else:
         del _temp_pass_store[dbid]
@@ -270,5 +336,8 @@ def clear_pass(dbid: str)->None:
     global _temp_pass_store
     if dbid is None or dbid=='':
         _temp_pass_store=dict()
+        dispose_engines()
     elif dbid in _temp_pass_store:
         del _temp_pass_store[dbid]
+        dispose_engines(dbid)
+
@@ -1,46 +1,149 @@
+import os
 import json
+import asyncio
+import functools
 import traceback
+import concurrent.futures
 from jupyter_server.base.handlers import APIHandler
 from jupyter_server.utils import url_path_join
 import tornado
 from . import engine, db, comments
-from . import task
+from . import task, cancel, search, crawler, catalog
+from .serializer import to_columnar, to_arrow, has_arrow, dumps_bytes, to_csv, to_jsonl, ARROW_MIME, EXPORT_FORMATS
+
+def is_true(v: str)->bool:
+    return v.lower() in ('1', 'true', 'yes')
+
+RESULT_FORMATS = ('rows', 'columns', 'arrow')
+
+def check_format(fmt: str):
+    '''
+    raise if a result can't be sent in fmt, before the result is taken from its task
+    '''
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f'unknown result format {fmt}')
+    if fmt == 'arrow' and not has_arrow():
+        raise ValueError('format arrow needs pyarrow installed')
+
+# rows encoded and sent in one piece when streaming a result
+STREAM_CHUNK_ROWS = 2000
+
+async def _write_array(handler: APIHandler, items: list):
+    '''
+    write a json array chunk by chunk, flush after each chunk
+    '''
+    handler.write(b'[')
+    for i in range(0, len(items), STREAM_CHUNK_ROWS):
+        if i > 0:
+            handler.write(b',')
+        # strip [ ] of the encoded chunk
+        handler.write(dumps_bytes(items[i:i + STREAM_CHUNK_ROWS])[1:-1])
+        await handler.flush()
+    handler.write(b']')
+
+async def write_result(handler: APIHandler, data, fmt: str):
+    '''
+    write a query result in format rows (default), columns (one array per column)
+    or arrow (arrow IPC stream, need pyarrow). Large json results are streamed in
+    chunks of rows, so the encoded response is never in memory as a whole. The
+    connection is closed if streaming fails
+    '''
+    if fmt == 'arrow' and isinstance(data, dict) and 'columns' in data:
+        handler.set_header('Content-Type', ARROW_MIME)
+        handler.finish(to_arrow(data))
+        return
+    if fmt == 'columns' and isinstance(data, dict):
+        data = to_columnar(data)
+
+    rows = data.get('data') if isinstance(data, dict) else None
+    if isinstance(rows, list):
+        nrows = (len(rows[0]) if rows else 0) if data.get('format') == 'columns' else len(rows)
+    if not isinstance(rows, list) or nrows <= STREAM_CHUNK_ROWS:
+        handler.finish(dumps_bytes({'data': data}))
+        return
+
+    handler.set_header('Content-Type', 'application/json')
+    head = {k: v for k, v in data.items() if k != 'data'}
+    handler.write(b'{"data":' + dumps_bytes(head)[:-1] + b',"data":')
+    try:
+        await handler.flush()
+        if data.get('format') == 'columns':
+            handler.write(b'[')
+            for i, col in enumerate(rows):
+                if i > 0:
+                    handler.write(b',')
+                await _write_array(handler, col)
+            handler.write(b']')
+        else:
+            await _write_array(handler, rows)
+    except Exception as err:
+        # part of the result is sent, an error document can't follow it: abort the
+        # response, the client gets an incomplete response instead of broken json
+        handler.log.error(f'result stream aborted: {err}')
+        handler.request.connection.close()
+        handler.finish()
+        return
+    handler.write(b'}}')
+    handler.finish()
 
 class ConnHandler(APIHandler):
     '''
     data source connection handler
     '''
     @tornado.web.authenticated
-    def get(self):
-        self.finish(json.dumps({'data': engine.getDBlist()}))
+    async def get(self):
+        data = await task.run_blocking(engine.getDBlist)
+        self.finish(json.dumps({'data': data}))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         try:
             data = self.get_json_body()
-            engine.addEntry(data)
-            self.finish(json.dumps({'data': engine.getDBlist()}))
+            await task.run_blocking(engine.addEntry, data)
+            data = await task.run_blocking(engine.getDBlist)
+            self.finish(json.dumps({'data': data}))
         except Exception as err:
             self.log.error(err)
             traceback.print_exc()
             self.finish(json.dumps({'error': str(err)}))
 
     @tornado.web.authenticated
-    def put(self):
+    async def put(self):
         try:
             data = self.get_json_body()
-            engine.addEntry(data)
-            self.finish(json.dumps({'data': engine.getDBlist()}))
+            await task.run_blocking(engine.addEntry, data)
+            data = await task.run_blocking(engine.getDBlist)
+            self.finish(json.dumps({'data': data}))
         except Exception as err:
             self.log.error(err)
             traceback.print_exc()
             self.finish(json.dumps({'error': str(err)}))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         dbid=self.get_argument('dbid')
-        engine.delEntry(dbid)
-        self.finish(json.dumps({'data': engine.getDBlist()}))
+        await task.run_blocking(engine.delEntry, dbid)
+        db.invalidate_meta(dbid)
+        db.invalidate_results(dbid)
+        catalog.drop(dbid)
+        search.drop(dbid)
+        crawler.drop(dbid)
+        data = await task.run_blocking(engine.getDBlist)
+        self.finish(json.dumps({'data': data}))
+
+class EngineHandler(APIHandler):
+    '''
+    list/dispose live database engines
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        self.finish(json.dumps({'data': engine.list_engines()}))
+
+    @tornado.web.authenticated
+    def delete(self):
+        dbid=self.get_argument('dbid', None)
+        n=engine.dispose_engines(dbid or None)
+        self.finish(json.dumps({'data': n}))
 
 class DbTableHandler(APIHandler):
     '''
@@ -48,16 +151,20 @@ class DbTableHandler(APIHandler):
      connection
     '''
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         dbid=self.get_argument('dbid')
         database = self.get_argument('db', None)
+        refresh = is_true(self.get_argument('refresh', '0'))
         try:
-            st, db_user=engine.check_pass(dbid)
+            st, db_user=await task.run_blocking(engine.check_pass, dbid)
             if not st:
                 self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
             else:
-                data=db.get_schema_or_table(dbid, database)
-                self.finish(json.dumps({'data': data}))
+                data, stale=await task.run_blocking(db.get_schema_or_table, dbid, database, refresh, True)
+                if stale:
+                    self.finish(json.dumps({'data': data, 'stale': True}))
+                else:
+                    self.finish(json.dumps({'data': data}))
         except Exception as err:
             self.log.error(err)
             traceback.print_exc()
@@ -68,31 +175,130 @@ class TabColumnHandler(APIHandler):
     Retrieve the schema of a database table.
     '''
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         dbid = self.get_argument('dbid')
         database = self.get_argument('db', None)
         tbl = self.get_argument('tbl')
+        refresh = is_true(self.get_argument('refresh', '0'))
         try:
-            st, db_user=engine.check_pass(dbid)
+            st, db_user=await task.run_blocking(engine.check_pass, dbid)
             if not st:
                 self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
             else:
-                data=db.get_column_info(dbid, database, tbl)
-                self.finish(json.dumps({'data': data}))
+                data, stale=await task.run_blocking(db.get_column_info, dbid, database, tbl, refresh, True)
+                if stale:
+                    self.finish(json.dumps({'data': data, 'stale': True}))
+                else:
+                    self.finish(json.dumps({'data': data}))
         except Exception as err:
             self.log.error(err)
             traceback.print_exc()
             self.finish(json.dumps({'error': f"can't get table columns of {tbl}, reason: {str(err)}"}))
 
+class SchemaColumnsHandler(APIHandler):
+    '''
+    Obtain the columns of all tables of a schema (or the tables given, comma separated)
+    in one request
+    '''
+    @tornado.web.authenticated
+    async def get(self):
+        dbid = self.get_argument('dbid')
+        database = self.get_argument('db', None)
+        tables = self.get_argument('tables', None)
+        refresh = is_true(self.get_argument('refresh', '0'))
+        try:
+            st, db_user=await task.run_blocking(engine.check_pass, dbid)
+            if not st:
+                self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
+            else:
+                tables = [t for t in tables.split(',') if t] if tables else None
+                data=await task.run_blocking(db.get_schema_columns, dbid, database, tables, refresh)
+                self.finish(dumps_bytes({'data': data}))
+        except Exception as err:
+            self.log.error(err)
+            traceback.print_exc()
+            self.finish(json.dumps({'error': f"can't get columns of {database}, reason: {str(err)}"}))
+
+class SearchHandler(APIHandler):
+    '''
+    search schemas, tables and columns of a connection by name or comment (GET with q),
+    objects listed so far are searched. POST lists the whole connection to index it
+    '''
+    @tornado.web.authenticated
+    async def get(self):
+        dbid = self.get_argument('dbid')
+        q = self.get_argument('q', '')
+        kind = self.get_argument('type', None)
+        try:
+            limit = max(1, min(int(self.get_argument('limit', '50')), search.MAX_LIMIT))
+        except ValueError:
+            self.finish(json.dumps({'error': 'limit must be a number'}))
+            return
+        if not q:
+            self.finish(json.dumps({'data': search.stats(dbid)}))
+            return
+        data = await task.run_blocking(search.search, dbid, q, limit, kind)
+        self.finish(dumps_bytes({'data': data}))
+
+    @tornado.web.authenticated
+    async def post(self):
+        try:
+            dbid = self.get_json_body()['dbid']
+            st, db_user=await task.run_blocking(engine.check_pass, dbid)
+            if not st:
+                self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
+                return
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+            return
+        if not search.stats(dbid)['building']:
+            search.get_index(dbid).building = True
+            asyncio.ensure_future(self._build(dbid))
+        self.finish(json.dumps({'data': search.stats(dbid)}))
+
+    async def _build(self, dbid):
+        # no timeout, a large connection takes a while
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, db.build_search_index, dbid)
+        except Exception as err:
+            self.log.error(f'build search index of {dbid}: {err}')
+            search.get_index(dbid).building = False
+
+class CrawlerHandler(APIHandler):
+    '''
+    progress of the background metadata crawler (of a connection), POST starts a crawl
+    of a connection now
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        dbid = self.get_argument('dbid', None)
+        self.finish(json.dumps({'data': crawler.status(dbid)}))
+
+    @tornado.web.authenticated
+    async def post(self):
+        try:
+            dbid = self.get_json_body()['dbid']
+            st, db_user=await task.run_blocking(engine.check_pass, dbid)
+            if not st:
+                self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
+                return
+            await crawler.start_crawl(dbid)
+            self.finish(json.dumps({'data': crawler.status(dbid)}))
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+
 class PasswdHandler(APIHandler):
     '''
     Retrieve the schema of a database table.
     '''
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         try:
-            st, msg=engine.set_pass(data['db_id'], data['db_user'], data['db_pass'])
+            st, msg=await task.run_blocking(engine.set_pass, data['db_id'], data['db_user'], data['db_pass'])
             if st:
                 self.finish(json.dumps({'data': 'set passwd ok'}))
             else:
@@ -104,9 +310,9 @@ class PasswdHandler(APIHandler):
     Clear temporary stored password
     '''
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         dbid=self.get_argument('dbid', None)
-        engine.clear_pass(dbid)
+        await task.run_blocking(engine.clear_pass, dbid)
         self.finish(json.dumps({'data': 'delete pass ok'}))
 
 class QueryHandler(APIHandler):
@@ -122,9 +328,18 @@ class QueryHandler(APIHandler):
             st, db_user=engine.check_pass(qdata['dbid'])
             if not st:
                 self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': qdata['dbid'], 'db_user': db_user}}))
+            elif qdata.get('script'):
+                progress = {'done': 0, 'total': 0, 'results': []}
+                taskid = await task.create_query_task(
+                    functools.partial(db.script_exec, transaction=bool(qdata.get('transaction'))),
+                    qdata['dbid'], qdata['sql'], progress, progress=progress)
+                self.finish(json.dumps(task.retry_info(taskid)))
             else:
-                taskid = await task.create_query_task(db.query_exec, qdata['dbid'], qdata['sql'])
-                self.finish(json.dumps({'error': 'RETRY', 'data': taskid}))
+                page_size = int(qdata.get('page_size') or 0)
+                no_cache = bool(qdata.get('no_cache'))
+                taskid = await task.create_query_task(
+                    functools.partial(db.query_exec, page_size=page_size, no_cache=no_cache), qdata['dbid'], qdata['sql'])
+                self.finish(json.dumps(task.retry_info(taskid)))
         except Exception as err:
             self.log.error(err)
             self.finish(json.dumps({'error': str(err)}))
@@ -135,10 +350,12 @@ class QueryHandler(APIHandler):
     @tornado.web.authenticated
     async def get(self):
         task_id=self.get_argument('taskid')
+        fmt=self.get_argument('format', 'rows')
         try:
+            check_format(fmt)
             rc, data = await task.get_result(task_id)
             if rc:
-                self.finish(json.dumps({'data': data}))
+                await write_result(self, data, fmt)
             else:
                 self.finish(json.dumps(data))
         except Exception as err:
@@ -157,6 +374,186 @@ class QueryHandler(APIHandler):
             self.log.error(err)
             self.finish(json.dumps({'error': str(err)}))
 
+class ResultPageHandler(APIHandler):
+    '''
+    get a page of a paged query result
+    '''
+    @tornado.web.authenticated
+    async def get(self):
+        task_id=self.get_argument('taskid')
+        offset=int(self.get_argument('offset', '0'))
+        size=int(self.get_argument('size', '500'))
+        fmt=self.get_argument('format', 'rows')
+        try:
+            check_format(fmt)
+            rc, data = await task.get_page(task_id, offset, size)
+            if rc:
+                await write_result(self, data, fmt)
+            else:
+                self.finish(json.dumps(data))
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+
+# exported chunks waiting to be sent, the query thread waits when it is full
+EXPORT_QUEUE_CHUNKS = 8
+
+class ExportHandler(APIHandler):
+    '''
+    export the whole result of a query (no limit) as csv or json lines.
+    GET streams it to the client, POST writes it to a file under the server root and
+    returns a task to wait for with GET query. Rows exported so far are shown in tasks.
+    '''
+    _taskid = None
+
+    async def _check(self, dbid, fmt) -> bool:
+        if fmt not in EXPORT_FORMATS:
+            self.finish(json.dumps({'error': f'unknown export format {fmt}'}))
+            return False
+        st, db_user=await task.run_blocking(engine.check_pass, dbid)
+        if not st:
+            self.finish(json.dumps({'error': 'NEED-PASS', 'pass_info': {'db_id': dbid, 'db_user': db_user}}))
+            return False
+        return True
+
+    @tornado.web.authenticated
+    async def get(self):
+        dbid=self.get_argument('dbid')
+        sql=self.get_argument('sql')
+        fmt=self.get_argument('format', 'csv')
+        try:
+            if not await self._check(dbid, fmt):
+                return
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+            return
+
+        loop = asyncio.get_event_loop()
+        chunks = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+
+        def write(data: bytes):
+            # runs in the query thread, wait while the client is slow
+            put = asyncio.run_coroutine_threadsafe(chunks.put(data), loop)
+            while True:
+                try:
+                    return put.result(timeout=1)
+                except concurrent.futures.TimeoutError:
+                    if cancel.cancelled():
+                        put.cancel()
+                        raise cancel.QueryCancelled('query cancelled')
+
+        progress = {'rows': 0, 'bytes': 0}
+        self._taskid = await task.create_query_task(db.export_query, dbid, sql, fmt, write, progress, progress=progress)
+        future = task.task_dict[self._taskid].future
+        sent = False
+        try:
+            while True:
+                get = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait({get, future}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    # all chunks are queued before the query thread returns
+                    if chunks.empty():
+                        break
+                    get = asyncio.ensure_future(chunks.get())
+                    await get
+                if not sent:
+                    self.set_header('Content-Type', EXPORT_FORMATS[fmt])
+                    self.set_header('Content-Disposition', f'attachment; filename="export.{fmt}"')
+                    sent = True
+                self.write(get.result())
+                await self.flush()
+            future.result()
+            self.finish()
+        except (tornado.iostream.StreamClosedError, asyncio.CancelledError):
+            await task.delete(self._taskid)
+        except Exception as err:
+            self.log.error(err)
+            if sent:
+                # too late to report, the client gets a truncated file
+                self.finish()
+            else:
+                self.finish(json.dumps({'error': str(err)}))
+        finally:
+            task.task_dict.pop(self._taskid, None)
+
+    def on_connection_close(self):
+        if self._taskid in task.task_dict:
+            asyncio.ensure_future(task.delete(self._taskid))
+
+    @tornado.web.authenticated
+    async def post(self):
+        data = self.get_json_body()
+        fmt = data.get('format', 'csv')
+        try:
+            if not await self._check(data['dbid'], fmt):
+                return
+            root = os.path.realpath(self.settings.get('server_root_dir') or os.getcwd())
+            path = os.path.realpath(os.path.join(root, data['path']))
+            if os.path.commonpath([root, path]) != root:
+                raise ValueError('export path must be under the server root')
+            if os.path.exists(path) and not data.get('overwrite'):
+                raise ValueError(f'{data["path"]} exists, set overwrite to replace it')
+            progress = {'rows': 0, 'bytes': 0, 'path': data['path']}
+            taskid = await task.create_query_task(
+                db.export_file, data['dbid'], data['sql'], fmt, path, progress, progress=progress)
+            self.finish(json.dumps(task.retry_info(taskid)))
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+
+class ScriptHandler(APIHandler):
+    '''
+    results of the statements of a script completed so far, from index since.
+    Get the whole result with GET query when finished
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        task_id=self.get_argument('taskid')
+        since=int(self.get_argument('since', '0'))
+        progress = task.get_progress(task_id)
+        if progress is None or 'results' not in progress:
+            self.finish(json.dumps({'error': 'task not exists'}))
+            return
+        results = progress['results'][since:]
+        self.finish(dumps_bytes({'data': {
+            'results': results,
+            'since': since,
+            'done': progress['done'],
+            'total': progress['total'],
+        }}))
+
+class QueueHandler(APIHandler):
+    '''
+    query scheduler status: running/waiting queries and queue wait time
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        self.finish(json.dumps({'data': task.query_stats()}))
+
+class ResultCacheHandler(APIHandler):
+    '''
+    query result cache: stats, clear (of a connection)
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        self.finish(json.dumps({'data': db.result_cache_stats()}))
+
+    @tornado.web.authenticated
+    def delete(self):
+        dbid=self.get_argument('dbid', None)
+        db.invalidate_results(dbid or None)
+        self.finish(json.dumps({'data': db.result_cache_stats()}))
+
+class TaskHandler(APIHandler):
+    '''
+    list live query tasks with age, state and approximate result size
+    '''
+    @tornado.web.authenticated
+    def get(self):
+        self.finish(json.dumps({'data': task.list_tasks()}))
+
 class CommentsHandler(APIHandler):
     '''
     handler comments
@@ -166,6 +563,7 @@ class CommentsHandler(APIHandler):
         try:
             data = self.get_json_body()
             msg=comments.add(data)
+            search.set_comment(data)
             self.finish(json.dumps({'data': msg}))
         except Exception as err:
             self.log.error(err)
@@ -183,6 +581,63 @@ class CommentsHandler(APIHandler):
             traceback.print_exc()
             self.finish(json.dumps({'error': str(err)}))
 
+class CommentsBulkHandler(APIHandler):
+    '''
+    bulk import (POST a json list, or format=csv/jsonl) and export (GET, format=jsonl/csv)
+    of comments
+    '''
+    @tornado.web.authenticated
+    async def post(self):
+        fmt=self.get_argument('format', 'json')
+        try:
+            items = comments.parse_comments(self.request.body, fmt)
+            # no timeout, large imports take a while
+            loop = asyncio.get_event_loop()
+            n, err = await loop.run_in_executor(None, comments.add_bulk, items)
+            # batches are committed one after another, only the first n items are written
+            for data in items[:n]:
+                search.set_comment(data)
+            if err is not None:
+                self.log.error(err)
+                self.finish(json.dumps({'error': f'{err} ({n} comments imported)', 'data': n}))
+                return
+            self.finish(json.dumps({'data': n}))
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+
+    @tornado.web.authenticated
+    async def get(self):
+        dbid=self.get_argument('dbid', None)
+        fmt=self.get_argument('format', 'jsonl')
+        if fmt not in EXPORT_FORMATS:
+            self.finish(json.dumps({'error': f'unknown export format {fmt}'}))
+            return
+        after = 0
+        try:
+            items, after = await task.run_blocking(comments.export_comments, dbid or None, after)
+        except Exception as err:
+            self.log.error(err)
+            self.finish(json.dumps({'error': str(err)}))
+            return
+        self.set_header('Content-Type', EXPORT_FORMATS[fmt])
+        self.set_header('Content-Disposition', f'attachment; filename="comments.{fmt}"')
+        if fmt == 'csv':
+            self.write(to_csv([comments.COMMENT_FIELDS]))
+        try:
+            while items:
+                if fmt == 'csv':
+                    self.write(to_csv(items))
+                else:
+                    self.write(to_jsonl(comments.COMMENT_FIELDS, items))
+                await self.flush()
+                items, after = await task.run_blocking(comments.export_comments, dbid or None, after)
+        except Exception as err:
+            # the response is started, it can't carry an error any more
+            self.log.error(f'comments export aborted: {err}')
+            self.request.connection.close()
+        self.finish()
+
 def handler_url(base_url, act):
     return url_path_join(base_url, "jupyterlab-sql-explorer", act)
 
@@ -192,10 +647,21 @@ def setup_handlers(web_app):
     base_url=web_app.settings["base_url"]
     handlers=[
         (handler_url(base_url, "conns"), ConnHandler),
+        (handler_url(base_url, "engines"), EngineHandler),
         (handler_url(base_url, "dbtables"), DbTableHandler),
         (handler_url(base_url, "columns"), TabColumnHandler),
+        (handler_url(base_url, "schemacolumns"), SchemaColumnsHandler),
+        (handler_url(base_url, "search"), SearchHandler),
+        (handler_url(base_url, "crawler"), CrawlerHandler),
         (handler_url(base_url, "pass"), PasswdHandler),
         (handler_url(base_url, "query"), QueryHandler),
+        (handler_url(base_url, "result"), ResultPageHandler),
+        (handler_url(base_url, "export"), ExportHandler),
+        (handler_url(base_url, "script"), ScriptHandler),
+        (handler_url(base_url, "queue"), QueueHandler),
+        (handler_url(base_url, "tasks"), TaskHandler),
+        (handler_url(base_url, "cache"), ResultCacheHandler),
         (handler_url(base_url, "comments"), CommentsHandler),
+        (handler_url(base_url, "comments/bulk"), CommentsBulkHandler),
     ]
     web_app.add_handlers(host_pattern, handlers)
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+#
+# Kerberos tickets and krb5.conf of Hive (kerberos) connections.
+#
+# A ticket is obtained with kinit from the keytab of the connection once per principal,
+# and renewed (kinit again) in background before it expires, instead of running kinit
+# for each engine. Each principal has its own credential cache, engines connect with
+# KRB5CCNAME set to the cache of their principal.
+#
+KINIT = 'kinit'
+KLIST = 'klist'
+# keytab of a connection, {dbid} is replaced
+keytab_path = '/opt/conda/etc/keytab_{dbid}'
+krb5_conf = '/opt/conda/etc/krb5.conf'
+# directory of the credential caches
+ccache_dir = os.path.join(tempfile.gettempdir(), f'krb5cc_{os.getuid()}_sql_explorer')
+# seconds a ticket is valid if klist can't tell (ticket_lifetime of the realm), it is
+# renewed after RENEW_AFTER of it
+ticket_lifetime = 10 * 3600
+RENEW_AFTER = 0.8
+KINIT_TIMEOUT = 30
+
+# end time in klist output, MIT (as of the locale) and Heimdal
+KLIST_TIME_FORMATS = ('%m/%d/%Y %H:%M:%S', '%m/%d/%y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+                      '%b %d %H:%M:%S %Y')
+
+def _klist_expires(ccache: str) -> 'float | None':
+    '''
+    end time of the ticket granting ticket in ccache, None if it can't be read
+    '''
+    try:
+        p = subprocess.run([KLIST, '-c', ccache], capture_output=True, text=True, timeout=KINIT_TIMEOUT,
+                           env=dict(os.environ, LC_ALL='C'))
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    for line in p.stdout.splitlines():
+        # valid starting, expires, service principal
+        parts = re.split(r'\s{2,}', line.strip())
+        if len(parts) < 3 or not parts[2].startswith('krbtgt/'):
+            continue
+        for fmt in KLIST_TIME_FORMATS:
+            try:
+                return time.mktime(time.strptime(parts[1], fmt))
+            except ValueError:
+                pass
+    return None
+
+class Ticket:
+    def __init__(self, principal: str, keytab: str):
+        self.principal = principal
+        self.keytab = keytab
+        self.ccache = 'FILE:' + os.path.join(ccache_dir, 'krb5cc_' + hashlib.sha256(principal.encode()).hexdigest()[:16])
+        self.obtained = 0.0
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+    def due(self, now: float) -> bool:
+        return now >= self.obtained + (self.expires - self.obtained) * RENEW_AFTER
+
+    def kinit(self):
+        os.makedirs(ccache_dir, mode=0o700, exist_ok=True)
+        p = subprocess.run([KINIT, '-c', self.ccache, '-kt', self.keytab, self.principal],
+                           capture_output=True, text=True, timeout=KINIT_TIMEOUT)
+        if p.returncode != 0:
+            raise Exception(f'kinit {self.principal} failed: {(p.stderr or p.stdout).strip()}')
+        self.obtained = time.time()
+        self.expires = _klist_expires(self.ccache) or self.obtained + ticket_lifetime
+
+_tickets = {}       # principal -> Ticket
+_lock = threading.Lock()
+
+def configure(keytab: str = None, conf: str = None, lifetime: float = None):
+    global keytab_path, krb5_conf, ticket_lifetime
+    if keytab:
+        keytab_path = keytab
+    if conf:
+        krb5_conf = conf
+    if lifetime:
+        ticket_lifetime = lifetime
+
+def ensure_ticket(dbid: str, principal: str) -> str:
+    '''
+    make sure there is a valid ticket of principal, kinit with the keytab of dbid if not.
+    Return the credential cache of the ticket
+    '''
+    with _lock:
+        t = _tickets.get(principal)
+        if t is None:
+            t = _tickets[principal] = Ticket(principal, keytab_path.format(dbid=dbid))
+    if not t.due(time.time()):
+        return t.ccache
+    with t.lock:
+        # another thread may have renewed it
+        if t.due(time.time()):
+            t.kinit()
+    return t.ccache
+
+# KRB5CCNAME is process wide, connections of kerberos engines are opened one at a time
+_env_lock = threading.Lock()
+
+def attach(engine, ccache: str):
+    '''
+    open the connections of engine with the credential cache ccache
+    '''
+    from sqlalchemy import event
+
+    def do_connect(dialect, conn_rec, cargs, cparams):
+        with _env_lock:
+            old = os.environ.get('KRB5CCNAME')
+            os.environ['KRB5CCNAME'] = ccache
+            try:
+                return dialect.connect(*cargs, **cparams)
+            finally:
+                if old is None:
+                    os.environ.pop('KRB5CCNAME', None)
+                else:
+                    os.environ['KRB5CCNAME'] = old
+
+    event.listen(engine, 'do_connect', do_connect)
+    return engine
+
+def renew() -> int:
+    '''
+    renew tickets which are due, return the count
+    '''
+    with _lock:
+        tickets = list(_tickets.values())
+    n = 0
+    now = time.time()
+    for t in tickets:
+        if not t.due(now):
+            continue
+        try:
+            with t.lock:
+                t.kinit()
+            n += 1
+        except Exception as err:
+            # tried again by the next renew or connection
+            print(err)
+    return n
+
+def tickets() -> list:
+    with _lock:
+        return [{'principal': t.principal, 'ccache': t.ccache, 'obtained': t.obtained, 'expires': t.expires}
+                for t in _tickets.values()]
+
+def forget(principal: str = None):
+    with _lock:
+        if principal is None:
+            _tickets.clear()
+        else:
+            _tickets.pop(principal, None)
+
+# the realms are written between these lines of krb5.conf, the rest of the file is kept
+BEGIN_MARK = '# BEGIN jupyterlab-sql-explorer'
+END_MARK = '# END jupyterlab-sql-explorer'
+
+_realms = {}        # realm -> settings of all connections
+_default_realms = {}    # dbid -> def_realm of the connection
+_conf_hash = None   # hash of the content written
+
+def render_krb5_conf() -> str:
+    '''
+    the managed part of krb5.conf. The default realm is the first (by name) of the
+    connections, it doesn't change with the connection used last
+    '''
+    lines = [BEGIN_MARK, '[libdefaults]']
+    if _default_realms:
+        lines.append(f'default_realm = {min(_default_realms.values())}')
+    lines += ['dns_lookup_realm = false', 'dns_lookup_kdc = false', '', '[realms]']
+    for realm in sorted(_realms):
+        lines.append(f'  {realm} = {{')
+        for k, v in _realms[realm].items():
+            lines.append(f'    {k} = {v}')
+        lines.append('  }')
+    lines.append(END_MARK)
+    return '\n'.join(lines) + '\n'
+
+def _merge(old: str, block: str) -> str:
+    '''
+    old content of krb5.conf with its managed part replaced by block
+    '''
+    begin = old.find(BEGIN_MARK + '\n')
+    end = old.find(END_MARK + '\n', begin)
+    if begin >= 0 and end >= 0:
+        return old[:begin] + block + old[end + len(END_MARK) + 1:]
+    if old and not old.endswith('\n'):
+        old += '\n'
+    return old + block
+
+def write_krb5_conf(dbid: str, dbinfo: dict) -> bool:
+    '''
+    add the realms of connection dbid to krb5.conf. The file is written only when its
+    content changes, return True if written
+    '''
+    global _conf_hash
+    with _lock:
+        if dbinfo.get('def_realm'):
+            _default_realms[dbid] = dbinfo['def_realm']
+        for realm, cfg in (dbinfo.get('krb5conf') or {}).items():
+            _realms[realm] = dict(cfg)
+        block = render_krb5_conf()
+        h = hashlib.sha256(block.encode()).hexdigest()
+        if h == _conf_hash:
+            return False
+        try:
+            with open(krb5_conf) as f:
+                old = f.read()
+        except FileNotFoundError:
+            old = ''
+        content = _merge(old, block)
+        if content == old:
+            _conf_hash = h
+            return False
+
+        _write_file(krb5_conf, content)
+        _conf_hash = h
+        return True
+
+def _write_file(path: str, content: str):
+    '''
+    replace the file atomically keeping its mode, in place if its directory is not writable
+    '''
+    dirname = os.path.dirname(path) or '.'
+    os.makedirs(dirname, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+    if not os.access(dirname, os.W_OK):
+        with open(path, 'w') as f:
+            f.write(content)
+        return
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.krb5.conf.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+_renewer = None
+
+def start_renewer(interval: float = 300):
+    global _renewer
+    from tornado.ioloop import PeriodicCallback
+
+    async def _renew():
+        await asyncio.get_event_loop().run_in_executor(None, renew)
+
+    if _renewer is not None:
+        _renewer.stop()
+        _renewer = None
+    if interval > 0:
+        _renewer = PeriodicCallback(lambda: asyncio.ensure_future(_renew()), interval * 1000)
+        _renewer.start()
@@ -0,0 +1,264 @@
+'''
+Limit the rows of a SELECT statement, in the form of the database dialect:
+
+- LIMIT n [OFFSET m]                 mysql, postgresql, sqlite (and unknown)
+- LIMIT [m,] n                       hive
+- [OFFSET m ROWS] FETCH FIRST n ROWS ONLY   oracle
+- SELECT TOP n                       kept in place if the statement uses it
+
+Only the trailing clause of the statement is tokenized: the statement is scanned once
+(with a regex) for quotes, comments, parentheses and semicolons, the limit clause can
+only be after the last top level closing parenthesis or string.
+'''
+import re
+import functools
+from . import engine
+
+# quoted strings/identifiers, comments, parentheses and semicolons
+_SCAN_ITEMS = r'''
+    '(?:[^'\\]|\\.|'')*'
+  | "(?:[^"]|"")*"
+  | `[^`]*`
+  | --[^\n]*
+  | /\*.*?(?:\*/|\Z)
+  | [();]
+'''
+_SCAN = re.compile(_SCAN_ITEMS, re.S | re.X)
+
+# ... and the statement verbs, to find the statement type after WITH
+_VERB_SCAN = re.compile(_SCAN_ITEMS + r'| \b(?:SELECT|INSERT|UPDATE|DELETE|MERGE|UPSERT|REPLACE)\b', re.S | re.I | re.X)
+
+_HEAD = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/|\()*(\w+)', re.S)
+
+_TOP = re.compile(r'''
+    (?:\s+|--[^\n]*|/\*.*?\*/|\()*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?TOP\s*
+    (?:(\d+)|\(\s*(\d+)\s*\))(\s+PERCENT\b)?
+''', re.S | re.I | re.X)
+
+_BLANK = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/)*\Z', re.S)
+
+_TAIL_KEYWORD = re.compile(r'\b(?:LIMIT|OFFSET|FETCH)\b', re.I)
+
+# LIMIT ALL
+_ALL = -1
+
+_TOKEN = re.compile(r"\s+|--[^\n]*|/\*.*?(?:\*/|\Z)|\w+|'(?:[^']|'')*'|\S", re.S)
+
+class _Tokens:
+    '''
+    code tokens (no whitespaces and comments) of the tail of a statement
+    '''
+    def __init__(self, text: str, base: int):
+        self.items = []     # (upper value, start, end)
+        for m in _TOKEN.finditer(text):
+            v = m.group()
+            if v[0].isspace() or v.startswith('--') or v.startswith('/*'):
+                continue
+            self.items.append((v.upper(), base + m.start(), base + m.end()))
+
+    def value(self, i: int) -> str:
+        return self.items[i][0] if i < len(self.items) else ''
+
+    def number(self, i: int) -> 'int | None':
+        v = self.value(i)
+        return int(v) if v.isdigit() else None
+
+def _parse_fetch(t: _Tokens, i: int) -> 'tuple | None':
+    '''
+    FETCH {FIRST|NEXT} [n] {ROW|ROWS} ONLY at i, return (n, next index)
+    '''
+    if t.value(i) != 'FETCH' or t.value(i + 1) not in ('FIRST', 'NEXT'):
+        return None
+    i += 2
+    n = t.number(i)
+    if n is None:
+        n = 1
+    else:
+        i += 1
+    if t.value(i) not in ('ROW', 'ROWS') or t.value(i + 1) != 'ONLY':
+        return None
+    return n, i + 2
+
+def _parse_clause(t: _Tokens, i: int) -> 'tuple | None':
+    '''
+    parse the limit clause starting at token i, return (limit, offset, next index),
+    limit is None if not given. None if it is not a limit clause
+    '''
+    kw = t.value(i)
+    if kw == 'LIMIT':
+        n = t.number(i + 1)
+        if n is None:
+            if t.value(i + 1) == 'ALL':
+                limit, offset, i = _ALL, None, i + 2
+            else:
+                raise Exception("Sql Error")
+        elif t.value(i + 2) == ',':
+            # mysql/hive: LIMIT offset, count
+            limit = t.number(i + 3)
+            if limit is None:
+                raise Exception("Sql Error")
+            offset, i = n, i + 4
+        else:
+            limit, offset, i = n, None, i + 2
+        if offset is None and t.value(i) == 'OFFSET' and t.number(i + 1) is not None:
+            offset, i = t.number(i + 1), i + 2
+        return limit, offset, i
+    if kw == 'OFFSET':
+        offset = t.number(i + 1)
+        if offset is None:
+            return None
+        i += 2
+        if t.value(i) in ('ROW', 'ROWS'):
+            i += 1
+        if t.value(i) == 'LIMIT':
+            limit = t.number(i + 1)
+            if limit is None:
+                raise Exception("Sql Error")
+            return limit, offset, i + 2
+        fetch = _parse_fetch(t, i)
+        if fetch is not None:
+            return fetch[0], offset, fetch[1]
+        return None, offset, i
+    if kw == 'FETCH':
+        fetch = _parse_fetch(t, i)
+        if fetch is not None:
+            return fetch[0], None, fetch[1]
+    return None
+
+def _limit_clause(dialect: str, limit: int, offset: 'int | None') -> str:
+    if dialect == engine.DB_ORACLE:
+        out = f' OFFSET {offset} ROWS' if offset else ''
+        return out + f' FETCH FIRST {limit} ROWS ONLY'
+    if dialect in (engine.DB_HIVE_LDAP, engine.DB_HIVE_KERBEROS):
+        return f' LIMIT {offset}, {limit}' if offset else f' LIMIT {limit}'
+    out = f' LIMIT {limit}'
+    return out + f' OFFSET {offset}' if offset else out
+
+def _main_verb(sql: str, end: int) -> 'str | None':
+    '''
+    the first verb out of parentheses, e.g. of WITH ... SELECT
+    '''
+    depth = 0
+    for m in _VERB_SCAN.finditer(sql, 0, end):
+        c = m.group()[0]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif depth == 0 and c.isalpha():
+            return m.group().upper()
+    return None
+
+def statement_verb(sql: str) -> 'str | None':
+    '''
+    verb of one statement in upper case (SELECT, INSERT, CREATE, ...), the main verb after
+    WITH. None if it has no code
+    '''
+    head = _HEAD.match(sql)
+    if head is None:
+        return None
+    first = head.group(1).upper()
+    if first == 'WITH':
+        return _main_verb(sql, len(sql))
+    return first
+
+def _use_limit(limit, def_lim: int, max_lim: int) -> int:
+    if limit is None:
+        return def_lim
+    if limit == _ALL:
+        return max_lim
+    return limit if limit <= max_lim else max_lim
+
+# statements longer than this are not cached, the cache would keep large scripts alive
+CACHE_MAX_SQL = 4096
+
+def set_limit(sql: str, def_lim: int = 200, max_lim: int = 10000, dialect: str = None) -> (bool, str):
+    '''
+    Limit the rows of a select statement to def_lim if it has no limit, or to max_lim
+    if its limit is larger. Return (False, message) if sql is not one statement.
+    dialect is the db_type of the connection.
+    '''
+    if len(sql) > CACHE_MAX_SQL:
+        return _set_limit(sql, def_lim, max_lim, dialect)
+    return _cached_set_limit(sql, def_lim, max_lim, dialect)
+
+def _set_limit(sql: str, def_lim: int, max_lim: int, dialect: str) -> (bool, str):
+    depth = 0
+    tail_start = 0
+    end = len(sql)
+    line_comment = None
+    for m in _SCAN.finditer(sql):
+        c = m.group()[0]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                tail_start = m.end()
+        elif c == ';':
+            if depth == 0:
+                if not _BLANK.match(sql, m.end()):
+                    return False, 'can only process one statement'
+                end = m.start()
+                break
+        elif c == '-':
+            line_comment = m.end()
+        elif c in '\'"`':
+            if depth == 0:
+                tail_start = m.end()
+
+    head = _HEAD.match(sql, 0, end)
+    if head is None:
+        return False, 'can only process one statement'
+    first = head.group(1).upper()
+    if first != 'SELECT' and (first != 'WITH' or _main_verb(sql, end) != 'SELECT'):
+        return True, sql
+
+    top = _TOP.match(sql, 0, end)
+    if top is not None:
+        if top.group(3):
+            return True, sql
+        g = 1 if top.group(1) else 2
+        n = _use_limit(int(top.group(g)), def_lim, max_lim)
+        return True, sql[:top.start(g)] + str(n) + sql[top.end(g):end]
+
+    body = sql[:end]
+    limit, offset = None, None
+    if _TAIL_KEYWORD.search(body, tail_start):
+        t = _Tokens(body[tail_start:], tail_start)
+        for i, (v, start, _) in enumerate(t.items):
+            if v not in ('LIMIT', 'OFFSET', 'FETCH'):
+                continue
+            clause = _parse_clause(t, i)
+            if clause is not None:
+                limit, offset, j = clause
+                stop = t.items[j - 1][2]
+                body = body[:start] + body[stop:]
+                break
+
+    if line_comment is not None and sql[line_comment:end].strip() == '':
+        # do not append to a line comment
+        body += '\n'
+    return True, body + _limit_clause(dialect, _use_limit(limit, def_lim, max_lim), offset)
+
+_cached_set_limit = functools.lru_cache(maxsize=128)(_set_limit)
+
+def split_statements(sql: str) -> list:
+    '''
+    split a script by semicolons out of quotes, comments and parentheses, statements
+    without code are dropped. Procedural blocks with semicolons inside are not supported.
+    '''
+    out = []
+    depth = 0
+    start = 0
+    for m in _SCAN.finditer(sql):
+        c = m.group()[0]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ';' and depth == 0:
+            out.append(sql[start:m.start()])
+            start = m.end()
+    out.append(sql[start:])
+    return [stmt.strip() for stmt in out if not _BLANK.match(stmt)]
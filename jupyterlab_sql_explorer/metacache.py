@@ -0,0 +1,80 @@
+import time
+import threading
+from collections import OrderedDict
+
+class MetaCache:
+    '''
+    TTL cache for metadata listings (schemas, tables, columns) of connections.
+
+    Keys are tuples starting with the dbid, so all entries of a connection can be
+    invalidated at once. At most max_size entries are kept (least recently used first out).
+    Cached values are shared, callers must not modify them.
+    '''
+    def __init__(self, ttl: float = 300, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()   # key -> (expire time, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, load, refresh: bool = False):
+        '''
+        return the cached value of key, call load() if not cached, expired or refresh is set
+        '''
+        now = time.monotonic()
+        if not refresh and self.ttl > 0:
+            with self._lock:
+                e = self._data.get(key)
+                if e is not None:
+                    if e[0] > now:
+                        self._data.move_to_end(key)
+                        return e[1]
+                    del self._data[key]
+
+        value = load()
+        self.put(key, value)
+        return value
+
+    def peek(self, key: tuple):
+        '''
+        return the cached value of key or None, not load
+        '''
+        with self._lock:
+            e = self._data.get(key)
+            if e is not None and e[0] > time.monotonic():
+                return e[1]
+        return None
+
+    def put(self, key: tuple, value):
+        if value is None or self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def replace(self, key: tuple, value):
+        '''
+        update key if it is cached, it is not added nor made more recent
+        '''
+        if value is None:
+            return
+        with self._lock:
+            if key in self._data:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, dbid: 'str | None' = None, *prefix):
+        '''
+        remove entries of dbid (all if dbid is None), optionally only those whose key
+        continues with prefix
+        '''
+        with self._lock:
+            if dbid is None:
+                self._data.clear()
+                return
+            k = (dbid,) + prefix
+            for key in [key for key in self._data if key[:len(k)] == k]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
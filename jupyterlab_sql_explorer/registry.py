@@ -0,0 +1,123 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+class EngineRegistry:
+    '''
+    Process-wide registry of live sqlalchemy engines.
+
+    Engines are keyed by (dbid, usedb, fingerprint), where fingerprint is a hash of the
+    connection url and its options, so a changed password or config gets a new engine.
+    Engines idle longer than idle_timeout seconds are disposed, and at most max_count
+    engines are kept (least recently used first out).
+    '''
+    def __init__(self, idle_timeout: float = 600, max_count: int = 32):
+        self.idle_timeout = idle_timeout
+        self.max_count = max_count
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(*args) -> str:
+        h = hashlib.sha256()
+        for a in args:
+            h.update(repr(a).encode())
+            h.update(b'\0')
+        return h.hexdigest()[:16]
+
+    def get(self, key: tuple, create):
+        '''
+        return the engine of key, call create() to make one if not exists
+        '''
+        now = time.monotonic()
+        with self._lock:
+            e = self._engines.get(key)
+            if e is not None:
+                e['last_used'] = now
+                self._engines.move_to_end(key)
+                return e['engine']
+
+        eng = create()
+        if not eng:
+            return eng
+
+        dispose = []
+        with self._lock:
+            e = self._engines.get(key)
+            if e is not None:
+                # another thread created it first
+                dispose.append(eng)
+                eng = e['engine']
+                e['last_used'] = now
+            else:
+                self._engines[key] = {'engine': eng, 'created': now, 'last_used': now}
+            self._engines.move_to_end(key)
+            dispose += self._evict(now)
+        self._dispose(dispose)
+        return eng
+
+    def _evict(self, now: float) -> list:
+        '''
+        remove idle and overflow entries, must hold the lock. return engines to dispose
+        '''
+        out = []
+        for key in list(self._engines):
+            if now - self._engines[key]['last_used'] > self.idle_timeout:
+                out.append(self._engines.pop(key)['engine'])
+        while len(self._engines) > self.max_count:
+            _, e = self._engines.popitem(last=False)
+            out.append(e['engine'])
+        return out
+
+    @staticmethod
+    def _dispose(engines: list):
+        for eng in engines:
+            try:
+                eng.dispose()
+            except Exception:
+                pass
+
+    def sweep(self) -> int:
+        '''
+        dispose engines which idle too long, return count of disposed
+        '''
+        with self._lock:
+            out = self._evict(time.monotonic())
+        self._dispose(out)
+        return len(out)
+
+    def dispose(self, dbid: 'str | None' = None) -> int:
+        '''
+        dispose all engines of dbid, or all engines if dbid is None
+        '''
+        with self._lock:
+            keys = [k for k in self._engines if dbid is None or k[0] == dbid]
+            out = [self._engines.pop(k)['engine'] for k in keys]
+        self._dispose(out)
+        return len(out)
+
+    def list(self) -> list:
+        '''
+        info of live engines
+        '''
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._engines.items())
+        lst = []
+        for (dbid, usedb, _), e in items:
+            try:
+                pool = e['engine'].pool.status()
+            except Exception:
+                pool = ''
+            lst.append({
+                'dbid': dbid,
+                'db': usedb,
+                'age': round(now - e['created'], 1),
+                'idle': round(now - e['last_used'], 1),
+                'pool': pool
+            })
+        return lst
+
+    def __len__(self):
+        return len(self._engines)
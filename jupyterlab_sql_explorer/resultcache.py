@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    '''
+    Cache of query results, bounded by the total (approximate) size in bytes, least
+    recently used results are dropped first. Keys are tuples starting with the dbid.
+    Each entry has its own ttl, so connections can keep results for different times.
+    '''
+    def __init__(self, ttl: float = 0, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (expire time, created, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> 'tuple | None':
+        '''
+        return (value, age in seconds) or None
+        '''
+        now = time.monotonic()
+        with self._lock:
+            e = self._data.get(key)
+            if e is not None:
+                if e[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return e[3], now - e[1]
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, value, size: int, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (now + ttl, now, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        self.bytes -= self._data.pop(key)[2]
+
+    def invalidate(self, dbid: 'str | None' = None):
+        with self._lock:
+            if dbid is None:
+                self._data.clear()
+                self.bytes = 0
+                return
+            for key in [key for key in self._data if key[0] == dbid]:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._data)
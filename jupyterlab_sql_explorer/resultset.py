@@ -0,0 +1,193 @@
+import os
+import threading
+from .const import DB_ROOT
+from .serializer import serialize_rows, estimate_size, column_types
+from . import spool
+from .spool import Spool
+
+# rows of a result are moved to a spool file when they use more memory than spool_bytes, 0 to disable
+spool_bytes = 16 * 1024 * 1024
+spool_dir = DB_ROOT + 'spool/'
+# rows of a batch in the spool file
+SPOOL_BATCH_ROWS = 1000
+
+def set_spool(max_bytes: int, dirname: str = None):
+    '''
+    set at start, the spool files left by stopped servers are deleted
+    '''
+    global spool_bytes, spool_dir
+    spool_bytes = max_bytes
+    if dirname:
+        spool_dir = dirname
+    spool.clear(os.path.expanduser(spool_dir))
+
+class ResultHandle:
+    '''
+    An open query result, rows are fetched from the (server side) cursor when a page
+    needs them and kept for later pages. The connection is released when all rows are
+    fetched or the handle is closed.
+
+    Large results are spooled: the leading rows are moved to a file, only the rows
+    fetched since then stay in memory.
+    '''
+    def __init__(self, conn, transaction, result, max_rows: int, page_size: int):
+        self._conn = conn
+        self._transaction = transaction
+        self._result = result
+        self._lock = threading.Lock()
+        self._close_lock = threading.Lock()
+        self._on_close = None
+        self._spool = None
+        self.columns = list(result.keys())
+        self.types = ['null'] * len(self.columns)
+        self.rows = []          # rows after the spooled ones
+        self.spooled = 0
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.done = False
+        self.truncated = False
+        self.size = estimate_size(self.columns)
+        self.cached = None      # age of the cached result it was made from
+        self.on_complete = None # called with the handle when all rows are fetched
+
+    @classmethod
+    def from_rows(cls, columns: list, types: list, rows: list, page_size: int) -> 'ResultHandle':
+        '''
+        a handle of a result already fetched
+        '''
+        h = cls.__new__(cls)
+        h._conn = h._transaction = h._result = None
+        h._lock = threading.Lock()
+        h._close_lock = threading.Lock()
+        h._on_close = None
+        h._spool = None
+        h.columns = columns
+        h.types = types
+        h.rows = rows
+        h.spooled = 0
+        h.max_rows = len(rows)
+        h.page_size = page_size
+        h.done = True
+        h.truncated = False
+        h.size = estimate_size(columns) + estimate_size(rows)
+        h.cached = None
+        h.on_complete = None
+        return h
+
+    @property
+    def count(self) -> int:
+        return self.spooled + len(self.rows)
+
+    def _fill(self, n: int):
+        '''
+        fetch rows until there are n rows or no more, must hold the lock
+        '''
+        n = min(n, self.max_rows)
+        while not self.done and self.count < n:
+            want = n - self.count
+            raw = self._result.fetchmany(want)
+            if 'null' in self.types:
+                self.types = column_types(raw, self.types)
+            batch = serialize_rows(raw)
+            self.rows.extend(batch)
+            self.size += estimate_size(batch)
+            if spool_bytes > 0 and self.size > spool_bytes:
+                self._spool_rows()
+            if len(batch) < want:
+                self._close()
+                if self.on_complete is not None and self.spooled == 0:
+                    self.on_complete(self)
+            elif self.count >= self.max_rows:
+                self.truncated = self._result.fetchmany(1) != []
+                self._close()
+
+    def _spool_rows(self):
+        '''
+        move rows in memory to the spool file, must hold the lock
+        '''
+        if self._spool is None:
+            self._spool = Spool(os.path.expanduser(spool_dir))
+        for i in range(0, len(self.rows), SPOOL_BATCH_ROWS):
+            self._spool.append(self.rows[i:i + SPOOL_BATCH_ROWS])
+        self.spooled += len(self.rows)
+        self.rows = []
+        self.size = estimate_size(self.columns)
+
+    def _rows(self, start: int, end: int) -> list:
+        out = []
+        if start < self.spooled:
+            out = self._spool.read(start, min(end, self.spooled))
+        start = max(start, self.spooled) - self.spooled
+        end = end - self.spooled
+        if end > start:
+            out.extend(self.rows[start:end])
+        return out
+
+    def page(self, offset: int, size: int) -> dict:
+        '''
+        rows [offset, offset+size), blocks when rows need to be fetched
+        '''
+        with self._lock:
+            # one more row to know if there are more
+            self._fill(offset + size + 1)
+            end = offset + size
+            page = {
+                'columns': self.columns,
+                'types': self.types,
+                'data': self._rows(offset, end),
+                'offset': offset,
+                'more': self.count > end,
+                'total': self.count if self.done else None,
+                'truncated': self.truncated
+            }
+            if self.cached is not None:
+                page['cached'] = self.cached
+            return page
+
+    def set_on_close(self, callback) -> bool:
+        '''
+        call callback() when the connection is released, False if it is released already
+        '''
+        with self._close_lock:
+            if self.done:
+                return False
+            self._on_close = callback
+            return True
+
+    def _close(self):
+        if self.done:
+            return
+        self.done = True
+        try:
+            self._result.close()
+            if self._transaction.is_active:
+                self._transaction.commit()
+        finally:
+            self._conn.close()
+            with self._close_lock:
+                callback, self._on_close = self._on_close, None
+            if callback is not None:
+                callback()
+
+    def close(self):
+        '''
+        release the connection, fetched rows are kept
+        '''
+        with self._lock:
+            if not self.done:
+                self.truncated = True
+            self._close()
+
+    def discard(self):
+        '''
+        release the connection and drop all rows, delete the spool file
+        '''
+        with self._lock:
+            try:
+                self._close()
+            finally:
+                self.rows = []
+                self.spooled = 0
+                if self._spool is not None:
+                    self._spool.remove()
+                    self._spool = None
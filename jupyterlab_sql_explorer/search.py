@@ -0,0 +1,185 @@
+import bisect
+import threading
+import itertools
+from . import comments_db
+
+# rank of the object types when names match equally well
+KIND_RANK = {'table': 0, 'col': 1, 'db': 2}
+
+# max results of a search
+MAX_LIMIT = 1000
+
+# max matches of one kind (exact/prefix, substring, comment) ranked for a search
+MAX_CANDIDATES = 5000
+
+def _path(*parts) -> tuple:
+    # sqlite has no schema layer, its tables are at the root
+    return tuple(p for p in parts if p)
+
+class SearchIndex:
+    '''
+    Names and comments of the schemas, tables and columns of a connection, added
+    as they are listed from the catalog.
+
+    Objects are keyed by their path: (schema,), (schema, table), (schema, table, column).
+    The names (and comments) are joined in one lower case text on the first search after a
+    change, matches are found with str.find on it.
+    '''
+    def __init__(self):
+        self._items = {}        # path -> (kind, name, desc)
+        self._children = {}     # path -> names of the children
+        self._lock = threading.Lock()
+        self._version = 0
+        self._text = None       # (entries, name starts, names text, comment starts, comments text)
+        self.building = False
+        self.progress = {}
+
+    def update(self, parent: tuple, items: list):
+        '''
+        set the children of parent to items (listed by get_schema_or_table/get_column_info),
+        children not in items are removed with their descendants
+        '''
+        with self._lock:
+            changed = False
+            names = set()
+            for r in items:
+                path = parent + (r['name'],)
+                names.add(r['name'])
+                value = (r['type'], r['name'], r.get('desc') or '')
+                if self._items.get(path) != value:
+                    self._items[path] = value
+                    changed = True
+            gone = self._children.get(parent, set()) - names
+            for name in gone:
+                self._remove(parent + (name,))
+            self._children[parent] = names
+            if changed or gone:
+                self._changed()
+
+    def _remove(self, path: tuple):
+        self._items.pop(path, None)
+        for name in self._children.pop(path, ()):
+            self._remove(path + (name,))
+
+    def _changed(self):
+        self._version += 1
+        self._text = None
+
+    def set_desc(self, path: tuple, desc: str):
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None and item[2] != (desc or ''):
+                self._items[path] = (item[0], item[1], desc or '')
+                self._changed()
+
+    def _build(self):
+        with self._lock:
+            if self._text is not None:
+                return self._text
+            entries = list(self._items.items())
+            version = self._version
+        names = [v[1].lower().replace('\n', ' ') for _, v in entries]
+        descs = [v[2].lower().replace('\n', ' ') for _, v in entries]
+        # start of each entry in the texts, entries are enclosed by '\n'
+        name_starts = list(itertools.accumulate((len(s) + 1 for s in names), initial=1))
+        desc_starts = list(itertools.accumulate((len(s) + 1 for s in descs), initial=1))
+        text = (entries, name_starts, '\n' + '\n'.join(names) + '\n',
+                desc_starts, '\n' + '\n'.join(descs) + '\n')
+        with self._lock:
+            if self._version == version:
+                self._text = text
+        return text
+
+    def __len__(self):
+        return len(self._items)
+
+    def search(self, q: str, limit: int = 50, kind: str = None) -> list:
+        '''
+        objects whose name or comment contains q (case insensitive), best first: exact
+        name, name prefix, name substring, then comment matches. Ties are ranked by type
+        (table, column, schema) and name length.
+        '''
+        q = q.lower().strip()
+        if not q or '\n' in q:
+            return []
+        entries, name_starts, names, desc_starts, descs = self._build()
+
+        found = {}      # entry index -> (score, ...)
+        def scan(text, starts, needle, score_of, skip=0):
+            # a match at pos is in the entry starting before pos + skip
+            n = 0
+            pos = text.find(needle)
+            while pos >= 0 and n < MAX_CANDIDATES:
+                i = bisect.bisect_right(starts, pos + skip) - 1
+                if i not in found:
+                    path, (k, name, _) = entries[i]
+                    if kind is None or k == kind:
+                        found[i] = (score_of(i), KIND_RANK.get(k, 3), len(name), name.lower(), path)
+                        n += 1
+                pos = text.find(needle, starts[i + 1] - skip)
+
+        def name_score(i):
+            return 0 if name_starts[i + 1] - name_starts[i] - 1 == len(q) else 1
+
+        # exact and prefix: q after the '\n' before an entry
+        scan(names, name_starts, '\n' + q, name_score, 1)
+        if len(found) < limit:
+            scan(names, name_starts, q, lambda i: 2)
+        if len(found) < limit:
+            scan(descs, desc_starts, q, lambda i: 3)
+
+        out = []
+        for i, _ in sorted(found.items(), key=lambda e: e[1])[:limit]:
+            path, (k, name, desc) = entries[i]
+            out.append({'name': name, 'type': k, 'desc': desc, 'path': list(path)})
+        return out
+
+_indexes = {}       # dbid -> SearchIndex
+_lock = threading.Lock()
+
+def get_index(dbid: str, create: bool = True) -> 'SearchIndex | None':
+    with _lock:
+        idx = _indexes.get(dbid)
+        if idx is None and create:
+            idx = _indexes[dbid] = SearchIndex()
+        return idx
+
+def update(dbid: str, items: list, *parent):
+    '''
+    set the listed children of parent (schema, table names; None/'' if no schema layer)
+    '''
+    get_index(dbid).update(_path(*parent), items)
+
+# path length of the objects of each comment type, connections are not indexed
+_COMMENT_DEPTH = {comments_db.C_SCHEMA: 1, comments_db.C_TABLE: 2, comments_db.C_COLUMN: 3}
+
+def set_comment(data: dict):
+    '''
+    apply a comment set by the user (fields of comments.add) to the index
+    '''
+    try:
+        type = int(data['type'])
+        idx = get_index(data['dbid'], False)
+    except (KeyError, TypeError, ValueError):
+        return
+    depth = _COMMENT_DEPTH.get(type)
+    if idx is None or depth is None:
+        return
+    parts = [data.get('schema'), data.get('table'), data.get('column')][:depth]
+    idx.set_desc(_path(*parts), data.get('comment'))
+
+def drop(dbid: str):
+    with _lock:
+        _indexes.pop(dbid, None)
+
+def search(dbid: str, q: str, limit: int = 50, kind: str = None) -> list:
+    idx = get_index(dbid, False)
+    if idx is None:
+        return []
+    return idx.search(q, limit, kind)
+
+def stats(dbid: str) -> dict:
+    idx = get_index(dbid, False)
+    if idx is None:
+        return {'objects': 0, 'building': False}
+    return {'objects': len(idx), 'building': idx.building, 'progress': dict(idx.progress)}
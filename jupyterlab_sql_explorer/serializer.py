@@ -1,3 +1,7 @@
+import io
+import csv
+import json
+import functools
 import datetime
 import uuid
 import decimal
@@ -39,3 +43,212 @@ DISPATCHER = {
     list: _list_processor,
     decimal.Decimal: _decimal_processor,
 }
+
+
+def make_plan(rows: list) -> list:
+    '''
+    (column index, type, processor) for columns which need conversion, decided by
+    the first non-null value of each column
+    '''
+    if not rows:
+        return []
+    plan = []
+    for i in range(len(rows[0])):
+        for row in rows:
+            value = row[i]
+            if value is not None:
+                processor = DISPATCHER.get(type(value))
+                if processor is not None:
+                    plan.append((i, type(value), processor))
+                break
+    return plan
+
+
+def _converter(type_, processor):
+    def convert(v):
+        return processor(v) if type(v) is type_ else _make_value_serializable(v)
+    return convert
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_plan(plan: tuple):
+    '''
+    make a function converting one row by plan, columns not in plan are copied as is.
+    values of other types than planned (mixed type columns) fall back to the dispatcher
+    '''
+    convs = tuple((i, _converter(type_, processor)) for i, type_, processor in plan)
+    def convert(r):
+        r = list(r)
+        for i, f in convs:
+            r[i] = f(r[i])
+        return tuple(r)
+    return convert
+
+
+def serialize_rows(rows: list, plan: list = None) -> list:
+    '''
+    make rows json serializable with a per column plan, columns need no conversion are
+    not touched. A value not converted by the plan is handled by json_default
+    '''
+    if not rows:
+        return []
+    if plan is None:
+        plan = make_plan(rows)
+    if not plan:
+        return [tuple(row) for row in rows]
+    convert = _compile_plan(tuple(plan))
+    return list(map(convert, rows))
+
+
+def json_default(value):
+    '''
+    default of json.dumps for values missed by the serialize plan
+    '''
+    processor = DISPATCHER.get(type(value))
+    if processor is not None:
+        return processor(value)
+    return str(value)
+
+
+def dumps(obj) -> str:
+    return json.dumps(obj, default=json_default)
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_bytes(obj) -> bytes:
+    '''
+    json encode, use orjson if installed
+    '''
+    if orjson is not None:
+        # datetime goes to json_default, the same as the json module
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return dumps(obj).encode()
+
+
+def loads_bytes(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def estimate_size(rows: list, sample: int = 100) -> int:
+    '''
+    approximate json size of rows, only some rows are encoded
+    '''
+    n = len(rows)
+    if n == 0:
+        return 0
+    step = max(1, n // sample)
+    part = rows[::step]
+    try:
+        return len(dumps(part)) * n // len(part)
+    except Exception:
+        return 0
+
+
+TYPE_NAMES = {
+    bool: 'bool',
+    int: 'int',
+    float: 'float',
+    str: 'string',
+    bytes: 'binary',
+    decimal.Decimal: 'decimal',
+    datetime.datetime: 'datetime',
+    datetime.date: 'date',
+    datetime.time: 'time',
+    uuid.UUID: 'uuid',
+    list: 'list',
+    dict: 'object',
+}
+
+
+def column_types(rows: list, types: list = None) -> list:
+    '''
+    type name of each column from the first non-null value, columns already known
+    in types are kept
+    '''
+    if not rows:
+        return types or []
+    ncol = len(rows[0])
+    types = list(types) if types else ['null'] * ncol
+    for i in range(ncol):
+        if types[i] != 'null':
+            continue
+        for row in rows:
+            if row[i] is not None:
+                types[i] = TYPE_NAMES.get(type(row[i]), 'object')
+                break
+    return types
+
+
+def to_columnar(result: dict) -> dict:
+    '''
+    convert a row oriented result to one array per column
+    '''
+    if 'columns' not in result:
+        return result
+    out = dict(result)
+    rows = result['data']
+    if rows:
+        out['data'] = [list(col) for col in zip(*rows)]
+    else:
+        out['data'] = [[] for _ in result['columns']]
+    out['format'] = 'columns'
+    return out
+
+
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def has_arrow() -> bool:
+    return pa is not None
+
+
+def to_arrow(result: dict) -> bytes:
+    '''
+    encode a result as arrow IPC stream, other keys of result are set in schema metadata.
+    need pyarrow
+    '''
+    if pa is None:
+        raise ValueError('format arrow needs pyarrow installed')
+    columns = result.get('columns', [])
+    rows = result.get('data', [])
+    arrays = []
+    for i, col in enumerate(zip(*rows) if rows else [() for _ in columns]):
+        try:
+            arrays.append(pa.array(col))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            arrays.append(pa.array([None if v is None else str(v) for v in col], type=pa.string()))
+    meta = {k: dumps(v) for k, v in result.items() if k not in ('columns', 'data')}
+    table = pa.Table.from_arrays(arrays, names=[str(c) for c in columns], metadata=meta)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def to_csv(rows: list) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode()
+
+
+def to_jsonl(columns: list, rows: list) -> bytes:
+    '''
+    one json object per row
+    '''
+    return b''.join(dumps_bytes(dict(zip(columns, row))) + b'\n' for row in rows)
@@ -0,0 +1,100 @@
+import os
+import mmap
+import bisect
+import tempfile
+from .serializer import dumps_bytes, loads_bytes
+
+SUFFIX = '.spool'
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+def clear(dirname: str) -> int:
+    '''
+    delete the spool files left in dirname by servers that are not running any more (files
+    are prefixed with the pid of their server), return the count
+    '''
+    try:
+        names = os.listdir(dirname)
+    except FileNotFoundError:
+        return 0
+    n = 0
+    for name in names:
+        pid = name.split('-', 1)[0]
+        if not name.endswith(SUFFIX) or (pid.isdigit() and _alive(int(pid))):
+            continue
+        try:
+            os.unlink(os.path.join(dirname, name))
+            n += 1
+        except OSError:
+            pass
+    return n
+
+class Spool:
+    '''
+    Rows of a query result kept in a file. Rows are appended in batches (json encoded),
+    and read back through a memory map of the file, only the batches of the requested
+    rows are decoded.
+    '''
+    def __init__(self, dirname: str):
+        os.makedirs(dirname, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(suffix=SUFFIX, prefix=f'{os.getpid()}-', dir=dirname)
+        self._file = os.fdopen(fd, 'w+b')
+        self._starts = []       # first row of each batch
+        self._spans = []        # (offset, length) of each batch in the file
+        self._mmap = None
+        self.count = 0
+        self.bytes = 0
+
+    def append(self, rows: list):
+        if not rows:
+            return
+        data = dumps_bytes(rows)
+        self._file.write(data)
+        self._starts.append(self.count)
+        self._spans.append((self.bytes, len(data)))
+        self.count += len(rows)
+        self.bytes += len(data)
+        self._unmap()
+
+    def read(self, start: int, end: int) -> list:
+        '''
+        rows [start, end)
+        '''
+        end = min(end, self.count)
+        if start >= end:
+            return []
+        if self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        out = []
+        i = bisect.bisect_right(self._starts, start) - 1
+        while i < len(self._starts) and self._starts[i] < end:
+            offset, length = self._spans[i]
+            rows = loads_bytes(self._mmap[offset:offset + length])
+            first = self._starts[i]
+            out.extend(rows[max(start - first, 0):end - first])
+            i += 1
+        return out
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def remove(self):
+        '''
+        close and delete the file
+        '''
+        self._unmap()
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
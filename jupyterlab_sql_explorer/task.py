@@ -1,33 +1,452 @@
 import asyncio
 import uuid
+import time
+import functools
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from . import cancel
+from .serializer import estimate_size
+from .resultset import ResultHandle
 
 task_dict={}
 
-async def create_query_task(*args):
+# executor for short blocking calls (metadata, connections), separated from queries
+_meta_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='sql-explorer-meta')
+_meta_timeout = 60
+
+def set_meta_executor(workers: int, timeout: float):
+    global _meta_executor, _meta_timeout
+    old = _meta_executor
+    _meta_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sql-explorer-meta')
+    _meta_timeout = timeout
+    old.shutdown(wait=False)
+
+async def _run_in(executor, timeout: float, func, *args, **kwargs):
     loop=asyncio.get_event_loop()
-    future = loop.run_in_executor(None, *args)
+    future = loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f'timeout after {timeout} seconds')
+
+async def run_blocking(func, *args, **kwargs):
+    '''
+    run func in the metadata executor, so the event loop is not blocked.
+    raise TimeoutError if it takes longer than the metadata timeout (the call itself keeps
+    running in its thread until the driver returns)
+    '''
+    return await _run_in(_meta_executor, _meta_timeout, func, *args, **kwargs)
+
+def call_blocking(func, *args, **kwargs):
+    '''
+    run_blocking for background threads: run func in the metadata executor and wait for
+    it at most the metadata timeout
+    '''
+    future = _meta_executor.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=_meta_timeout)
+    except concurrent.futures.TimeoutError:
+        raise TimeoutError(f'timeout after {_meta_timeout} seconds')
+
+# executor and timeout for fetching pages of open results, which may wait for the database
+_page_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='sql-explorer-page')
+_page_timeout = 300
+
+def set_page_timeout(timeout: float):
+    global _page_timeout
+    _page_timeout = timeout
+
+async def _fetch_page(h: ResultHandle, offset: int, size: int) -> dict:
+    return await _run_in(_page_executor, _page_timeout, h.page, offset, size)
+
+class QueryScheduler:
+    '''
+    Run queries with at most max_running at the same time, and at most max_per_conn
+    for one connection. Others wait in a FIFO queue; a query whose connection is
+    full does not block queries of other connections behind it.
+    '''
+    def __init__(self, max_running: int = 8, max_per_conn: int = 4):
+        self.max_running = max_running
+        self.max_per_conn = max_per_conn
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix='sql-explorer-query')
+        self._waiting = []      # FIFO of waiting entries
+        self._running = {}      # dbid -> number of running queries
+        self._open = {}         # dbid -> number of open paged results (holding a connection)
+        self.on_full = None     # called with dbid when open results block a query of dbid
+        self._total_running = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _dispatch(self):
+        for entry in list(self._waiting):
+            if self._total_running >= self.max_running:
+                break
+            dbid = entry['dbid']
+            running = self._running.get(dbid, 0)
+            if running + self._open.get(dbid, 0) >= self.max_per_conn:
+                if running < self.max_per_conn and self.on_full is not None:
+                    self.on_full(dbid)
+                continue
+            self._waiting.remove(entry)
+            self._running[dbid] = self._running.get(dbid, 0) + 1
+            self._total_running += 1
+            entry['slot'].set_result(True)
+
+    def _release(self, dbid):
+        self._running[dbid] -= 1
+        if self._running[dbid] == 0:
+            del self._running[dbid]
+        self._total_running -= 1
+        self._dispatch()
+
+    def hold(self, dbid):
+        '''
+        a paged result of dbid keeps its connection open, it counts for max_per_conn
+        '''
+        self._open[dbid] = self._open.get(dbid, 0) + 1
+
+    def unhold(self, dbid):
+        self._open[dbid] -= 1
+        if self._open[dbid] == 0:
+            del self._open[dbid]
+        self._dispatch()
+
+    def submit(self, key, dbid, func, *args) -> asyncio.Future:
+        '''
+        queue func(*args), return a future of its result
+        '''
+        loop = asyncio.get_event_loop()
+        entry = {'key': key, 'dbid': dbid, 'slot': loop.create_future(), 'queued': time.monotonic()}
+        self._waiting.append(entry)
+        self._dispatch()
+        return asyncio.ensure_future(self._run(entry, func, *args))
+
+    async def _run(self, entry, func, *args):
+        '''
+        wait for a slot, then run func(*args) in the query executor
+        '''
+        loop = asyncio.get_event_loop()
+        dbid = entry['dbid']
+        try:
+            await entry['slot']
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            elif entry['slot'].done() and not entry['slot'].cancelled():
+                self._release(dbid)
+            raise
+
+        wait = time.monotonic() - entry['queued']
+        self._started += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+        cf = self._executor.submit(_run_task, entry['key'], func, *args)
+        try:
+            return await asyncio.wrap_future(cf)
+        finally:
+            if cf.done():
+                self._release(dbid)
+            else:
+                # cancelled while running, the slot is in use until the thread returns
+                cf.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, dbid))
+
+    def position(self, key) -> int:
+        '''
+        1-based position in the wait queue, 0 if not waiting
+        '''
+        for i, entry in enumerate(self._waiting):
+            if entry['key'] == key:
+                return i + 1
+        return 0
+
+    def stats(self) -> dict:
+        return {
+            'max_running': self.max_running,
+            'max_per_conn': self.max_per_conn,
+            'running': dict(self._running),
+            'open': dict(self._open),
+            'waiting': len(self._waiting),
+            'started': self._started,
+            'wait_avg': round(self._wait_total / self._started, 3) if self._started else 0,
+            'wait_max': round(self._wait_max, 3),
+        }
+
+def _run_task(taskid, func, *args):
+    with cancel.running(taskid) as q:
+        result = func(*args)
+        if q.cancelled and isinstance(result, ResultHandle):
+            # nobody will read it
+            result.discard()
+        return result
+
+def _release_idle(dbid):
+    '''
+    release the connection of the least recently used open result of dbid, so a waiting
+    query can run. The rows fetched so far are kept
+    '''
+    tasks = [t for t in task_dict.values() if t.dbid == dbid and t.handle is not None and not t.handle.done]
+    if tasks and not any(t.releasing for t in tasks):
+        # one at a time, the query is dispatched when it is released
+        min(tasks, key=lambda t: t.last_access).release()
+
+_scheduler = QueryScheduler()
+_scheduler.on_full = _release_idle
+
+def set_query_limits(max_running: int, max_per_conn: int):
+    global _scheduler
+    old = _scheduler
+    _scheduler = QueryScheduler(max_running, max_per_conn)
+    _scheduler.on_full = _release_idle
+    old._executor.shutdown(wait=False)
+
+def query_stats() -> dict:
+    return _scheduler.stats()
+
+def running_queries(dbid) -> int:
+    '''
+    number of queries of dbid running now, can be called from any thread
+    '''
+    return _scheduler._running.get(dbid, 0)
+
+class QueryTask:
+    '''
+    a query task and its retained result
+    '''
+    def __init__(self, taskid, dbid, future):
+        self.taskid = taskid
+        self.dbid = dbid
+        self.future = future
+        self.created = time.monotonic()
+        self.finished = None
+        self.last_access = self.created
+        self.size = 0
+        self.expired = False
+        self.progress = None
+        self.releasing = False
+
+    @property
+    def state(self) -> str:
+        if self.expired:
+            return 'expired'
+        if not self.future.done():
+            return 'queued' if _scheduler.position(self.taskid) else 'running'
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.exception() is not None:
+            return 'error'
+        return 'done'
+
+    @property
+    def handle(self) -> 'ResultHandle | None':
+        '''
+        the open result if the query is paged
+        '''
+        if self.state == 'done':
+            result = self.future.result()
+            if isinstance(result, ResultHandle):
+                return result
+        return None
+
+    def release(self):
+        '''
+        release the database connection of a paged result
+        '''
+        h = self.handle
+        if h is not None and not h.done and not self.releasing:
+            self.releasing = True
+            _meta_executor.submit(h.close)
+
+    def discard(self):
+        '''
+        release the connection and delete the rows of a paged result (including spool file)
+        '''
+        h = self.handle
+        if h is not None:
+            _meta_executor.submit(h.discard)
+
+    def expire(self):
+        '''
+        drop the result, keep the task so the client gets a meaningful error
+        '''
+        self.discard()
+        self.expired = True
+        self.future = None
+        self.size = 0
+
+    def info(self) -> dict:
+        now = time.monotonic()
+        return {
+            'taskid': self.taskid,
+            'dbid': self.dbid,
+            'state': self.state,
+            'age': round(now - self.created, 1),
+            'idle': round(now - self.last_access, 1),
+            'size': self.size,
+            'queue': _scheduler.position(self.taskid),
+            # lists (e.g. results of a script) are too large for a summary
+            'progress': None if self.progress is None else
+                {k: v for k, v in self.progress.items() if not isinstance(v, list)}
+        }
+
+# seconds a finished task is kept
+task_ttl = 3600
+# max bytes (approximate json size) of retained results
+task_max_bytes = 512 * 1024 * 1024
+# seconds the cursor of a paged result is kept open without page requests
+cursor_idle_timeout = 300
+
+def set_task_limits(ttl: float, max_bytes: int, cursor_idle: float = 300):
+    global task_ttl, task_max_bytes, cursor_idle_timeout
+    task_ttl = ttl
+    task_max_bytes = max_bytes
+    cursor_idle_timeout = cursor_idle
+
+def _estimate_size(result) -> int:
+    '''
+    approximate json size of a query result
+    '''
+    if isinstance(result, ResultHandle):
+        return result.size
+    if isinstance(result, dict) and isinstance(result.get('data'), list):
+        return estimate_size(result['data']) + estimate_size(result.get('columns') or [])
+    return estimate_size([result])
+
+def _on_done(t: QueryTask):
+    t.finished = time.monotonic()
+    if t.state == 'done':
+        h = t.handle
+        if h is not None:
+            # the open result counts for the connection limit until it is released
+            scheduler = _scheduler
+            loop = asyncio.get_event_loop()
+            if h.set_on_close(lambda: loop.call_soon_threadsafe(scheduler.unhold, t.dbid)):
+                scheduler.hold(t.dbid)
+        t.size = _estimate_size(t.future.result())
+        _enforce_budget()
+
+def _enforce_budget():
+    '''
+    expire least recently used results until the retained size is under budget
+    '''
+    done = [t for t in task_dict.values() if t.size > 0]
+    total = sum(t.size for t in done)
+    if total <= task_max_bytes:
+        return
+    for t in sorted(done, key=lambda t: t.last_access):
+        total -= t.size
+        t.expire()
+        if total <= task_max_bytes:
+            break
+
+def sweep() -> int:
+    '''
+    remove tasks finished longer than task_ttl, return count of removed
+    '''
+    now = time.monotonic()
+    old = [k for k, t in task_dict.items() if t.finished is not None and now - t.finished > task_ttl]
+    for k in old:
+        task_dict.pop(k).discard()
+    for t in task_dict.values():
+        if now - t.last_access > cursor_idle_timeout:
+            t.release()
+    _enforce_budget()
+    return len(old)
+
+_sweeper = None
+
+def start_sweeper(interval: float = 60):
+    global _sweeper
+    from tornado.ioloop import PeriodicCallback
+    if _sweeper is not None:
+        _sweeper.stop()
+    _sweeper = PeriodicCallback(sweep, interval * 1000)
+    _sweeper.start()
+
+def list_tasks() -> list:
+    return [t.info() for t in task_dict.values()]
+
+async def create_query_task(func, dbid, *args, progress: dict = None):
+    '''
+    queue func(dbid, *args), progress is a dict func updates, shown in list_tasks
+    '''
     taskid = str(uuid.uuid4())
-    task_dict[taskid] = future
+    future = _scheduler.submit(taskid, dbid, func, dbid, *args)
+    t = QueryTask(taskid, dbid, future)
+    t.progress = progress
+    future.add_done_callback(lambda _: _on_done(t))
+    task_dict[taskid] = t
     return taskid
 
+def retry_info(taskid) -> dict:
+    '''
+    long poll response of a task not finished yet
+    '''
+    return {'error': 'RETRY', 'data': taskid, 'queue': _scheduler.position(taskid)}
+
 async def get_result(taskid, timeout=118):
 
     if taskid not in task_dict:
         return False, {'error': 'task not exists'}
 
-    future = task_dict[taskid]
+    t = task_dict[taskid]
+    t.last_access = time.monotonic()
+    if t.expired:
+        del task_dict[taskid]
+        return False, {'error': 'query result expired, please run it again'}
+
+    future = t.future
     done, _ = await asyncio.wait({future}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
     if future in done:
         result = future.result()
-        del task_dict[taskid]
+        if isinstance(result, ResultHandle):
+            # keep the task for later pages
+            return True, await _fetch_page(result, 0, result.page_size)
+        task_dict.pop(taskid, None)
         return True, result
     else:
-        return False, {'error': 'RETRY', 'data': taskid}
+        return False, retry_info(taskid)
+
+async def get_page(taskid, offset: int, size: int):
+    '''
+    get a page of a paged result
+    '''
+    if taskid not in task_dict:
+        return False, {'error': 'task not exists'}
+
+    t = task_dict[taskid]
+    t.last_access = time.monotonic()
+    if t.expired:
+        del task_dict[taskid]
+        return False, {'error': 'query result expired, please run it again'}
+
+    h = t.handle
+    if h is None:
+        return False, {'error': 'result of task is not paged or not ready'}
+    data = await _fetch_page(h, offset, size)
+    t.size = h.size
+    _enforce_budget()
+    return True, data
+
+def get_progress(taskid) -> 'dict | None':
+    '''
+    progress of a task (e.g. results of completed statements of a script), None if the
+    task does not exist or has no progress
+    '''
+    t = task_dict.get(taskid)
+    if t is None:
+        return None
+    t.last_access = time.monotonic()
+    return t.progress
 
 async def delete(taskid):
     if taskid not in task_dict:
         return False
-    future = task_dict[taskid]
-    future.cancel()
-    del task_dict[taskid]
-    return True
\ No newline at end of file
+    t = task_dict.pop(taskid)
+    if t.future is not None:
+        t.future.cancel()
+        t.discard()
+    # stop the statement on the database server, so the thread is released
+    await run_blocking(cancel.cancel, taskid)
+    return True
@@ -1,11 +1,28 @@
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import os
 import json
+import pytest
 from .. import comments_db
 from .. import comments
 
 TESTDB = '/tmp/unit_test_comments.db'
 
+@pytest.fixture(autouse=True)
+def restore_comments():
+    '''
+    tests init their own stores, the store of the server is restored after each test
+    '''
+    saved = (comments.comments_store, comments._last_id, set(comments._recent), dict(comments._index),
+             comments._reloader, comments_db._conn_str, comments_db._engine, comments_db._Session)
+    yield
+    if comments_db._engine is not None and comments_db._engine is not saved[6]:
+        comments_db._engine.dispose()
+    (comments.comments_store, comments._last_id, comments._recent, index,
+     comments._reloader, comments_db._conn_str, comments_db._engine, comments_db._Session) = saved
+    with comments._index_lock:
+        comments._index.clear()
+        comments._index.update(index)
+
 # def setup_function():
 #     comments_db.init("sqlite:///" + TESTDB)
 
@@ -98,4 +115,122 @@ async def test_comments_handler(jp_fetch):
     payload = json.loads(response.body)
     assert payload == {
         'data': 'set comment ok'
-    }
\ No newline at end of file
+    }
+
+def test_comments_index(tmp_path):
+    comments.init("database::sqlite:///" + str(tmp_path / 'comments.db'))
+    comments.add({'type': comments_db.C_COLUMN, 'dbid': 'con1', 'schema': 's1', 'table': 't1', 'column': 'c1', 'comment': 'c1'})
+    assert comments.match_column('con1', 's1', 't1', [{'name': 'c1'}]) == [{'name': 'c1', 'desc': 'c1'}]
+
+    # warm: the store is not read, writes go through to the index
+    with patch("jupyterlab_sql_explorer.comments_db.get_column_comments") as load:
+        comments.add({'type': comments_db.C_COLUMN, 'dbid': 'con1', 'schema': 's1', 'table': 't1', 'column': 'c2', 'comment': 'c2'})
+        assert comments.match_column('con1', 's1', 't1', [{'name': 'c1'}, {'name': 'c2'}]) == \
+            [{'name': 'c1', 'desc': 'c1'}, {'name': 'c2', 'desc': 'c2'}]
+        load.assert_not_called()
+
+    # written by another server sharing the store
+    comments_db.set_comments(type=comments_db.C_COLUMN, dbid='con1', schema='s1', table='t1', column='c1', comment='new')
+    assert comments.match_column('con1', 's1', 't1', [{'name': 'c1'}]) == [{'name': 'c1', 'desc': 'c1'}]
+    assert comments.reload() == 3
+    assert comments.match_column('con1', 's1', 't1', [{'name': 'c1'}]) == [{'name': 'c1', 'desc': 'new'}]
+    assert comments.reload() == 0
+
+    # a comment committed after one with a larger id was read
+    with comments_db._Session() as session:
+        session.add(comments_db.Comments(id=10, type=comments_db.C_COLUMN, dbid='con1', schema='s1', tabname='t1', colname='c2', memo='c2 new'))
+        session.commit()
+    assert comments.reload() == 1
+    with comments_db._Session() as session:
+        session.add(comments_db.Comments(id=8, type=comments_db.C_COLUMN, dbid='con1', schema='s1', tabname='t1', colname='c1', memo='c1 late'))
+        session.commit()
+    assert comments.reload() == 1
+    assert comments.match_column('con1', 's1', 't1', [{'name': 'c1'}, {'name': 'c2'}]) == \
+        [{'name': 'c1', 'desc': 'c1 late'}, {'name': 'c2', 'desc': 'c2 new'}]
+    assert comments.reload() == 0
+
+def test_comments_index_no_schema(tmp_path):
+    comments.init("database::sqlite:///" + str(tmp_path / 'comments.db'))
+    assert comments.match_table('lite', None, [{'name': 't1'}]) == [{'name': 't1'}]
+    comments.add({'type': comments_db.C_TABLE, 'dbid': 'lite', 'schema': None, 'table': 't1', 'comment': 'first'})
+    assert comments.match_table('lite', None, [{'name': 't1'}]) == [{'name': 't1', 'desc': 'first'}]
+    comments.add({'type': comments_db.C_COLUMN, 'dbid': 'lite', 'schema': None, 'table': 't1', 'column': 'c1', 'comment': 'col'})
+    assert comments.match_column('lite', None, 't1', [{'name': 'c1'}]) == [{'name': 'c1', 'desc': 'col'}]
+    # the rows reloaded from the store have '' for no schema, the same entries are updated
+    comments_db.set_comments(type=comments_db.C_TABLE, dbid='lite', schema=None, table='t1', comment='second')
+    assert comments.reload() >= 1
+    assert comments.match_table('lite', None, [{'name': 't1'}]) == [{'name': 't1', 'desc': 'second'}]
+    assert comments.match_table('lite', '', [{'name': 't1'}]) == [{'name': 't1', 'desc': 'second'}]
+
+def test_comments_migrate(tmp_path):
+    import sqlite3
+    p = str(tmp_path / 'old.db')
+    # store of an older version, history only
+    with sqlite3.connect(p) as conn:
+        conn.execute('CREATE TABLE comments (id INTEGER PRIMARY KEY, type INTEGER, dbid VARCHAR(20), schema VARCHAR(100), '
+                     'tabname VARCHAR(100), colname VARCHAR(100), memo VARCHAR(500))')
+        conn.executemany('INSERT INTO comments (type, dbid, schema, tabname, colname, memo) VALUES (?, ?, ?, ?, ?, ?)', [
+            (comments_db.C_CONN, 'con1', None, None, None, 'conn old'),
+            (comments_db.C_CONN, 'con1', None, None, None, 'conn new'),
+            (comments_db.C_COLUMN, 'con1', 's1', 't1', 'c1', 'c1 old'),
+            (comments_db.C_COLUMN, 'con1', 's1', 't1', 'c1', 'c1 new'),
+            (comments_db.C_COLUMN, 'con1', 's1', 't1', 'c2', 'c2'),
+        ])
+    comments_db.init("sqlite:///" + p)
+    assert comments_db.get_conn_comments() == {'con1': 'conn new'}
+    assert comments_db.get_column_comments('con1', 's1', 't1') == {'c1': 'c1 new', 'c2': 'c2'}
+
+    comments_db.set_comments(type=comments_db.C_CONN, dbid='con1', comment='conn 3')
+    comments_db.set_comments(type=comments_db.C_TABLE, dbid='con1', schema='s1', table='t1', comment='t1')
+    assert comments_db.get_conn_comments() == {'con1': 'conn 3'}
+    assert comments_db.get_table_comments('con1', 's1') == {'t1': 't1'}
+    # history is kept
+    with sqlite3.connect(p) as conn:
+        assert conn.execute('SELECT count(*) FROM comments').fetchone() == (7,)
+        assert conn.execute('SELECT count(*) FROM comments_current').fetchone() == (4,)
+
+async def test_comments_bulk(jp_fetch, tmp_path, monkeypatch):
+    comments.init("database::sqlite:///" + str(tmp_path / 'bulk.db'))
+    monkeypatch.setattr(comments_db, 'BULK_BATCH', 10)
+    items = [{'type': comments_db.C_COLUMN, 'dbid': 'con1', 'schema': 's1', 'table': 't1', 'column': f'c{i}', 'comment': f'm{i}'}
+             for i in range(25)]
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", method='POST', body=json.dumps(items))
+    assert json.loads(response.body) == {'data': 25}
+    assert comments.match_column('con1', 's1', 't1', [{'name': 'c24'}]) == [{'name': 'c24', 'desc': 'm24'}]
+
+    csv_body = 'type,dbid,schema,table,column,comment\n3,con2,s1,t1,,"table, t1"\n4,con1,s1,t1,c0,new\n'
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", method='POST', body=csv_body,
+                              params={'format': 'csv'})
+    assert json.loads(response.body) == {'data': 2}
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", params={'dbid': 'con1'})
+    lines = [json.loads(l) for l in response.body.splitlines()]
+    assert len(lines) == 25
+    assert lines[-1] == {'type': 4, 'dbid': 'con1', 'schema': 's1', 'table': 't1', 'column': 'c0', 'comment': 'new'}
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", params={'format': 'csv'})
+    lines = response.body.decode().splitlines()
+    assert lines[0] == 'type,dbid,schema,table,column,comment'
+    assert '3,con2,s1,t1,,"table, t1"' in lines and len(lines) == 27
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", method='POST', body=json.dumps([{'type': 9}]))
+    assert 'error' in json.loads(response.body)
+
+    # a batch fails: only the batches committed before it are indexed
+    write = comments_db._write
+    def failing(batch):
+        if batch[0][1]['colname'] == 'x10':
+            raise Exception('disk full')
+        write(batch)
+    monkeypatch.setattr(comments_db, '_write', failing)
+    items = [{'type': comments_db.C_COLUMN, 'dbid': 'con3', 'schema': 's1', 'table': 't1', 'column': f'x{i}', 'comment': f'm{i}'}
+             for i in range(25)]
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk", method='POST', body=json.dumps(items))
+    payload = json.loads(response.body)
+    assert payload['data'] == 10 and 'disk full' in payload['error']
+    assert comments.match_column('con3', 's1', 't1', [{'name': 'x9'}, {'name': 'x10'}]) == \
+        [{'name': 'x9', 'desc': 'm9'}, {'name': 'x10'}]
+
+    monkeypatch.setattr(comments, 'export_comments', MagicMock(side_effect=Exception('store down')))
+    response = await jp_fetch("jupyterlab-sql-explorer", "comments", "bulk")
+    assert json.loads(response.body) == {'error': 'store down'}
@@ -0,0 +1,145 @@
+import json
+import base64
+import time
+import asyncio
+from unittest.mock import patch, MagicMock
+from .. import engine
+from ..registry import EngineRegistry
+
+def test_registry_reuse():
+    reg = EngineRegistry()
+    create = MagicMock(side_effect=lambda: MagicMock())
+    e1 = reg.get(('db1', None, 'x'), create)
+    e2 = reg.get(('db1', None, 'x'), create)
+    assert e1 is e2
+    assert create.call_count == 1
+
+    e3 = reg.get(('db1', None, 'y'), create)
+    assert e3 is not e1
+    assert len(reg) == 2
+
+    assert reg.dispose('db1') == 2
+    e1.dispose.assert_called_once()
+    assert len(reg) == 0
+
+def test_registry_evict():
+    reg = EngineRegistry(idle_timeout=600, max_count=2)
+    engs = [reg.get((f'db{i}', None, ''), MagicMock) for i in range(3)]
+    # lru one is disposed
+    engs[0].dispose.assert_called_once()
+    assert [e['dbid'] for e in reg.list()] == ['db1', 'db2']
+
+    reg.idle_timeout = 0
+    time.sleep(0.01)
+    assert reg.sweep() == 2
+    assert reg.list() == []
+
+def test_registry_no_cache_none():
+    reg = EngineRegistry()
+    assert reg.get(('db1', None, ''), lambda: None) is None
+    assert len(reg) == 0
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+def test_get_engine(mock_dbinfo):
+    engine.dispose_engines()
+    mock_dbinfo.return_value={'db_id': 'reg', 'db_type': engine.DB_SQLITE, 'db_name': ':memory:'}
+    e1 = engine.getEngine('reg')
+    assert engine.getEngine('reg') is e1
+    # sqlite (as postgresql, oracle) has one engine for all schemas
+    assert engine.getEngine('reg', 'other') is e1
+    assert [e['dbid'] for e in engine.list_engines()] == ['reg']
+
+    engine.clear_pass(None)
+    assert engine.list_engines() == []
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+async def test_engine_handler(mock_dbinfo, jp_fetch):
+    engine.dispose_engines()
+    mock_dbinfo.return_value={'db_id': 'reg', 'db_type': engine.DB_SQLITE, 'db_name': ':memory:'}
+    engine.getEngine('reg')
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "engines")
+    assert response.code == 200
+    payload = json.loads(response.body)
+    assert [(e['dbid'], e['db']) for e in payload['data']] == [('reg', None)]
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "engines", method='DELETE', params={'dbid': 'reg'})
+    assert json.loads(response.body) == {'data': 1}
+
+def test_config_store(tmp_path):
+    cfg = str(tmp_path / 'conf' / 'db_conf.json')
+    engine.addEntry({'db_id': 'c1', 'db_type': engine.DB_SQLITE, 'db_name': 'c1.db'}, cfg)
+    assert engine._getCfgEntry('c1', cfg) == {'db_id': 'c1', 'db_type': engine.DB_SQLITE, 'db_name': 'c1.db', 'name': ''}
+
+    # copies are returned, the cache is not changed by callers
+    engine._getCfgEntry('c1', cfg)['db_name'] = 'xx'
+    assert engine._getCfgEntry('c1', cfg)['db_name'] == 'c1.db'
+
+    # changed by others
+    with open(cfg, 'wt') as f:
+        json.dump({'c2': {'db_id': 'c2', 'db_type': engine.DB_SQLITE, 'db_name': 'c2.db', 'name': 'n2'}}, f)
+    assert list(engine._getCfgEntryList(cfg)) == ['c2']
+
+    engine.delEntry('c2', cfg)
+    assert engine._getCfgEntryList(cfg) == {}
+    with open(cfg) as f:
+        assert json.load(f) == {}
+
+def test_env_config(monkeypatch):
+    info = {'db_id': 'envdb', 'db_type': engine.DB_SQLITE, 'db_name': ':memory:'}
+    monkeypatch.setenv('DB_envdb', base64.b64encode(json.dumps(info).encode()).decode())
+    assert 'envdb' in engine._getDBlist()
+    assert engine._getDbInfo('envdb') == info
+
+    info['db_name'] = 'other.db'
+    monkeypatch.setenv('DB_envdb', base64.b64encode(json.dumps(info).encode()).decode())
+    assert engine._getDbInfo('envdb') == info
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+def test_warm_up(mock_dbinfo, tmp_path):
+    engine.dispose_engines()
+    mock_dbinfo.return_value={'db_id': 'warm', 'db_type': engine.DB_SQLITE, 'db_name': str(tmp_path / 'warm.db')}
+    assert engine.warm_up('warm', 3) == 3
+    assert engine.getEngine('warm').pool.checkedin() == 3
+    # at most the pool size
+    assert engine.warm_up('warm', 100) == engine.getEngine('warm').pool.size()
+    engine.dispose_engines()
+
+@patch("jupyterlab_sql_explorer.engine._getDBlist", return_value=['warm', 'broken'])
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+async def test_start_warmup(mock_dbinfo, mock_list, tmp_path):
+    engine.dispose_engines()
+    info = {'db_id': 'warm', 'db_type': engine.DB_SQLITE, 'db_name': str(tmp_path / 'warm.db')}
+    mock_dbinfo.side_effect = lambda dbid: info if dbid == 'warm' else None
+    log = MagicMock()
+    engine.start_warmup(2, log)
+    for _ in range(100):
+        if log.warning.called:
+            break
+        await asyncio.sleep(0.01)
+    log.info.assert_called_once_with('warm up warm: 2 connections')
+    assert 'warm up broken' in log.warning.call_args.args[0]
+    engine.dispose_engines()
+
+@patch("jupyterlab_sql_explorer.engine.cancel.attach", side_effect=lambda e: e)
+@patch("jupyterlab_sql_explorer.engine.sqlalchemy.create_engine")
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+def test_pool_options(mock_dbinfo, mock_create, mock_attach):
+    engine.dispose_engines()
+    mock_dbinfo.return_value={'db_id': 'pg', 'db_type': engine.DB_PGSQL, 'db_host': 'h', 'db_name': 'd',
+                              'db_user': 'u', 'db_pass': 'p'}
+    engine.set_pool_options(True, 1800)
+    try:
+        engine.getEngine('pg')
+        kwargs = mock_create.call_args[1]
+        assert (kwargs['pool_pre_ping'], kwargs['pool_recycle']) == (True, 1800)
+
+        # no pre-ping on Hive
+        mock_dbinfo.return_value={'db_id': 'hive', 'db_type': engine.DB_HIVE_LDAP, 'db_host': 'h', 'db_name': 'd',
+                                  'db_user': 'u', 'db_pass': 'p'}
+        engine.getEngine('hive')
+        kwargs = mock_create.call_args[1]
+        assert (kwargs['pool_pre_ping'], kwargs['pool_recycle']) == (False, 1800)
+    finally:
+        engine.set_pool_options(False, 0)
+        engine.dispose_engines()
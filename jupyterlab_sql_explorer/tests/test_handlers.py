@@ -1,6 +1,8 @@
 import json
+import time
+import asyncio
 from unittest.mock import patch
-from .. import engine
+from .. import engine, task
 
 async def test_conn(jp_fetch):
     '''
@@ -108,4 +110,23 @@ async def test_passwd(mock_engine, jp_fetch):
     response = await jp_fetch("jupyterlab-sql-explorer", "pass", method='DELETE')
     assert response.code == 200
     payload = json.loads(response.body)
-    assert payload == {'data': 'delete pass ok'}
\ No newline at end of file
+    assert payload == {'data': 'delete pass ok'}
+
+@patch("jupyterlab_sql_explorer.handlers.db.get_schema_or_table")
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_meta_timeout(mock_dbinfo, mock_tables, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'slow', 'db_type': engine.DB_SQLITE, 'db_name': ':memory:'}
+    mock_tables.side_effect=lambda *args: time.sleep(0.5)
+    task.set_meta_executor(2, 0.1)
+    try:
+        slow = asyncio.ensure_future(jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'slow'}))
+        # the server keeps serving other requests
+        response = await jp_fetch("jupyterlab-sql-explorer", "engines")
+        assert response.code == 200
+        assert not slow.done()
+
+        response = await slow
+        payload = json.loads(response.body)
+        assert payload == {'error': "can't get db/table list of slow"}
+    finally:
+        task.set_meta_executor(8, 60)
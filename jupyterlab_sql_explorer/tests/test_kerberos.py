@@ -0,0 +1,141 @@
+import os
+import time
+import hashlib
+import pytest
+import sqlalchemy
+from unittest.mock import patch
+from .. import kerberos, engine
+
+# ticket end time shown by the klist stub
+EXPIRES = int(time.time()) + 3600
+
+@pytest.fixture
+def stub_kinit(tmp_path):
+    '''
+    a kinit which logs its arguments, fails if the keytab does not exist, and a klist
+    showing a ticket valid for an hour
+    '''
+    log = tmp_path / 'kinit.log'
+    kinit = tmp_path / 'kinit'
+    kinit.write_text(f'#!/bin/sh\n[ -f "$4" ] || {{ echo "no keytab $4" >&2; exit 1; }}\necho "$@" >> {log}\n')
+    kinit.chmod(0o755)
+    klist = tmp_path / 'klist'
+    expires = time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(EXPIRES))
+    klist.write_text('#!/bin/sh\necho "Ticket cache: $2"\necho "Default principal: hive/host@EXAMPLE.COM"\necho\n'
+                     'echo "Valid starting       Expires              Service principal"\n'
+                     f'echo "01/01/2026 00:00:00  {expires}  krbtgt/EXAMPLE.COM@EXAMPLE.COM"\n')
+    klist.chmod(0o755)
+    (tmp_path / 'keytab_hive1').write_text('')
+    with patch.object(kerberos, 'KINIT', str(kinit)), patch.object(kerberos, 'KLIST', str(klist)), \
+         patch.object(kerberos, 'ccache_dir', str(tmp_path / 'cc')), \
+         patch.object(kerberos, 'keytab_path', str(tmp_path / 'keytab_{dbid}')):
+        kerberos.forget()
+        yield log
+        kerberos.forget()
+
+def ccache_of(tmp_path, principal) -> str:
+    return 'FILE:' + str(tmp_path / 'cc' / ('krb5cc_' + hashlib.sha256(principal.encode()).hexdigest()[:16]))
+
+def kinit_calls(log) -> list:
+    return log.read_text().splitlines() if log.exists() else []
+
+def test_ticket(stub_kinit, tmp_path):
+    ccache = kerberos.ensure_ticket('hive1', 'hive/host@EXAMPLE.COM')
+    assert kerberos.ensure_ticket('hive1', 'hive/host@EXAMPLE.COM') == ccache
+    assert ccache == ccache_of(tmp_path, 'hive/host@EXAMPLE.COM')
+    keytab = str(tmp_path / 'keytab_hive1')
+    assert kinit_calls(stub_kinit) == [f'-c {ccache} -kt {keytab} hive/host@EXAMPLE.COM']
+    # end time from klist of the cache
+    [t] = kerberos.tickets()
+    assert t['expires'] == EXPIRES
+
+    # not due yet
+    assert kerberos.renew() == 0
+    with patch.object(kerberos, 'RENEW_AFTER', 0):
+        assert kerberos.renew() == 1
+        kerberos.ensure_ticket('hive1', 'hive/host@EXAMPLE.COM')
+    assert len(kinit_calls(stub_kinit)) == 3
+
+    # another principal has its own cache
+    assert kerberos.ensure_ticket('hive1', 'other@EXAMPLE.COM') == ccache_of(tmp_path, 'other@EXAMPLE.COM')
+
+def test_ticket_no_klist(stub_kinit):
+    with patch.object(kerberos, 'KLIST', '/nonexistent/klist'):
+        kerberos.ensure_ticket('hive1', 'hive/host@EXAMPLE.COM')
+    [t] = kerberos.tickets()
+    assert t['expires'] - t['obtained'] == kerberos.ticket_lifetime
+
+def test_attach():
+    eng = kerberos.attach(sqlalchemy.create_engine('sqlite://'), 'FILE:/tmp/krb5cc_test')
+    seen = []
+    connect = eng.dialect.connect
+    def record(*args, **kwargs):
+        seen.append(os.environ.get('KRB5CCNAME'))
+        return connect(*args, **kwargs)
+    old = os.environ.get('KRB5CCNAME')
+    with patch.object(eng.dialect, 'connect', side_effect=record):
+        with eng.connect():
+            pass
+    assert seen == ['FILE:/tmp/krb5cc_test']
+    assert os.environ.get('KRB5CCNAME') == old
+    eng.dispose()
+
+def test_ticket_error(stub_kinit):
+    with pytest.raises(Exception, match='kinit hive/x@EXAMPLE.COM failed: no keytab'):
+        kerberos.ensure_ticket('missing', 'hive/x@EXAMPLE.COM')
+    assert kinit_calls(stub_kinit) == []
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+def test_kerberos_engine(mock_dbinfo, stub_kinit, tmp_path):
+    engine.dispose_engines()
+    mock_dbinfo.return_value = {
+        'db_id': 'hive1', 'db_type': engine.DB_HIVE_KERBEROS, 'db_host': 'hive.example.com',
+        'principal': 'hive/host@EXAMPLE.COM', 'def_realm': 'EXAMPLE.COM',
+        'krb5conf': {'EXAMPLE.COM': {'kdc': 'kdc.example.com', 'admin_server': 'kdc.example.com'}},
+    }
+    conf = tmp_path / 'krb5.conf'
+    site = '[logging]\n  default = FILE:/var/log/krb5libs.log\n'
+    conf.write_text(site)
+    os.chmod(conf, 0o640)
+    with patch.object(kerberos, 'krb5_conf', str(conf)), patch.object(kerberos, '_realms', {}), \
+         patch.object(kerberos, '_default_realms', {}), \
+         patch.object(kerberos, '_conf_hash', None), patch.object(engine, '_registered_engine') as reg:
+        engine.getEngine('hive1')
+        engine.getEngine('hive1', 'other')
+        assert reg.call_count == 2
+        assert reg.call_args.kwargs['ccache'] == ccache_of(tmp_path, 'hive/host@EXAMPLE.COM')
+        assert len(kinit_calls(stub_kinit)) == 1
+        # the site configuration is kept
+        assert conf.read_text() == site + (
+            '# BEGIN jupyterlab-sql-explorer\n'
+            '[libdefaults]\ndefault_realm = EXAMPLE.COM\ndns_lookup_realm = false\ndns_lookup_kdc = false\n\n'
+            '[realms]\n  EXAMPLE.COM = {\n    kdc = kdc.example.com\n    admin_server = kdc.example.com\n  }\n'
+            '# END jupyterlab-sql-explorer\n')
+
+        # not written again with the same content
+        mtime = os.stat(conf).st_mtime_ns
+        assert kerberos.write_krb5_conf('hive1', mock_dbinfo.return_value) is False
+        assert os.stat(conf).st_mtime_ns == mtime
+
+        # realms of other connections are kept
+        other = {'def_realm': 'OTHER.COM', 'krb5conf': {'OTHER.COM': {'kdc': 'kdc.other.com'}}}
+        assert kerberos.write_krb5_conf('hive2', other) is True
+        text = conf.read_text()
+        assert text.startswith(site)
+        assert text.count('[realms]') == 1 and text.count('# BEGIN') == 1
+        assert 'EXAMPLE.COM = {' in text and 'OTHER.COM = {' in text
+        assert [f for f in os.listdir(tmp_path) if f.startswith('.krb5')] == []
+        assert os.stat(conf).st_mode & 0o777 == 0o640
+
+        # the default realm doesn't follow the connection used last
+        assert 'default_realm = EXAMPLE.COM' in text
+        assert kerberos.write_krb5_conf('hive1', mock_dbinfo.return_value) is False
+        assert kerberos.write_krb5_conf('hive2', other) is False
+
+        # written in place when the directory is not writable
+        third = {'def_realm': 'THIRD.COM', 'krb5conf': {'THIRD.COM': {'kdc': 'kdc.third.com'}}}
+        ino = os.stat(conf).st_ino
+        with patch.object(kerberos.os, 'access', return_value=False):
+            assert kerberos.write_krb5_conf('hive3', third) is True
+        assert os.stat(conf).st_ino == ino and 'THIRD.COM = {' in conf.read_text()
+        assert os.stat(conf).st_mode & 0o777 == 0o640
@@ -1,7 +1,12 @@
 import json
 import os
+import time
+import asyncio
+import threading
 from unittest.mock import patch
-from .. import engine
+import pytest
+from tornado.httpclient import HTTPClientError
+from .. import engine, db, task, resultset, catalog, crawler, serializer, search, handlers, spool
 
 @patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
 async def test_sqlite_dbtable(mock_dbinfo, jp_fetch):
@@ -48,4 +53,484 @@ async def test_sqlite_dbtable(mock_dbinfo, jp_fetch):
     response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'testdb', 'db': '', 'tbl': 'AAA'})
     assert response.code == 200
     payload = json.loads(response.body)
-    assert payload == {'data': [{'name': 'a', 'desc': 'INT', 'type': 'col'}, {'name': 'b', 'desc': 'INT', 'type': 'col'}]}
\ No newline at end of file
+    assert payload == {'data': [{'name': 'a', 'desc': 'INT', 'type': 'col'}, {'name': 'b', 'desc': 'INT', 'type': 'col'}]}
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_meta_cache(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'cachedb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_cache.db'}
+    db.invalidate_meta()
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'cachedb'})
+    assert json.loads(response.body) == {"data": []}
+
+    # changed outside of /query, the cached listing is used until refresh
+    with engine.getEngine('cachedb').begin() as conn:
+        conn.exec_driver_sql('create table CCC (a int)')
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'cachedb'})
+    assert json.loads(response.body) == {"data": []}
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'cachedb', 'refresh': '1'})
+    assert json.loads(response.body) == {"data": [{'name': 'CCC', 'desc': '', 'type': 'table', 'subtype': 'T'}]}
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'cachedb', 'db': '', 'tbl': 'CCC'})
+    assert json.loads(response.body) == {'data': [{'name': 'a', 'desc': 'INT', 'type': 'col'}]}
+
+async def run_query(jp_fetch, body):
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", method='POST', body=json.dumps(body))
+    payload = json.loads(response.body)
+    assert payload['error'] == 'RETRY'
+    taskid = payload['data']
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    return taskid, json.loads(response.body)
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_paged(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'pagedb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_page.db'}
+    await run_query(jp_fetch, {'dbid': 'pagedb', 'sql': 'create table P (a int)'})
+    await run_query(jp_fetch, {'dbid': 'pagedb', 'sql': '''
+        insert into P WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 12000) SELECT x FROM c
+    '''})
+
+    taskid, payload = await run_query(jp_fetch, {'dbid': 'pagedb', 'sql': 'select a from P', 'page_size': 500})
+    # more rows than the limit of unpaged queries
+    assert payload['data']['columns'] == ['a']
+    assert payload['data']['data'] == [[i] for i in range(1, 501)]
+    assert payload['data']['more'] is True
+    assert payload['data']['total'] is None
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid, 'offset': 11800, 'size': 500})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [[i] for i in range(11801, 12001)]
+    assert payload['data']['more'] is False
+    assert payload['data']['total'] == 12000
+
+    # large pages are streamed in chunks
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid, 'offset': 0, 'size': 5000})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [[i] for i in range(1, 5001)]
+    assert payload['data']['offset'] == 0
+    response = await jp_fetch("jupyterlab-sql-explorer", "result",
+                              params={'taskid': taskid, 'offset': 0, 'size': 5000, 'format': 'columns'})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [list(range(1, 5001))]
+    assert payload['data']['format'] == 'columns'
+
+    # fetched rows are kept
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid, 'offset': 500, 'size': 2})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [[501], [502]]
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "result",
+                              params={'taskid': taskid, 'offset': 0, 'size': 3, 'format': 'columns'})
+    payload = json.loads(response.body)
+    assert payload['data']['columns'] == ['a']
+    assert payload['data']['types'] == ['int']
+    assert payload['data']['data'] == [[1, 2, 3]]
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", method='DELETE', params={'taskid': taskid})
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid})
+    assert json.loads(response.body) == {'error': 'task not exists'}
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_arrow_missing(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'arrowdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_arrow.db'}
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", method='POST', body=json.dumps({'dbid': 'arrowdb', 'sql': 'select 1 as a'}))
+    taskid = json.loads(response.body)['data']
+
+    # the result is kept for a request in another format
+    with patch("jupyterlab_sql_explorer.serializer.pa", None):
+        response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid, 'format': 'arrow'})
+    assert json.loads(response.body) == {'error': 'format arrow needs pyarrow installed'}
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    assert json.loads(response.body)['data']['data'] == [[1]]
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_stream_error(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'streamdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_stream.db'}
+    sql = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 5000) SELECT x FROM c'
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", method='POST', body=json.dumps({'dbid': 'streamdb', 'sql': sql, 'page_size': 5000}))
+    taskid = json.loads(response.body)['data']
+
+    # the second chunk of rows fails after the first one is sent
+    calls = []
+    def dumps_bytes(obj):
+        calls.append(obj)
+        if len(calls) == 3:
+            raise ValueError('bad value')
+        return serializer.dumps_bytes(obj)
+
+    with patch("jupyterlab_sql_explorer.handlers.dumps_bytes", dumps_bytes):
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    assert e.value.code == 599
+    await jp_fetch("jupyterlab-sql-explorer", "query", method='DELETE', params={'taskid': taskid})
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_stream_columns(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'streamdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_stream.db'}
+    sql = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 5000) SELECT x, -x FROM c'
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", method='POST', body=json.dumps({'dbid': 'streamdb', 'sql': sql, 'page_size': 5000}))
+    taskid = json.loads(response.body)['data']
+
+    # many rows and few columns are streamed in chunks of rows
+    calls = []
+    def dumps_bytes(obj):
+        calls.append(obj)
+        return serializer.dumps_bytes(obj)
+
+    with patch("jupyterlab_sql_explorer.handlers.dumps_bytes", dumps_bytes):
+        response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid, 'format': 'columns'})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [list(range(1, 5001)), list(range(-1, -5001, -1))]
+    assert max(len(c) for c in calls if isinstance(c, list)) == handlers.STREAM_CHUNK_ROWS
+    await jp_fetch("jupyterlab-sql-explorer", "query", method='DELETE', params={'taskid': taskid})
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_spool(mock_dbinfo, jp_fetch, tmp_path, monkeypatch):
+    monkeypatch.setattr(resultset, 'spool_bytes', 1000)
+    spool_dir = tmp_path / 'spool'
+    monkeypatch.setattr(resultset, 'spool_dir', str(spool_dir))
+    mock_dbinfo.return_value={'db_id': 'spooldb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_spool.db'}
+    await run_query(jp_fetch, {'dbid': 'spooldb', 'sql': 'create table S (a int, b text)'})
+    await run_query(jp_fetch, {'dbid': 'spooldb', 'sql': '''
+        insert into S WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 3000) SELECT x, 'r' || x FROM c
+    '''})
+
+    taskid, payload = await run_query(jp_fetch, {'dbid': 'spooldb', 'sql': 'select a, b from S', 'page_size': 100})
+    assert payload['data']['data'][0] == [1, 'r1']
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid, 'offset': 2950, 'size': 100})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [[i, f'r{i}'] for i in range(2951, 3001)]
+    assert payload['data']['total'] == 3000
+
+    # rows are read back from the spool file
+    h = task.task_dict[taskid].handle
+    assert h.spooled > 0 and h.size < 1000
+    assert len(list(spool_dir.iterdir())) == 1
+    response = await jp_fetch("jupyterlab-sql-explorer", "result", params={'taskid': taskid, 'offset': 990, 'size': 20})
+    payload = json.loads(response.body)
+    assert payload['data']['data'] == [[i, f'r{i}'] for i in range(991, 1011)]
+
+    await jp_fetch("jupyterlab-sql-explorer", "query", method='DELETE', params={'taskid': taskid})
+    await asyncio.sleep(0.1)
+    assert list(spool_dir.iterdir()) == []
+
+def test_spool_cleared_at_start(tmp_path, monkeypatch):
+    monkeypatch.setattr(resultset, 'spool_bytes', resultset.spool_bytes)
+    monkeypatch.setattr(resultset, 'spool_dir', resultset.spool_dir)
+    monkeypatch.setattr(spool, '_alive', lambda pid: pid == os.getpid())
+    live = spool.Spool(str(tmp_path))
+    for name in ['1-abc.spool', 'tmpabc.spool', 'notes.txt']:
+        (tmp_path / name).write_text('x')
+    # the files of stopped servers are deleted, not those of running ones
+    resultset.set_spool(1000, str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(live.path), 'notes.txt'])
+    live.remove()
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_export(mock_dbinfo, jp_fetch, jp_root_dir):
+    mock_dbinfo.return_value={'db_id': 'expdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_export.db'}
+    await run_query(jp_fetch, {'dbid': 'expdb', 'sql': 'create table E (a int, b text)'})
+    await run_query(jp_fetch, {'dbid': 'expdb', 'sql': '''
+        insert into E WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 25000) SELECT x, 'r,' || x FROM c
+    '''})
+
+    # more rows than the limit of queries
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", params={'dbid': 'expdb', 'sql': 'select * from E'})
+    assert response.headers['Content-Type'] == 'text/csv'
+    lines = response.body.decode().splitlines()
+    assert lines[:2] == ['a,b', '1,"r,1"']
+    assert len(lines) == 25001
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "export",
+                              params={'dbid': 'expdb', 'sql': 'select * from E where a > 24998', 'format': 'jsonl'})
+    assert [json.loads(l) for l in response.body.splitlines()] == [{'a': 24999, 'b': 'r,24999'}, {'a': 25000, 'b': 'r,25000'}]
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", params={'dbid': 'expdb', 'sql': 'select * from XX'})
+    assert 'no such table' in json.loads(response.body)['error']
+
+    # the connection is checked in the metadata executor
+    with patch("jupyterlab_sql_explorer.handlers.task.run_blocking", side_effect=Exception('conn not exists or error')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "export", params={'dbid': 'nodb', 'sql': 'select 1'})
+    assert json.loads(response.body) == {'error': 'conn not exists or error'}
+
+    # to a file, the task shows progress
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", method='POST',
+                              body=json.dumps({'dbid': 'expdb', 'sql': 'select * from E', 'path': 'out.csv'}))
+    taskid = json.loads(response.body)['data']
+    response = await jp_fetch("jupyterlab-sql-explorer", "tasks")
+    info = [t for t in json.loads(response.body)['data'] if t['taskid'] == taskid][0]
+    assert info['progress']['path'] == 'out.csv'
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    assert json.loads(response.body)['data']['rows'] == 25000
+    with open(jp_root_dir / 'out.csv') as f:
+        assert len(f.readlines()) == 25001
+
+    # an existing file is replaced only with overwrite
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", method='POST',
+                              body=json.dumps({'dbid': 'expdb', 'sql': 'select * from E where a < 3', 'path': 'out.csv'}))
+    assert json.loads(response.body) == {'error': 'out.csv exists, set overwrite to replace it'}
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", method='POST',
+                              body=json.dumps({'dbid': 'expdb', 'sql': 'select * from E where a < 3', 'path': 'out.csv', 'overwrite': True}))
+    taskid = json.loads(response.body)['data']
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    assert json.loads(response.body)['data']['rows'] == 2
+    with open(jp_root_dir / 'out.csv') as f:
+        assert len(f.readlines()) == 3
+
+    # a failed export leaves the file as it was, without temporary files
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", method='POST',
+                              body=json.dumps({'dbid': 'expdb', 'sql': 'select * from XX', 'path': 'out.csv', 'overwrite': True}))
+    taskid = json.loads(response.body)['data']
+    response = await jp_fetch("jupyterlab-sql-explorer", "query", params={'taskid': taskid})
+    assert 'no such table' in json.loads(response.body)['error']
+    await jp_fetch("jupyterlab-sql-explorer", "query", method='DELETE', params={'taskid': taskid})
+    with open(jp_root_dir / 'out.csv') as f:
+        assert len(f.readlines()) == 3
+    assert [p.name for p in jp_root_dir.iterdir() if p.name.startswith('.out.csv')] == []
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "export", method='POST',
+                              body=json.dumps({'dbid': 'expdb', 'sql': 'select * from E', 'path': '../out.csv'}))
+    assert json.loads(response.body) == {'error': 'export path must be under the server root'}
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_result_cache(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'rcdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_rcache.db', 'cache_ttl': 60}
+    await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'create table R (a int)'})
+    await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'insert into R values (1)'})
+
+    for page_size in (0, 100):
+        taskids = []
+        taskid, payload = await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'select a from R', 'page_size': page_size})
+        taskids.append(taskid)
+        assert payload['data']['data'] == [[1]] and 'cached' not in payload['data']
+        taskid, payload = await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'SELECT a  FROM R', 'page_size': page_size})
+        taskids.append(taskid)
+        assert payload['data']['data'] == [[1]] and payload['data']['cached'] >= 0
+        taskid, payload = await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'select a from R', 'page_size': page_size, 'no_cache': True})
+        taskids.append(taskid)
+        assert 'cached' not in payload['data']
+        for taskid in taskids:
+            await task.delete(taskid)
+
+    # writes drop the cached results of the connection
+    await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'insert into R values (2)'})
+    _, payload = await run_query(jp_fetch, {'dbid': 'rcdb', 'sql': 'select a from R'})
+    assert payload['data']['data'] == [[1], [2]] and 'cached' not in payload['data']
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "cache", method='DELETE')
+    assert json.loads(response.body)['data']['entries'] == 0
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_script(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'scriptdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_script.db'}
+    script = '''
+        drop table if exists SC;
+        create table SC (a int, b text);
+        insert into SC values (1, 'x;y'), (2, 'z'); -- two rows
+        select * from SC order by a;
+    '''
+    taskid, payload = await run_query(jp_fetch, {'dbid': 'scriptdb', 'sql': script, 'script': True})
+    results = payload['data']['results']
+    assert [r['sql'].split()[0] for r in results] == ['drop', 'create', 'insert', '--']
+    assert results[3]['sql'] == '-- two rows\n        select * from SC order by a'
+    assert results[2]['rowcount'] == 2
+    assert results[3]['data'] == [[1, 'x;y'], [2, 'z']]
+    assert all(r['time'] >= 0 for r in results)
+
+    # stops at the error, the transaction is rolled back
+    script = "insert into SC values (3, 'w'); select * from NOTEXISTS; insert into SC values (4, 'v')"
+    taskid, payload = await run_query(jp_fetch, {'dbid': 'scriptdb', 'sql': script, 'script': True, 'transaction': True})
+    results = payload['data']['results']
+    assert len(results) == 2 and 'NOTEXISTS' in results[1]['error']
+    assert payload['data']['rolled_back'] is True
+    _, payload = await run_query(jp_fetch, {'dbid': 'scriptdb', 'sql': 'select count(*) from SC'})
+    assert payload['data']['data'] == [[2]]
+
+    # without transaction, completed statements are committed
+    taskid, payload = await run_query(jp_fetch, {'dbid': 'scriptdb', 'sql': script, 'script': True})
+    _, payload = await run_query(jp_fetch, {'dbid': 'scriptdb', 'sql': 'select count(*) from SC'})
+    assert payload['data']['data'] == [[3]]
+
+async def test_script_progress(jp_fetch):
+    progress = {'done': 1, 'total': 2, 'results': [{'sql': 'select 1', 'data': [[1]]}]}
+    block = threading.Event()
+    taskid = await task.create_query_task(lambda dbid: block.wait(5), 'db1', progress=progress)
+    response = await jp_fetch("jupyterlab-sql-explorer", "script", params={'taskid': taskid, 'since': 0})
+    payload = json.loads(response.body)
+    assert payload['data']['results'] == progress['results'] and payload['data']['done'] == 1
+    response = await jp_fetch("jupyterlab-sql-explorer", "tasks")
+    info = [t for t in json.loads(response.body)['data'] if t['taskid'] == taskid][0]
+    assert info['progress'] == {'done': 1, 'total': 2}
+    block.set()
+    await task.delete(taskid)
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_schema_columns(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'scdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_schemacols.db'}
+    db.invalidate_meta()
+    await run_query(jp_fetch, {'dbid': 'scdb', 'sql': 'create table if not exists T1 (a int, b text)'})
+    await run_query(jp_fetch, {'dbid': 'scdb', 'sql': 'create table if not exists T2 (c real)'})
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "schemacolumns", params={'dbid': 'scdb'})
+    assert json.loads(response.body) == {'data': {
+        'T1': [{'name': 'a', 'desc': 'INT', 'type': 'col'}, {'name': 'b', 'desc': 'TEXT', 'type': 'col'}],
+        'T2': [{'name': 'c', 'desc': 'REAL', 'type': 'col'}],
+    }}
+
+    # the columns of each table are cached
+    with patch("jupyterlab_sql_explorer.db.query", side_effect=Exception('not cached')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'scdb', 'tbl': 'T2'})
+        assert json.loads(response.body) == {'data': [{'name': 'c', 'desc': 'REAL', 'type': 'col'}]}
+        response = await jp_fetch("jupyterlab-sql-explorer", "schemacolumns", params={'dbid': 'scdb', 'tables': 'T1'})
+        assert list(json.loads(response.body)['data']) == ['T1']
+
+    db.invalidate_meta()
+    response = await jp_fetch("jupyterlab-sql-explorer", "schemacolumns", params={'dbid': 'scdb', 'tables': "T2,X'Y"})
+    assert json.loads(response.body) == {'data': {'T2': [{'name': 'c', 'desc': 'REAL', 'type': 'col'}]}}
+
+@patch("jupyterlab_sql_explorer.db.query")
+def test_schema_columns_one_query(mock_query):
+    dbinfo = {'db_id': 'pg', 'db_type': engine.DB_PGSQL}
+    mock_query.return_value = [('t1', 'a', 'comment a'), ('t1', 'b', None), ('t2', 'c', None)]
+    assert db._get_schema_columns('pg', dbinfo, 'public') == {
+        't1': [{'name': 'a', 'desc': 'comment a', 'type': 'col'}, {'name': 'b', 'desc': None, 'type': 'col'}],
+        't2': [{'name': 'c', 'desc': None, 'type': 'col'}],
+    }
+    assert mock_query.call_count == 1
+    db._get_schema_columns('pg', dbinfo, 'public', ['t1', 'x'])
+    assert "c.table_name IN ('t1', 'x')" in mock_query.call_args[0][1]
+
+    # names are quoted as string literals
+    db._get_schema_columns('pg', dbinfo, "o'x")
+    assert "c.table_schema = 'o''x'" in mock_query.call_args[0][1]
+    db._get_schema_columns('my', {'db_id': 'my', 'db_type': engine.DB_MYSQL}, "a\\' or 1=1 -- ")
+    assert "table_schema = 'a\\\\'' or 1=1 -- '" in mock_query.call_args[0][1]
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_search(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'searchdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_search.db'}
+    db.invalidate_meta()
+    await run_query(jp_fetch, {'dbid': 'searchdb', 'sql': 'create table if not exists CUSTOMER (cust_id int, name text)'})
+    await run_query(jp_fetch, {'dbid': 'searchdb', 'sql': 'create table if not exists ORDERS (order_id int, cust_id int)'})
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "search", method='POST', body=json.dumps({'dbid': 'searchdb'}))
+    assert 'error' not in json.loads(response.body)
+    for _ in range(50):
+        response = await jp_fetch("jupyterlab-sql-explorer", "search", params={'dbid': 'searchdb'})
+        stats = json.loads(response.body)['data']
+        if not stats['building']:
+            break
+        await asyncio.sleep(0.1)
+    assert stats['objects'] == 6
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "search", params={'dbid': 'searchdb', 'q': 'cust'})
+    assert [(r['name'], r['path']) for r in json.loads(response.body)['data']] == [
+        ('CUSTOMER', ['CUSTOMER']), ('cust_id', ['CUSTOMER', 'cust_id']), ('cust_id', ['ORDERS', 'cust_id'])]
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "search", params={'dbid': 'searchdb', 'q': 'id', 'type': 'col', 'limit': '2'})
+    assert [r['name'] for r in json.loads(response.body)['data']] == ['cust_id', 'cust_id']
+    response = await jp_fetch("jupyterlab-sql-explorer", "search", params={'dbid': 'searchdb', 'q': 'id', 'type': 'col', 'limit': '-5'})
+    assert len(json.loads(response.body)['data']) == 1
+
+    # comments which are not objects of the index are ignored
+    search.set_comment({'type': 'x', 'dbid': 'searchdb'})
+    search.set_comment({'type': 1, 'dbid': 'searchdb', 'comment': 'conn'})
+    search.set_comment({'type': 3})
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_catalog_snapshot(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'snapdb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_snapshot.db'}
+    db.invalidate_meta()
+    await run_query(jp_fetch, {'dbid': 'snapdb', 'sql': 'create table if not exists S1 (a int)'})
+    response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'snapdb'})
+    assert json.loads(response.body) == {'data': [{'name': 'S1', 'desc': '', 'type': 'table', 'subtype': 'T'}]}
+
+    # listed in this session (e.g. by the crawler): served from the snapshot, not stale
+    db._meta_cache.invalidate()
+    with patch("jupyterlab_sql_explorer.db._get_schema_or_table", side_effect=Exception('not cached')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'snapdb'})
+        assert json.loads(response.body) == {'data': [{'name': 'S1', 'desc': '', 'type': 'table', 'subtype': 'T'}]}
+
+    # restarted: the listing is served from the snapshot and fetched again in background
+    db._meta_cache.invalidate()
+    catalog.started = time.time()
+    fetched = threading.Event()
+    tables = [{'name': 'S1', 'desc': '', 'type': 'table', 'subtype': 'T'}, {'name': 'S2', 'desc': '', 'type': 'table', 'subtype': 'T'}]
+    def fetch(*args):
+        fetched.wait(5)
+        return tables
+    with patch("jupyterlab_sql_explorer.db._get_schema_or_table", side_effect=fetch):
+        response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'snapdb'})
+        assert json.loads(response.body) == {'data': [{'name': 'S1', 'desc': '', 'type': 'table', 'subtype': 'T'}], 'stale': True}
+        fetched.set()
+        for _ in range(50):
+            if not db.is_stale('snapdb', 'tables', None):
+                break
+            await asyncio.sleep(0.05)
+        response = await jp_fetch("jupyterlab-sql-explorer", "dbtables", params={'dbid': 'snapdb'})
+        assert json.loads(response.body) == {'data': tables}
+
+    # changed objects drop the snapshot
+    db.invalidate_meta('snapdb')
+    assert catalog.get(('snapdb', 'tables', None)) is None
+
+    # no snapshot is created for a connection without one, a deleted connection's is removed
+    db.invalidate_meta('nosnapdb')
+    assert not os.path.exists(catalog._file('nosnapdb'))
+    assert os.path.exists(catalog._file('snapdb'))
+    catalog.drop('snapdb')
+    assert not os.path.exists(catalog._file('snapdb'))
+
+async def wait_crawl(jp_fetch, dbid):
+    for _ in range(100):
+        response = await jp_fetch("jupyterlab-sql-explorer", "crawler", params={'dbid': dbid})
+        status = json.loads(response.body)['data'][dbid]
+        if status['state'] == 'idle':
+            return status
+        await asyncio.sleep(0.05)
+
+@patch("jupyterlab_sql_explorer.handlers.engine._getDbInfo")
+async def test_sqlite_crawler(mock_dbinfo, jp_fetch):
+    mock_dbinfo.return_value={'db_id': 'crawldb', 'db_type': engine.DB_SQLITE, 'db_name': 'jp_sql_crawl.db'}
+    db.invalidate_meta()
+    crawler.drop('crawldb')
+    await run_query(jp_fetch, {'dbid': 'crawldb', 'sql': 'create table if not exists C1 (a int)'})
+    await run_query(jp_fetch, {'dbid': 'crawldb', 'sql': 'create table if not exists C2 (b int)'})
+
+    response = await jp_fetch("jupyterlab-sql-explorer", "crawler", method='POST', body=json.dumps({'dbid': 'crawldb'}))
+    assert 'crawldb' in json.loads(response.body)['data']
+    status = await wait_crawl(jp_fetch, 'crawldb')
+    assert (status['runs'], status['tables'], status['changed'], status['errors']) == (1, 2, 2, 0)
+    # the columns are in the snapshot, not added to the metadata cache
+    assert db._meta_cache.peek(('crawldb', 'columns', None, 'C2')) is None
+    assert catalog.get(('crawldb', 'columns', None, 'C2')) == [{'name': 'b', 'desc': 'INT', 'type': 'col'}]
+    with patch("jupyterlab_sql_explorer.db.query", side_effect=Exception('not cached')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'crawldb', 'tbl': 'C2'})
+        assert json.loads(response.body) == {'data': [{'name': 'b', 'desc': 'INT', 'type': 'col'}]}
+
+    # nothing changed
+    await jp_fetch("jupyterlab-sql-explorer", "crawler", method='POST', body=json.dumps({'dbid': 'crawldb'}))
+    status = await wait_crawl(jp_fetch, 'crawldb')
+    assert (status['runs'], status['tables'], status['changed']) == (2, 2, 0)
+
+    # only the altered table is crawled again (altered outside /query, the cache is kept)
+    with engine.getEngine('crawldb').begin() as conn:
+        conn.exec_driver_sql('alter table C1 add column c text')
+    await jp_fetch("jupyterlab-sql-explorer", "crawler", method='POST', body=json.dumps({'dbid': 'crawldb'}))
+    status = await wait_crawl(jp_fetch, 'crawldb')
+    assert (status['runs'], status['tables'], status['changed']) == (3, 2, 1)
+    with patch("jupyterlab_sql_explorer.db.query", side_effect=Exception('not cached')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'crawldb', 'tbl': 'C1'})
+        assert [c['name'] for c in json.loads(response.body)['data']] == ['a', 'c']
+
+    # DDL through /query drops the cached metadata, all tables are crawled again
+    await run_query(jp_fetch, {'dbid': 'crawldb', 'sql': 'alter table C2 add column d text'})
+    await jp_fetch("jupyterlab-sql-explorer", "crawler", method='POST', body=json.dumps({'dbid': 'crawldb'}))
+    status = await wait_crawl(jp_fetch, 'crawldb')
+    assert (status['runs'], status['tables'], status['changed']) == (4, 2, 2)
+    with patch("jupyterlab_sql_explorer.db.query", side_effect=Exception('not cached')):
+        response = await jp_fetch("jupyterlab-sql-explorer", "columns", params={'dbid': 'crawldb', 'tbl': 'C1'})
+        assert [c['name'] for c in json.loads(response.body)['data']] == ['a', 'c']
@@ -0,0 +1,205 @@
+import json
+import time
+import asyncio
+import functools
+import threading
+from unittest.mock import patch, MagicMock
+import pytest
+from .. import task, db, engine, cancel
+
+async def test_scheduler_limits():
+    sch = task.QueryScheduler(max_running=2, max_per_conn=1)
+    gate = threading.Event()
+
+    def work(v):
+        gate.wait(5)
+        return v
+
+    f1 = sch.submit('t1', 'db1', work, 1)
+    f2 = sch.submit('t2', 'db1', work, 2)
+    f3 = sch.submit('t3', 'db2', work, 3)
+    f4 = sch.submit('t4', 'db3', work, 4)
+    await asyncio.sleep(0.05)
+
+    # db1 is full, t3 goes ahead of t2, t4 waits for a global slot
+    assert sch.stats()['running'] == {'db1': 1, 'db2': 1}
+    assert sch.position('t2') == 1
+    assert sch.position('t4') == 2
+    assert sch.position('t1') == 0
+
+    gate.set()
+    assert await asyncio.gather(f1, f2, f3, f4) == [1, 2, 3, 4]
+    stats = sch.stats()
+    assert stats['running'] == {}
+    assert stats['waiting'] == 0
+    assert stats['started'] == 4
+    assert stats['wait_max'] > 0
+
+async def test_scheduler_cancel_waiting():
+    sch = task.QueryScheduler(max_running=1, max_per_conn=1)
+    f1 = sch.submit('t1', 'db1', time.sleep, 0.1)
+    f2 = sch.submit('t2', 'db1', time.sleep, 0)
+    await asyncio.sleep(0)
+    assert sch.position('t2') == 1
+    f2.cancel()
+    await asyncio.sleep(0)
+    assert sch.position('t2') == 0
+    await f1
+    assert sch.stats()['started'] == 1
+    assert sch.stats()['running'] == {}
+
+async def test_query_task():
+    taskid = await task.create_query_task(lambda dbid, sql: {'dbid': dbid, 'sql': sql}, 'db1', 'select 1')
+    rc, data = await task.get_result(taskid)
+    assert rc
+    assert data == {'dbid': 'db1', 'sql': 'select 1'}
+
+    rc, data = await task.get_result(taskid)
+    assert not rc
+
+SLOW_SQL = '''
+WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 1000000000)
+SELECT count(*) FROM c
+'''
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+async def test_cancel_sqlite(mock_dbinfo):
+    mock_dbinfo.return_value={'db_id': 'slowdb', 'db_type': engine.DB_SQLITE, 'db_name': ':memory:'}
+    taskid = await task.create_query_task(db.query_exec, 'slowdb', SLOW_SQL)
+    future = task.task_dict[taskid].future
+    await asyncio.sleep(0.3)
+    assert not future.done()
+
+    begin = time.monotonic()
+    assert await task.delete(taskid)
+    # the statement is interrupted in the database, the thread is released
+    while task.query_stats()['running']:
+        await asyncio.sleep(0.05)
+    assert time.monotonic() - begin < 5
+    assert taskid not in task.task_dict
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+def test_cancel_after_checkin(mock_dbinfo, tmp_path):
+    mock_dbinfo.return_value={'db_id': 'ckdb', 'db_type': engine.DB_SQLITE, 'db_name': str(tmp_path / 'ck.db')}
+    eng = engine.getEngine('ckdb')
+    with cancel.running('t2') as q:
+        with eng.connect() as conn:
+            conn.exec_driver_sql('select 1')
+            assert q.dbapi_conn is not None and q.backend_id is None
+        # back in the pool, a late cancel must not touch it
+        assert q.dbapi_conn is None
+        assert cancel.cancel('t2') is True
+    engine.dispose_engines('ckdb')
+
+def test_cancel_kill_connection():
+    # the kill connection is opened without the lock, the connection can be returned meanwhile
+    with cancel.running('t3') as q:
+        q.dialect, q.backend_id, q.dbapi_conn = 'mysql', 42, MagicMock()
+        q.engine = MagicMock()
+        kill_conn = q.engine.connect.return_value.__enter__.return_value
+        free = []
+        def probe():
+            if q.lock.acquire(timeout=1):
+                q.lock.release()
+                free.append(True)
+        def connect():
+            t = threading.Thread(target=probe)
+            t.start()
+            t.join()
+            return MagicMock(__enter__=MagicMock(return_value=kill_conn))
+        q.engine.connect.side_effect = connect
+        assert cancel.cancel('t3') is True
+        assert free == [True]
+        kill_conn.exec_driver_sql.assert_called_once_with('KILL QUERY 42')
+
+        q.cancelled = False
+        kill_conn.exec_driver_sql.reset_mock()
+        def returned():
+            q.clear()
+            return MagicMock(__enter__=MagicMock(return_value=kill_conn))
+        q.engine.connect.side_effect = returned
+        assert cancel.cancel('t3') is True
+        kill_conn.exec_driver_sql.assert_not_called()
+
+def test_cancel_not_running():
+    assert cancel.cancel('not-exists') is False
+    with cancel.running('t1') as q:
+        assert cancel.cancel('t1') is True
+        assert q.cancelled
+    assert cancel.cancel('t1') is False
+
+async def _settled(taskid, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = {t['taskid']: t for t in task.list_tasks()}
+        if info[taskid]['state'] != 'running':
+            return info
+        await asyncio.sleep(0.01)
+    raise TimeoutError(taskid)
+
+async def test_task_budget_and_ttl():
+    old = (task.task_ttl, task.task_max_bytes)
+    result = lambda dbid, n: {'columns': ['a'], 'data': [(i,) for i in range(n)]}
+    try:
+        task.set_task_limits(3600, 10000)
+        t1 = await task.create_query_task(result, 'db1', 1000)
+        await _settled(t1)
+        t2 = await task.create_query_task(result, 'db1', 1000)
+        info = await _settled(t2)
+        assert info[t2]['state'] == 'done'
+        assert 5000 < info[t2]['size'] < 10000
+        # over budget, the least recently used result is dropped
+        assert info[t1]['state'] == 'expired'
+        rc, data = await task.get_result(t1)
+        assert not rc
+        assert data == {'error': 'query result expired, please run it again'}
+
+        task.set_task_limits(0, 10000)
+        assert task.sweep() == 1
+        assert t2 not in task.task_dict
+    finally:
+        task.set_task_limits(*old)
+
+async def test_task_handler(jp_fetch):
+    taskid = await task.create_query_task(lambda dbid: {}, 'db1')
+    response = await jp_fetch("jupyterlab-sql-explorer", "tasks")
+    payload = json.loads(response.body)
+    info = [t for t in payload['data'] if t['taskid'] == taskid]
+    assert len(info) == 1
+    assert info[0]['dbid'] == 'db1'
+    assert info[0]['state'] == 'done'
+    await task.get_result(taskid)
+
+@patch("jupyterlab_sql_explorer.engine._getDbInfo")
+async def test_open_results_limit(mock_dbinfo, tmp_path):
+    mock_dbinfo.return_value={'db_id': 'opendb', 'db_type': engine.DB_SQLITE, 'db_name': str(tmp_path / 'open.db')}
+    task.set_query_limits(8, 1)
+    try:
+        sql = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x<100) SELECT x FROM c'
+        query = functools.partial(db.query_exec, page_size=10)
+        t1 = await task.create_query_task(query, 'opendb', sql)
+        ok, page = await task.get_result(t1)
+        assert ok and page['more']
+        # the open result holds the only slot of the connection
+        assert task.query_stats()['open'] == {'opendb': 1}
+
+        # a new query releases it (rows fetched so far are kept)
+        t2 = await task.create_query_task(query, 'opendb', 'SELECT 1')
+        ok, page = await task.get_result(t2)
+        assert ok and page['data'][0][0] == 1
+        ok, page = await task.get_page(t1, 0, 10)
+        assert ok and page['truncated'] and len(page['data']) == 10
+        for taskid in (t1, t2):
+            await task.delete(taskid)
+        assert task.query_stats()['open'] == {}
+    finally:
+        task.set_query_limits(8, 4)
+
+def test_call_blocking():
+    task.set_meta_executor(2, 0.1)
+    try:
+        assert task.call_blocking(sum, [1, 2]) == 3
+        with pytest.raises(TimeoutError):
+            task.call_blocking(time.sleep, 0.5)
+    finally:
+        task.set_meta_executor(8, 60)
@@ -1,5 +1,15 @@
+import json
 import pytest
-from .. import db
+import decimal
+import datetime
+import uuid
+from unittest.mock import MagicMock
+from .. import db, engine, limit
+from ..metacache import MetaCache
+from ..resultcache import ResultCache
+from ..search import SearchIndex
+from .. import serializer
+from ..serializer import make_row_serializable, serialize_rows, dumps, dumps_bytes, column_types, to_columnar, to_arrow
 
 def test_limit():
     sql = 'select * from aaa limit 200'
@@ -44,4 +54,160 @@ def test_limit():
 
     with pytest.raises(Exception):
         sql = 'select * from AAA limit x 10'
-        rc, sql1 = db.set_limit(sql, 200, 10000)
\ No newline at end of file
+        rc, sql1 = db.set_limit(sql, 200, 10000)
+
+def test_limit_dialects():
+    assert db.set_limit('select * from t limit 10 offset 5') == (True, 'select * from t  LIMIT 10 OFFSET 5')
+    assert db.set_limit('select * from t limit 5, 20000') == (True, 'select * from t  LIMIT 10000 OFFSET 5')
+    assert db.set_limit('select * from t limit 5, 10', dialect=engine.DB_HIVE_LDAP) == (True, 'select * from t  LIMIT 5, 10')
+    assert db.set_limit('select * from t', dialect=engine.DB_ORACLE) == (True, 'select * from t FETCH FIRST 200 ROWS ONLY')
+    assert db.set_limit('select * from t order by a offset 5 rows fetch next 20000 rows only', dialect=engine.DB_ORACLE) == \
+        (True, 'select * from t order by a  OFFSET 5 ROWS FETCH FIRST 10000 ROWS ONLY')
+    assert db.set_limit('select * from t fetch first 10 rows only', dialect=engine.DB_PGSQL) == (True, 'select * from t  LIMIT 10')
+    assert db.set_limit('select top 50000 * from t') == (True, 'select top 10000 * from t')
+    assert db.set_limit('select top (5) a from t') == (True, 'select top (5) a from t')
+    assert db.set_limit('with a as (select 1 limit 3) select * from a') == (True, 'with a as (select 1 limit 3) select * from a LIMIT 200')
+    assert db.set_limit('with a as (select 1) delete from b') == (True, 'with a as (select 1) delete from b')
+
+    # strings, comments and semicolons
+    assert db.set_limit("select 'a;b limit 5' from t;") == (True, "select 'a;b limit 5' from t LIMIT 200")
+    assert db.set_limit('select 1 -- limit 5') == (True, 'select 1 -- limit 5\n LIMIT 200')
+    assert db.set_limit('select offset from t') == (True, 'select offset from t LIMIT 200')
+    assert db.set_limit('select 1; select 2') == (False, 'can only process one statement')
+    assert db.set_limit('select 1; -- end') == (True, 'select 1 LIMIT 200')
+    # long statements are not cached
+    sql = 'select ' + ', '.join(f'c{i}' for i in range(2000)) + ' from t'
+    info = limit._cached_set_limit.cache_info()
+    assert db.set_limit(sql) == (True, sql + ' LIMIT 200')
+    assert limit._cached_set_limit.cache_info() == info
+
+def test_meta_cache():
+    c = MetaCache(ttl=300, max_size=2)
+    load = MagicMock(return_value=[{'name': 't1'}])
+    assert c.get(('db1', 'tables', None), load) == [{'name': 't1'}]
+    assert c.get(('db1', 'tables', None), load) == [{'name': 't1'}]
+    assert load.call_count == 1
+
+    c.get(('db1', 'tables', None), load, refresh=True)
+    assert load.call_count == 2
+
+    c.get(('db1', 'columns', 's1', 't1'), load)
+    c.get(('db2', 'tables', None), load)
+    assert len(c) == 2
+    assert c.peek(('db1', 'tables', None)) is None
+
+    c.invalidate('db2')
+    assert c.peek(('db2', 'tables', None)) is None
+    assert c.peek(('db1', 'columns', 's1', 't1')) is not None
+
+    # replace updates cached keys only
+    c.replace(('db1', 'columns', 's1', 't1'), [{'name': 'c2'}])
+    c.replace(('db3', 'tables', None), [{'name': 't3'}])
+    assert c.peek(('db1', 'columns', 's1', 't1')) == [{'name': 'c2'}]
+    assert c.peek(('db3', 'tables', None)) is None and len(c) == 1
+
+    c.ttl = 0
+    c.get(('db1', 'tables', None), load)
+    assert c.peek(('db1', 'tables', None)) is None
+
+def test_result_format():
+    rows = [(1, None, 'a'), (2, decimal.Decimal('1.5'), None)]
+    assert column_types(rows) == ['int', 'decimal', 'string']
+    assert column_types([(None,)]) == ['null']
+
+    result = {'columns': ['a', 'b', 'c'], 'data': [make_row_serializable(r) for r in rows], 'more': False}
+    assert to_columnar(result) == {
+        'columns': ['a', 'b', 'c'],
+        'data': [[1, 2], [None, '1.5'], ['a', None]],
+        'more': False,
+        'format': 'columns'
+    }
+    assert to_columnar({'columns': ['a'], 'data': []})['data'] == [[]]
+
+def test_result_arrow():
+    pa = pytest.importorskip('pyarrow')
+    result = {'columns': ['a', 'b'], 'data': [(1, 'x'), (2, 3)], 'total': 2}
+    table = pa.ipc.open_stream(to_arrow(result)).read_all()
+    assert table.column_names == ['a', 'b']
+    assert table.column('a').to_pylist() == [1, 2]
+    # mixed types are encoded as string
+    assert table.column('b').to_pylist() == ['x', '3']
+    assert table.schema.metadata[b'total'] == b'2'
+
+def test_serialize_rows():
+    t = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    u = uuid.UUID(int=1)
+    rows = [
+        (1, None, t, decimal.Decimal('1.5'), u, [t]),
+        (2, 'a', datetime.date(2024, 1, 2), 7, None, None),
+    ]
+    assert serialize_rows(rows) == [make_row_serializable(r) for r in rows]
+    assert serialize_rows([(1, 'a')]) == [(1, 'a')]
+    assert serialize_rows([]) == []
+
+    # column decided as int by the first value
+    assert dumps(serialize_rows([(1,), (decimal.Decimal('2.5'),)])) == '[[1], ["2.5"]]'
+    # mixed type column: values of another type than planned go to the dispatcher
+    assert serialize_rows([(t, 1), ('x', 2), (None, 3)]) == [(str(t), 1), ('x', 2), (None, 3)]
+
+def test_dumps_bytes(monkeypatch):
+    obj = {'data': [[1, datetime.datetime(2023, 1, 2, 3, 4, 5)], [decimal.Decimal('2.5'), 'x']]}
+    expect = json.loads(dumps(obj))
+    assert json.loads(dumps_bytes(obj)) == expect
+    monkeypatch.setattr(serializer, 'orjson', None)
+    assert json.loads(dumps_bytes(obj)) == expect
+
+def test_result_cache():
+    cache = ResultCache(ttl=60, max_bytes=100)
+    cache.put(('db1', None, 'a'), 'A', 40)
+    cache.put(('db1', None, 'b'), 'B', 40)
+    assert cache.get(('db1', None, 'a'))[0] == 'A'
+    # over size, lru (b) is dropped
+    cache.put(('db2', None, 'c'), 'C', 40)
+    assert cache.get(('db1', None, 'b')) is None
+    assert cache.bytes == 80
+    # too large or no ttl
+    cache.put(('db2', None, 'd'), 'D', 200)
+    cache.put(('db2', None, 'e'), 'E', 10, ttl=0)
+    assert len(cache) == 2
+    cache.invalidate('db1')
+    assert cache.get(('db1', None, 'a')) is None
+    assert cache.stats()['entries'] == 1 and cache.bytes == 40
+
+def test_cache_key():
+    assert db._cache_key('d', None, 'select  a -- x\n from\tT where b = \'x  y\';') == \
+        db._cache_key('d', None, "SELECT a FROM T WHERE b = 'x  y'")
+    assert db._cache_key('d', None, "select 'a'") != db._cache_key('d', None, "select 'A'")
+    assert db._cache_key('d', None, 'delete from T') is None
+    assert db._cache_key('d', None, 'select 1; select 2') is None
+    assert db._cache_key('d', None, 'select ' + 'a, ' * limit.CACHE_MAX_SQL + '1') is None
+    assert db._cache_key('d', None, 'with t as (select 1) select * from t') is not None
+    assert db._is_ddl('select 1; create table x (a int)')
+    assert not db._is_ddl('with t as (select 1) insert into x select * from t')
+
+def test_search_index():
+    idx = SearchIndex()
+    idx.update((), [{'name': 'sales', 'type': 'db', 'desc': ''}, {'name': 'hr', 'type': 'db', 'desc': 'People'}])
+    idx.update(('sales',), [{'name': 'Orders', 'type': 'table', 'desc': 'customer orders'},
+                            {'name': 'order_items', 'type': 'table', 'desc': ''}])
+    idx.update(('sales', 'Orders'), [{'name': 'id', 'type': 'col', 'desc': ''},
+                                     {'name': 'order_date', 'type': 'col', 'desc': None}])
+
+    names = lambda q, **kw: [(r['name'], r['path']) for r in idx.search(q, **kw)]
+    # exact, prefix (tables before columns), substring, comment
+    assert names('orders') == [('Orders', ['sales', 'Orders'])]
+    assert names('ORDER') == [('Orders', ['sales', 'Orders']), ('order_items', ['sales', 'order_items']),
+                              ('order_date', ['sales', 'Orders', 'order_date'])]
+    assert names('date') == [('order_date', ['sales', 'Orders', 'order_date'])]
+    assert names('people') == [('hr', ['hr'])]
+    assert names('order', limit=1) == [('Orders', ['sales', 'Orders'])]
+    assert names('order', kind='col') == [('order_date', ['sales', 'Orders', 'order_date'])]
+    assert names('nothing') == []
+
+    idx.set_desc(('sales', 'Orders', 'id'), 'primary key')
+    assert names('primary') == [('id', ['sales', 'Orders', 'id'])]
+
+    # schema dropped: its tables and columns are removed
+    idx.update((), [{'name': 'hr', 'type': 'db', 'desc': 'People'}])
+    assert len(idx) == 1
+    assert names('order') == []
@@ -8,7 +8,8 @@ import {
   IQueryRes,
   IDBConn,
   IComment,
-  IParam
+  IParam,
+  ITableData
 } from './interfaces';
 
 /**
@@ -54,7 +55,7 @@ export async function requestAPI<T>(
       if (data.error === 'NEED-PASS') {
         data = { status: 'NEED-PASS', pass_info: data.pass_info };
       } else if (data.error === 'RETRY') {
-        data = { status: 'RETRY', data: data.data };
+        data = { status: 'RETRY', data: data.data, queue: data.queue };
       } else {
         data = { status: 'ERR', message: data.error };
       }
@@ -143,23 +144,37 @@ export const load_tree_root = async (): Promise<ITreeCmdRes> => {
   return await load_db_tree('conns', {});
 };
 
-export const load_tree_db_node = async (dbid: string): Promise<ITreeCmdRes> => {
-  return await load_db_tree('dbtables', { dbid });
+export const load_tree_db_node = async (
+  dbid: string,
+  refresh = false
+): Promise<ITreeCmdRes> => {
+  return await load_db_tree('dbtables', { dbid, refresh: refresh ? '1' : '0' });
 };
 
 export const load_tree_table_node = async (
   dbid: string,
-  db: string
+  db: string,
+  refresh = false
 ): Promise<ITreeCmdRes> => {
-  return await load_db_tree('dbtables', { dbid, db });
+  return await load_db_tree('dbtables', {
+    dbid,
+    db,
+    refresh: refresh ? '1' : '0'
+  });
 };
 
 export const load_tree_col_node = async (
   dbid: string,
   db: string,
-  tbl: string
+  tbl: string,
+  refresh = false
 ): Promise<ITreeCmdRes> => {
-  return await load_db_tree('columns', { dbid, db, tbl });
+  return await load_db_tree('columns', {
+    dbid,
+    db,
+    tbl,
+    refresh: refresh ? '1' : '0'
+  });
 };
 
 export const edit_conn = async (conn: IDBConn): Promise<IApiRes<any>> => {
@@ -188,16 +203,95 @@ export const query = async (
   sql: string,
   dbid: string,
   schema?: string,
-  options?: RequestInit
+  options?: RequestInit,
+  page_size?: number
 ): Promise<IQueryRes> => {
-  return await POST('query', { sql, dbid }, options);
+  return await POST('query', { sql, dbid, page_size: page_size || 0 }, options);
+};
+
+/**
+ * run the statements of a script one by one on one connection (in one
+ * transaction if set), wait for the result with get_query, results of
+ * completed statements can be read before with get_script_results
+ */
+export const run_script = async (
+  sql: string,
+  dbid: string,
+  transaction = false
+): Promise<IQueryRes> => {
+  return await POST('query', { sql, dbid, script: true, transaction });
+};
+
+export const get_script_results = async (
+  taskid: string,
+  since = 0
+): Promise<IApiRes<any>> => {
+  return await GET('script', { taskid, since: since.toString() });
+};
+
+/**
+ * search schemas, tables and columns of a connection by name or comment,
+ * best matches first
+ */
+export const search_objects = async (
+  dbid: string,
+  q: string,
+  limit = 50
+): Promise<IApiRes<any>> => {
+  return await GET('search', { dbid, q, limit: limit.toString() });
+};
+
+/**
+ * list the whole connection in background to index it for search
+ */
+export const build_search_index = async (
+  dbid: string
+): Promise<IApiRes<any>> => {
+  return await POST('search', { dbid });
+};
+
+export const get_result_page = async (
+  taskid: string,
+  offset: number,
+  size: number
+): Promise<IQueryRes> => {
+  return columns_to_rows(
+    await GET('result', {
+      taskid,
+      offset: offset.toString(),
+      size: size.toString(),
+      format: 'columns'
+    })
+  );
+};
+
+/**
+ * results are transferred column by column (smaller and faster to parse),
+ * convert them back to rows for the table
+ */
+const columns_to_rows = (rc: IQueryRes): IQueryRes => {
+  if (rc && rc.status === 'OK' && rc.data && typeof rc.data === 'object') {
+    const data = rc.data as ITableData;
+    if (data.format === 'columns') {
+      const cols = data.data;
+      const nrow = cols.length > 0 ? cols[0].length : 0;
+      const rows = new Array(nrow);
+      for (let i = 0; i < nrow; i++) {
+        rows[i] = cols.map(c => c[i]);
+      }
+      rc.data = { ...data, data: rows, format: 'rows' };
+    }
+  }
+  return rc;
 };
 
 export const get_query = async (
   taskid: string,
   options?: RequestInit
 ): Promise<IQueryRes> => {
-  return await GET('query', { taskid }, options);
+  return columns_to_rows(
+    await GET('query', { taskid, format: 'columns' }, options)
+  );
 };
 
 export const stop_query = async (taskid: string): Promise<IQueryRes> => {
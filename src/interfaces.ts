@@ -56,13 +56,23 @@ export interface ITreeCmdRes {
 
 export interface ITableData {
   columns: Array<string>;
+  types?: Array<string>;
   data: Array<Array<any>>;
+  format?: 'rows' | 'columns';
+  // for paged result
+  offset?: number;
+  more?: boolean;
+  total?: number | null;
+  truncated?: boolean;
+  // age (seconds) of the cached result it is served from
+  cached?: number;
 }
 
 export interface IQueryRes {
   status: TApiStatus;
   data?: ITableData | string;
   message?: string;
+  queue?: number; // if status is RETRY, position in server wait queue (0: running)
   pass_info?: IPass; // if status if NEED_PASS,
 }
 
@@ -8,6 +8,7 @@ import {
   clear_pass,
   query,
   get_query,
+  get_result_page,
   stop_query,
   edit_conn,
   del_conn,
@@ -20,7 +21,8 @@ import {
   TApiStatus,
   IQueryRes,
   IDBConn,
-  IComment
+  IComment,
+  ITableData
 } from './interfaces';
 
 let sqlModelInst: SqlModel;
@@ -63,6 +65,8 @@ export class SqlModel {
       }
     }
     pptr.next = false;
+    // reload from database, not from server side cache
+    this._stale.add(pptr);
     return;
   }
 
@@ -106,15 +110,16 @@ export class SqlModel {
         if (cur_list[i].name === p.name) {
           if (cur_list[i].next === false || !('next' in cur_list[i])) {
             let res!: ITreeCmdRes;
+            const refresh = this._stale.delete(cur_list[i]);
             if (p.type === 'conn') {
-              res = await load_tree_db_node(dbid);
+              res = await load_tree_db_node(dbid, refresh);
             }
             if (p.type === 'db') {
-              res = await load_tree_table_node(dbid, db);
+              res = await load_tree_table_node(dbid, db, refresh);
               console.log(res);
             }
             if (p.type === 'table') {
-              res = await load_tree_col_node(dbid, db, tbl);
+              res = await load_tree_col_node(dbid, db, tbl, refresh);
             }
             if (res.status === 'NEED-PASS') {
               // send as signal to triger passwd input
@@ -258,6 +263,7 @@ export class SqlModel {
   }
 
   private _item_list: IDbItem[] = [];
+  private _stale = new Set<IDbItem>();
   private _need_passwd = new Signal<SqlModel, IPass>(this);
   private _passwd_settled = new Signal<SqlModel, string>(this);
   private _conn_changed = new Signal<SqlModel, string>(this);
@@ -278,6 +284,7 @@ export interface IQueryModel {
   dbid: string;
   schema?: string;
   query: (sql: string) => Promise<IQueryRes>;
+  fetch_page: (offset: number) => Promise<ITableData | undefined>;
   conns: Array<string>;
   isConnReadOnly: boolean;
   stop: () => void;
@@ -285,6 +292,11 @@ export interface IQueryModel {
   query_finish: ISignal<IQueryModel, IQueryStatus>;
 }
 
+/**
+ * rows of a page of query result
+ */
+const PAGE_SIZE = 500;
+
 export interface IQueryModelOptions {
   dbid?: string;
   schema?: string;
@@ -311,11 +323,15 @@ export class QueryModel implements IQueryModel {
       this._query_finish.emit(st);
       return { status: 'ERR' };
     }
+    if (this._taskid) {
+      // release the result of last query on server
+      stop_query(this._taskid);
+    }
     this._running = true;
     this._controller = new AbortController();
     this._query_begin.emit();
     const options = { signal: this._controller.signal };
-    let rc = await query(sql, this.dbid, this.schema, options);
+    let rc = await query(sql, this.dbid, this.schema, options, PAGE_SIZE);
     if (rc.status === 'NEED-PASS') {
       // send as signal to triger passwd input
       getSqlModel().need_passwd.emit(rc.pass_info as IPass);
@@ -337,6 +353,17 @@ export class QueryModel implements IQueryModel {
     return rc;
   }
 
+  fetch_page = async (offset: number): Promise<ITableData | undefined> => {
+    if (!this._taskid) {
+      return;
+    }
+    const rc = await get_result_page(this._taskid, offset, PAGE_SIZE);
+    if (rc.status !== 'OK') {
+      return;
+    }
+    return rc.data as ITableData;
+  };
+
   get conns(): Array<string> {
     const model = getSqlModel();
     return model.get_list([]).map(o => o.name);
@@ -2,7 +2,12 @@ import { Widget } from '@lumino/widgets';
 
 import { IDisposable } from '@lumino/disposable';
 
-import { Table, TableDataModel } from './Table';
+import {
+  Table,
+  TableDataModel,
+  PagedTableDataModel,
+  PageLoader
+} from './Table';
 
 export class ResultsTable implements IDisposable {
   constructor(keys: Array<string>, data: Array<Array<any>>) {
@@ -18,8 +23,16 @@ export class ResultsTable implements IDisposable {
     this._table.theme = theme;
   }
 
-  setData(keys: Array<string>, data: Array<Array<any>>): void {
-    this._model = new TableDataModel(keys, data);
+  setData(
+    keys: Array<string>,
+    data: Array<Array<any>>,
+    loader?: PageLoader,
+    more = false
+  ): void {
+    this._model =
+      loader && more
+        ? new PagedTableDataModel(keys, data, more, loader)
+        : new TableDataModel(keys, data);
     this._table.dataModel = this._model;
   }
 
@@ -7,6 +7,7 @@ import {
 import { CommandRegistry } from '@lumino/commands';
 import { copyIcon } from '@jupyterlab/ui-components';
 import { Menu } from '@lumino/widgets';
+import { ITableData } from '../interfaces';
 
 import {
   DataModel,
@@ -162,10 +163,71 @@ export class TableDataModel extends DataModel {
   }
 }
 
+/**
+ * load rows from offset, undefined if failed
+ */
+export type PageLoader = (offset: number) => Promise<ITableData | undefined>;
+
+/**
+ * Table data of a paged result, next page is loaded when the grid shows the last rows.
+ */
+export class PagedTableDataModel extends TableDataModel {
+  constructor(
+    keys: Array<string>,
+    data: Array<Array<any>>,
+    more: boolean,
+    loader: PageLoader
+  ) {
+    super(keys, data);
+    this._more = more;
+    this._loader = loader;
+  }
+
+  data(region: DataModel.CellRegion, row: number, column: number): any {
+    if (
+      region === 'body' &&
+      this._more &&
+      !this._loading &&
+      row >= this._data.length - Private.PREFETCH_ROWS
+    ) {
+      void this._loadMore();
+    }
+    return super.data(region, row, column);
+  }
+
+  private async _loadMore(): Promise<void> {
+    this._loading = true;
+    const page = await this._loader(this._data.length);
+    this._loading = false;
+    if (!page || page.data.length === 0) {
+      this._more = false;
+      return;
+    }
+    const index = this._data.length;
+    this._data.push(...page.data);
+    this._more = !!page.more;
+    this.emitChanged({
+      type: 'rows-inserted',
+      region: 'body',
+      index,
+      span: page.data.length
+    });
+  }
+
+  private _more: boolean;
+  private _loading = false;
+  private readonly _loader: PageLoader;
+}
+
 /**
  * A namespace for private data.
  */
 namespace Private {
+  /**
+   * load next page when the grid shows rows this close to the end
+   */
+  export const PREFETCH_ROWS = 100;
+
   /**
    * The light theme for the data grid.
    */
@@ -155,7 +155,12 @@ export class SqlConsoleWidget extends SplitPanel {
     this._is_running = false;
     if (rc.status === 'OK' && rc.data !== undefined) {
       const data = rc.data as ITableData;
-      this.resultsTable.setData(data.columns, data.data);
+      this.resultsTable.setData(
+        data.columns,
+        data.data,
+        this.queryModel.fetch_page,
+        !!data.more
+      );
     }
   };
 